@@ -0,0 +1,119 @@
+# agenda.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'AGENDA DEGLI APPUNTAMENTI
+# Appuntamenti di un intervallo di date qualsiasi (lettura a intervallo
+# sull'indice di Appuntamento.dataOra) e carico per ora/giorno/settimana
+# calcolato in SQL. La settimana corrente è tenuta in memoria e aggiornata
+# a ogni appuntamento aggiunto o eliminato dal menu, senza rileggerla.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import bisect
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+import queries
+
+
+# Inizio della settimana (lunedì alle 00:00) che contiene il giorno indicato.
+def inizio_settimana(giorno: datetime | None = None) -> datetime:
+    giorno = giorno or datetime.now()
+    return datetime(giorno.year, giorno.month, giorno.day) - timedelta(days=giorno.weekday())
+
+# Stessa etichetta calcolata in SQL da queries.inizio_intervallo.
+def intervallo(data_ora: datetime, granularita: str) -> str:
+    if granularita == "ora":
+        return data_ora.strftime("%Y-%m-%d %H:00")
+    if granularita == "giorno":
+        return data_ora.strftime("%Y-%m-%d")
+    if granularita == "settimana":
+        return inizio_settimana(data_ora).strftime("%Y-%m-%d")
+    raise ValueError(f"Granularità non valida: {granularita}")
+
+# Appuntamenti con dataOra in [da, a): lista di (idAppuntamento, dataOra, idRiparazione).
+def appuntamenti(conn, meta, da: datetime, a: datetime) -> list[tuple]:
+    return [tuple(r) for r in queries.esegui(conn, meta, "q_agenda_appuntamenti", da=da, a=a)]
+
+# Numero di appuntamenti per intervallo in [da, a): lista di (intervallo, appuntamenti).
+def carico(conn, meta, da: datetime, a: datetime, granularita: str = "giorno") -> list[tuple]:
+    if granularita not in queries.GRANULARITA:
+        raise ValueError(f"Granularità non valida: {granularita}")
+    return [tuple(r) for r in queries.esegui(conn, meta, f"q_agenda_carico_{granularita}", da=da, a=a)]
+
+
+# Agenda della settimana corrente: appuntamenti e conteggi per ogni granularità,
+# letti una volta dal database e poi aggiornati in memoria.
+class SettimanaCorrente:
+    def __init__(self):
+        self.inizio: datetime | None = None
+        self.fine: datetime | None = None
+        self._righe: list[tuple] = []   # (dataOra, idRiparazione, idAppuntamento), ordinate
+        self._carico: dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    # Indica se i dati in memoria sono quelli della settimana in corso.
+    def aggiornata(self, adesso: datetime | None = None) -> bool:
+        adesso = adesso or datetime.now()
+        return self.inizio is not None and self.inizio <= adesso < self.fine
+
+    # Legge dal database gli appuntamenti e i conteggi della settimana in corso.
+    def carica(self, conn, meta, adesso: datetime | None = None):
+        inizio = inizio_settimana(adesso)
+        fine = inizio + timedelta(days=7)
+        righe = sorted((d, r, i) for i, d, r in appuntamenti(conn, meta, inizio, fine))
+        conteggi = {g: Counter(dict(carico(conn, meta, inizio, fine, g))) for g in queries.GRANULARITA}
+        with self._lock:
+            self.inizio, self.fine = inizio, fine
+            self._righe = righe
+            self._carico = conteggi
+
+    # Garantisce che i dati in memoria siano quelli della settimana in corso.
+    def prepara(self, conn, meta):
+        if not self.aggiornata():
+            self.carica(conn, meta)
+
+    # Appuntamenti della settimana: lista di (idAppuntamento, dataOra, idRiparazione).
+    def appuntamenti(self) -> list[tuple]:
+        with self._lock:
+            return [(i, d, r) for d, r, i in self._righe]
+
+    # Conteggi della settimana: lista di (intervallo, appuntamenti) ordinata.
+    def carico(self, granularita: str = "giorno") -> list[tuple]:
+        with self._lock:
+            return sorted((k, n) for k, n in self._carico.get(granularita, {}).items() if n > 0)
+
+    # Registra un appuntamento appena inserito (dopo il commit).
+    def aggiungi(self, id_appuntamento, data_ora: datetime, id_riparazione):
+        with self._lock:
+            if self.inizio is None or not (self.inizio <= data_ora < self.fine):
+                return
+            bisect.insort(self._righe, (data_ora, id_riparazione, id_appuntamento))
+            for g in queries.GRANULARITA:
+                self._carico.setdefault(g, Counter())[intervallo(data_ora, g)] += 1
+
+    # Toglie gli appuntamenti delle riparazioni eliminate (dopo il commit).
+    def rimuovi_riparazioni(self, id_riparazioni):
+        ids = set(id_riparazioni)
+        with self._lock:
+            tolte = [riga for riga in self._righe if riga[1] in ids]
+            if not tolte:
+                return
+            self._righe = [riga for riga in self._righe if riga[1] not in ids]
+            for data_ora, _r, _i in tolte:
+                for g in queries.GRANULARITA:
+                    self._carico[g][intervallo(data_ora, g)] -= 1
+
+
+settimana = SettimanaCorrente()
+
+
+# Agenda di un intervallo: (appuntamenti, carico). La settimana corrente
+# viene servita dalla memoria, gli altri intervalli dal database.
+def agenda(conn, meta, da: datetime | None = None, a: datetime | None = None, granularita: str = "giorno"):
+    if da is None and a is None:
+        settimana.prepara(conn, meta)
+        da, a = settimana.inizio, settimana.fine
+    if settimana.aggiornata() and (da, a) == (settimana.inizio, settimana.fine):
+        return settimana.appuntamenti(), settimana.carico(granularita)
+    return appuntamenti(conn, meta, da, a), carico(conn, meta, da, a, granularita)
@@ -0,0 +1,308 @@
+# archivio.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'ARCHIVIAZIONE DELLE RIPARAZIONI CHIUSE
+# Sposta le riparazioni chiuse prima di una data (Riparazione.dataChiusura),
+# insieme a tutte le righe che dipendono da loro, in tabelle di archivio con
+# le stesse colonne (prefisso ARCHIVIO_PREFISSO, es. ArchivioRiparazione).
+#
+#   - le tabelle dipendenti e l'ordine si ricavano dalle FK del MetaData
+#     riflesso: Appuntamento, Intervento, Preventivo -> DettaglioPreventivo,
+#     Pagamento -> DocumentoFiscale, Garanzia, ... senza elenchi scritti a mano
+#   - a blocchi di ARCHIVIO_BLOCCO riparazioni: ogni blocco è una transazione
+#     con un INSERT ... SELECT per tabella (padri prima) e un DELETE per tabella
+#     (figli prima), così i lock durano poco
+#   - l'avanzamento (ultimo id archiviato) è salvato nella stessa transazione
+#     del blocco: un lavoro interrotto riprende da dove era arrivato
+#
+# Uso: python archivio.py --prima 2023-01-01 [--blocco 500] [--elimina] [--simula]
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime,
+    select, insert, update, delete, func, bindparam, or_, tuple_,
+)
+import chiavi
+from database import engine
+from schema_reflect import schema_riflesso, controllo_tabelle_richieste
+
+# Riparazioni spostate per ogni transazione.
+ARCHIVIO_BLOCCO = int(os.getenv("ARCHIVIO_BLOCCO", "500"))
+
+# Prefisso delle tabelle di archivio.
+ARCHIVIO_PREFISSO = os.getenv("ARCHIVIO_PREFISSO", "Archivio")
+
+RADICE = "Riparazione"
+
+_meta_avanzamento = MetaData()
+
+# Avanzamento dei lavori di archiviazione: uno per data limite e modo.
+ArchivioAvanzamento = Table(
+    "ArchivioAvanzamento", _meta_avanzamento,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("prima", DateTime, nullable=False),
+    Column("modo", String(20), nullable=False),
+    Column("ultimoId", Integer, nullable=False),
+    Column("riparazioni", Integer, nullable=False),
+    Column("righe", Integer, nullable=False),
+    Column("iniziato", DateTime, nullable=False),
+    Column("aggiornato", DateTime, nullable=False),
+    Column("completato", DateTime),
+)
+
+
+# -------------------------
+# DIPENDENZE DALLE FK
+# -------------------------
+
+# Tabelle che dipendono (direttamente o a catena) dalla radice, in ordine
+# padri -> figli. Ritorna [(tabella, [vincoli FK verso tabelle già incluse])];
+# la radice ha la lista vuota. Le FK di una tabella verso sé stessa si ignorano.
+def dipendenze(meta, radice: str = RADICE) -> list[tuple[Table, list]]:
+    def vincoli(t, incluse):
+        return [fk for fk in t.foreign_key_constraints
+                if fk.referred_table.name in incluse and fk.referred_table is not t]
+
+    incluse = {radice}
+    cambiato = True
+    while cambiato:
+        cambiato = False
+        for t in meta.sorted_tables:
+            if t.name not in incluse and vincoli(t, incluse):
+                incluse.add(t.name)
+                cambiato = True
+    return [
+        (t, [] if t.name == radice else vincoli(t, incluse))
+        for t in meta.sorted_tables if t.name in incluse
+    ]
+
+# Condizione "la riga appartiene a una delle riparazioni del blocco" per ogni
+# tabella: sulla radice IN (:id_riparazioni), sulle altre IN (SELECT ...) lungo
+# le FK (in OR se una tabella ha più FK verso l'insieme).
+def condizioni(meta, radice: str = RADICE) -> dict[str, object]:
+    Radice = meta.tables[radice]
+    pk = list(Radice.primary_key.columns)[0]
+    cond = {radice: pk.in_(bindparam("id_riparazioni", expanding=True))}
+    for t, vincoli in dipendenze(meta, radice):
+        if t.name == radice:
+            continue
+        parti = []
+        for fk in vincoli:
+            locali = [e.parent for e in fk.elements]
+            remote = [e.column for e in fk.elements]
+            sotto = select(*remote).where(cond[fk.referred_table.name])
+            if len(locali) == 1:
+                parti.append(locali[0].in_(sotto))
+            else:
+                parti.append(tuple_(*locali).in_(sotto))
+        cond[t.name] = or_(*parti) if len(parti) > 1 else parti[0]
+    return cond
+
+# Tabella di archivio con le stesse colonne e la stessa PK, senza FK né default.
+def tabella_archivio(meta_archivio, t: Table) -> Table:
+    nome = ARCHIVIO_PREFISSO + t.name
+    if nome in meta_archivio.tables:
+        return meta_archivio.tables[nome]
+    return Table(
+        nome, meta_archivio,
+        *[Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+          for c in t.columns],
+    )
+
+
+# -------------------------
+# LAVORO DI ARCHIVIAZIONE
+# -------------------------
+
+class Archiviazione:
+    # prima: data limite (si archiviano le riparazioni con dataChiusura < prima)
+    # modo: "archivia" (copia in archivio e cancella) o "elimina" (solo cancella)
+    def __init__(self, meta, prima: datetime, modo: str = "archivia", blocco: int = ARCHIVIO_BLOCCO):
+        if modo not in ("archivia", "elimina"):
+            raise ValueError(f"Modo non valido: {modo}")
+        self.meta = meta
+        self.prima = prima
+        self.modo = modo
+        self.blocco = blocco
+        self.tabelle = dipendenze(meta)
+        self.Radice = meta.tables[RADICE]
+        self.pk = list(self.Radice.primary_key.columns)[0]
+        cond = condizioni(meta)
+        self.meta_archivio = MetaData()
+        self.archivi = {t.name: tabella_archivio(self.meta_archivio, t) for t, _ in self.tabelle}
+        # INSERT ... SELECT padri prima, DELETE figli prima
+        self.copie = [
+            (t.name, insert(self.archivi[t.name]).from_select([c.name for c in t.columns],
+                                                             select(*t.columns).where(cond[t.name])))
+            for t, _ in self.tabelle
+        ]
+        self.cancellazioni = [(t.name, delete(t).where(cond[t.name])) for t, _ in reversed(self.tabelle)]
+        self.conteggi = {t.name: select(func.count()).select_from(t).where(cond[t.name]) for t, _ in self.tabelle}
+
+    def _da_archiviare(self):
+        return self.Radice.c.dataChiusura < self.prima
+
+    # Prepara tabelle di archivio, avanzamento e sequenze delle chiavi.
+    # Ritorna la riga di avanzamento da cui ripartire (un lavoro non completato
+    # con la stessa data limite e lo stesso modo) oppure ne crea una nuova.
+    def prepara(self, conn) -> dict:
+        _meta_avanzamento.create_all(conn, checkfirst=True)
+        if self.modo == "archivia":
+            self.meta_archivio.create_all(conn, checkfirst=True)
+        # le sequenze di chiavi.py devono esistere prima di togliere le righe con
+        # gli id più alti, altrimenti verrebbero inizializzate da un MAX() più basso
+        for t, _ in self.tabelle:
+            pks = list(t.primary_key.columns)
+            if len(pks) == 1 and isinstance(pks[0].type, Integer):
+                chiavi.allocatore.riserva(t, pks[0].name, 0, conn=conn)
+
+        riga = conn.execute(
+            select(ArchivioAvanzamento)
+            .where(ArchivioAvanzamento.c.prima == self.prima, ArchivioAvanzamento.c.modo == self.modo,
+                   ArchivioAvanzamento.c.completato.is_(None))
+            .order_by(ArchivioAvanzamento.c.id.desc())
+        ).mappings().first()
+        if riga is not None:
+            return dict(riga)
+        adesso = datetime.now()
+        valori = {"prima": self.prima, "modo": self.modo, "ultimoId": 0, "riparazioni": 0, "righe": 0,
+                  "iniziato": adesso, "aggiornato": adesso, "completato": None}
+        valori["id"] = conn.execute(insert(ArchivioAvanzamento).values(**valori)).inserted_primary_key[0]
+        return valori
+
+    # Riparazioni ancora da archiviare (dopo l'ultimo id già fatto).
+    def rimanenti(self, conn, dopo: int = 0) -> int:
+        return conn.execute(
+            select(func.count()).select_from(self.Radice)
+            .where(self._da_archiviare(), self.pk > dopo)
+        ).scalar_one()
+
+    # Righe coinvolte per tabella, senza modificare nulla.
+    def simula(self, conn) -> dict[str, int]:
+        ids = conn.execute(select(self.pk).where(self._da_archiviare())).scalars().all()
+        totali = {t.name: 0 for t, _ in self.tabelle}
+        for i in range(0, len(ids), self.blocco):
+            parte = {"id_riparazioni": ids[i:i + self.blocco]}
+            for nome, stmt in self.conteggi.items():
+                totali[nome] += conn.execute(stmt, parte).scalar_one()
+        return totali
+
+    # Sposta un blocco di riparazioni in una transazione. Le riparazioni del
+    # blocco sono lette con FOR UPDATE (dove supportato): una riparazione
+    # riaperta nel frattempo non viene archiviata a metà.
+    # Ritorna (ultimo id, riparazioni, righe per tabella); riparazioni 0 = finito.
+    def blocco_successivo(self, conn, avanzamento: dict) -> tuple[int, int, dict[str, int]]:
+        ids = conn.execute(
+            select(self.pk)
+            .where(self._da_archiviare(), self.pk > avanzamento["ultimoId"])
+            .order_by(self.pk)
+            .limit(self.blocco)
+            .with_for_update()
+        ).scalars().all()
+        if not ids:
+            return avanzamento["ultimoId"], 0, {}
+        parte = {"id_riparazioni": ids}
+        righe = {}
+        if self.modo == "archivia":
+            for nome, stmt in self.copie:
+                righe[nome] = conn.execute(stmt, parte).rowcount
+        for nome, stmt in self.cancellazioni:
+            n = conn.execute(stmt, parte).rowcount
+            if self.modo == "elimina":
+                righe[nome] = n
+            elif n != righe[nome]:
+                raise RuntimeError(f"{nome}: archiviate {righe[nome]} righe ma cancellate {n}")
+        totale = sum(righe.values())
+        conn.execute(
+            update(ArchivioAvanzamento).where(ArchivioAvanzamento.c.id == avanzamento["id"]).values(
+                ultimoId=ids[-1],
+                riparazioni=ArchivioAvanzamento.c.riparazioni + len(ids),
+                righe=ArchivioAvanzamento.c.righe + totale,
+                aggiornato=datetime.now(),
+            )
+        )
+        return ids[-1], len(ids), righe
+
+    # Esegue (o riprende) il lavoro fino alla fine. avanzamento(stat) viene
+    # chiamata dopo ogni blocco. Ritorna le statistiche finali.
+    def esegui(self, eng=None, avanzamento=None) -> dict:
+        eng = eng or engine
+        with eng.begin() as conn:
+            stato = self.prepara(conn)
+            da_fare = self.rimanenti(conn, stato["ultimoId"])
+        stat = {
+            "ripreso": stato["ultimoId"] > 0, "riparazioni": 0, "da_fare": da_fare, "blocchi": 0,
+            "righe": {t.name: 0 for t, _ in self.tabelle}, "secondi": 0.0, "blocco_max_s": 0.0,
+        }
+        t0 = time.perf_counter()
+        while True:
+            t_blocco = time.perf_counter()
+            with eng.begin() as conn:
+                ultimo, n, righe = self.blocco_successivo(conn, stato)
+                if n == 0:
+                    conn.execute(
+                        update(ArchivioAvanzamento).where(ArchivioAvanzamento.c.id == stato["id"])
+                        .values(completato=datetime.now())
+                    )
+            if n == 0:
+                break
+            stato["ultimoId"] = ultimo
+            stat["riparazioni"] += n
+            stat["blocchi"] += 1
+            for nome, k in righe.items():
+                stat["righe"][nome] += k
+            stat["blocco_max_s"] = max(stat["blocco_max_s"], time.perf_counter() - t_blocco)
+            stat["secondi"] = time.perf_counter() - t0
+            if avanzamento:
+                avanzamento(stat)
+        stat["secondi"] = time.perf_counter() - t0
+        return stat
+
+
+# Riga di avanzamento stampata dopo ogni blocco.
+def stampa_avanzamento(stat: dict):
+    fatte, totale = stat["riparazioni"], max(stat["da_fare"], 1)
+    al_secondo = fatte / stat["secondi"] if stat["secondi"] else 0.0
+    stima = (stat["da_fare"] - fatte) / al_secondo if al_secondo else 0.0
+    print(
+        f"blocco {stat['blocchi']}: {fatte}/{stat['da_fare']} riparazioni ({fatte / totale:.0%}), "
+        f"{sum(stat['righe'].values())} righe, {al_secondo:.0f} riparazioni/s, "
+        f"fine stimata tra {stima:.0f}s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archivia le riparazioni chiuse prima di una data")
+    parser.add_argument("--prima", required=True, help="data limite YYYY-MM-DD (dataChiusura precedente)")
+    parser.add_argument("--blocco", type=int, default=ARCHIVIO_BLOCCO, help="riparazioni per transazione")
+    parser.add_argument("--elimina", action="store_true", help="cancella senza copiare in archivio")
+    parser.add_argument("--simula", action="store_true", help="mostra ordine e righe coinvolte senza modificare")
+    args = parser.parse_args()
+
+    # tutte le tabelle, non solo quelle dell'applicativo: una FK non riflessa
+    # bloccherebbe le cancellazioni
+    meta = schema_riflesso(tabelle=None)
+    controllo_tabelle_richieste(meta)
+    lavoro = Archiviazione(meta, datetime.fromisoformat(args.prima), "elimina" if args.elimina else "archivia",
+                           args.blocco)
+    print("ordine di cancellazione: " + " -> ".join(nome for nome, _ in lavoro.cancellazioni))
+
+    if args.simula:
+        with engine.connect() as conn:
+            for nome, n in lavoro.simula(conn).items():
+                print(f"  {nome}: {n} righe")
+        sys.exit(0)
+
+    stat = lavoro.esegui(avanzamento=stampa_avanzamento)
+    print(
+        f"{'Ripreso e completato' if stat['ripreso'] else 'Completato'}: {stat['riparazioni']} riparazioni in "
+        f"{stat['blocchi']} blocchi, {stat['secondi']:.2f}s (blocco più lungo {stat['blocco_max_s'] * 1000:.0f} ms)"
+    )
+    for nome, n in stat["righe"].items():
+        print(f"  {nome}: {n} righe")
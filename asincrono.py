@@ -0,0 +1,89 @@
+# asincrono.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'ACCESSO ASINCRONO AL DATABASE (asyncio)
+# Gli statement di queries.py si eseguono senza modifiche su un engine
+# asincrono (aiomysql in produzione, aiosqlite per le prove in locale);
+# in_parallelo() esegue letture indipendenti su connessioni diverse del pool,
+# così la latenza totale è quella della query più lenta e non la somma.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import asyncio
+import os
+from sqlalchemy.ext.asyncio import create_async_engine
+from database import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+import queries
+
+# Driver asincroni corrispondenti a quelli sincroni.
+DRIVER_ASINCRONI = {
+    "mysql+mysqlconnector": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+# Converte l'URL sincrono di database.py nell'equivalente asincrono.
+def url_asincrono(url: str = DATABASE_URL) -> str:
+    schema, resto = url.split("://", 1)
+    return f"{DRIVER_ASINCRONI.get(schema, schema)}://{resto}"
+
+# URL dell'engine asincrono (si può indicare esplicitamente con DATABASE_URL_ASYNC).
+DATABASE_URL_ASYNC = os.getenv("DATABASE_URL_ASYNC", url_asincrono())
+
+_engine_async = None
+
+# Ritorna l'engine asincrono, creato al primo utilizzo
+# (il driver asincrono serve solo se si usa questo modulo).
+def engine_async():
+    global _engine_async
+    if _engine_async is None:
+        opzioni = {"pool_pre_ping": DB_POOL_PRE_PING}
+        if ":memory:" not in DATABASE_URL_ASYNC:
+            opzioni.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE)
+        _engine_async = create_async_engine(DATABASE_URL_ASYNC, **opzioni)
+    return _engine_async
+
+# Chiude le connessioni dell'engine asincrono.
+async def chiudi():
+    global _engine_async
+    if _engine_async is not None:
+        await _engine_async.dispose()
+        _engine_async = None
+
+
+# Esegue uno statement (SELECT) su una connessione del pool e ritorna le righe.
+async def esegui(stmt, params: dict | None = None) -> list:
+    async with engine_async().connect() as conn:
+        res = await conn.execute(stmt, params or {})
+        return res.fetchall()
+
+# Esegue uno statement del catalogo di queries.py passando solo i parametri.
+async def esegui_catalogo(meta, chiave: str, **params) -> list:
+    return await esegui(queries.catalogo(meta)[chiave], params)
+
+# Esegue più letture indipendenti in parallelo, ognuna sulla propria connessione.
+# richieste: dizionario {nome: statement} oppure {nome: (statement, parametri)}.
+# Ritorna {nome: righe}.
+async def in_parallelo(richieste: dict) -> dict:
+    nomi = list(richieste)
+    compiti = []
+    for nome in nomi:
+        r = richieste[nome]
+        stmt, params = r if isinstance(r, tuple) else (r, None)
+        compiti.append(esegui(stmt, params))
+    risultati = await asyncio.gather(*compiti)
+    return dict(zip(nomi, risultati))
+
+
+# Esempio di vista "cruscotto": dispositivi, appuntamenti e riparazioni con
+# appuntamento di un cliente privato, letti in parallelo.
+async def cruscotto_cliente_privato(meta, nome: str, cognome: str) -> dict:
+    cat = queries.catalogo(meta)
+    cliente = {"nome": nome, "cognome": cognome}
+    return await in_parallelo({
+        "dispositivi": (cat["q_dispositivi_cliente_privato"], cliente),
+        "appuntamenti": (cat["q_appuntamenti_cliente_privato"], cliente),
+        "riparazioni": (cat["q_riparazioni_con_appuntamento_prima_pagina"], {"limite": 50}),
+    })
@@ -0,0 +1,587 @@
+# benchmark.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO I BENCHMARK DELLE QUERY
+# Misurano sul database configurato in database.py il costo dei percorsi
+# alternativi (es. query per singolo cliente ripetuta vs query multi-cliente).
+#
+# Uso: python benchmark.py [--clienti N]
+#      python benchmark.py suite --scala 1000 --scala 100000 [--baseline file.json]
+#      python benchmark.py profilo [--dispositivi 1 --dispositivi 100 ...]
+#      python benchmark.py magazzino [--storico 10000 --storico 1000000 ...]
+#
+# La "suite" crea lo schema di prova su un database SQLite locale, lo popola con
+# dati sintetici alle scale indicate (numero di riparazioni) e misura tutte le
+# query del catalogo e i percorsi di scrittura, confrontando con una baseline.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, func, select
+from database import engine
+from schema_reflect import schema_riflesso, controllo_tabelle_richieste
+import queries
+
+# Esegue fn() `ripetizioni` volte e ritorna il tempo migliore in secondi.
+def cronometra(fn, ripetizioni: int = 3) -> float:
+    migliore = float("inf")
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        fn()
+        migliore = min(migliore, time.perf_counter() - t0)
+    return migliore
+
+
+# -------------------------
+# LOOKUP MULTI-CLIENTE
+# -------------------------
+
+# Confronta, per i primi n clienti privati e business, il ciclo di query per singolo
+# cliente con le query multi-cliente (una per blocco di clienti).
+# Ritorna {percorso: secondi}.
+def confronta_lookup_multipli(meta, n: int = 200) -> dict[str, float]:
+    ClientePrivato = meta.tables["ClientePrivato"]
+    ClienteBusiness = meta.tables["ClienteBusiness"]
+    cat = queries.catalogo(meta)
+
+    with engine.connect() as conn:
+        privati = [tuple(r) for r in conn.execute(select(ClientePrivato.c.nome, ClientePrivato.c.cognome).limit(n))]
+        business = list(conn.execute(select(ClienteBusiness.c.ragioneSociale).limit(n)).scalars())
+
+        def singoli():
+            for nome, cognome in privati:
+                conn.execute(cat["q_dispositivi_cliente_privato"], {"nome": nome, "cognome": cognome}).fetchall()
+                conn.execute(cat["q_appuntamenti_cliente_privato"], {"nome": nome, "cognome": cognome}).fetchall()
+            for rs in business:
+                conn.execute(cat["q_dispositivi_cliente_business"], {"ragione_sociale": rs}).fetchall()
+                conn.execute(cat["q_appuntamenti_cliente_business"], {"ragione_sociale": rs}).fetchall()
+
+        def multipli():
+            queries.dispositivi_clienti_privati(conn, meta, privati)
+            queries.appuntamenti_clienti_privati(conn, meta, privati)
+            queries.dispositivi_clienti_business(conn, meta, business)
+            queries.appuntamenti_clienti_business(conn, meta, business)
+
+        return {
+            f"singoli ({len(privati)} privati + {len(business)} business)": cronometra(singoli),
+            "multi-cliente": cronometra(multipli),
+        }
+
+
+
+# -------------------------
+# UPDATE / DELETE MULTI-RIPARAZIONE
+# -------------------------
+
+# Confronta, sulle prime n riparazioni, il ciclo per singolo id con le versioni
+# multi-riparazione di update e delete. Ogni prova gira in una transazione
+# annullata alla fine: il database non viene modificato.
+# Ritorna {percorso: secondi}.
+def confronta_update_delete(meta, n: int = 500) -> dict[str, float]:
+    Riparazione = meta.tables["Riparazione"]
+    cat = queries.catalogo(meta)
+
+    with engine.connect() as conn:
+        ids = list(conn.execute(select(Riparazione.c.idRiparazione).limit(n)).scalars())
+        conn.rollback()
+
+        def in_rollback(fn):
+            def prova():
+                tx = conn.begin()
+                try:
+                    fn()
+                finally:
+                    tx.rollback()
+            return prova
+
+        def update_singoli():
+            for i in ids:
+                conn.execute(cat["update_stato_riparazione"], {"id_riparazione": i, "nuovo_stato": "Chiusa"})
+
+        def update_multi():
+            queries.aggiorna_stato_riparazioni(conn, meta, {i: "Chiusa" for i in ids})
+
+        def delete_singoli():
+            for i in ids:
+                queries.elimina_riparazioni(conn, meta, [i])
+
+        def delete_multi():
+            queries.elimina_riparazioni(conn, meta, ids)
+
+        return {
+            f"update singoli ({len(ids)} id)": cronometra(in_rollback(update_singoli)),
+            "update multi-riparazione": cronometra(in_rollback(update_multi)),
+            f"delete singoli ({len(ids)} id)": cronometra(in_rollback(delete_singoli)),
+            "delete multi-riparazione": cronometra(in_rollback(delete_multi)),
+        }
+
+
+
+# -------------------------
+# LETTURE IN PARALLELO (asyncio)
+# -------------------------
+
+# Confronta le letture di un cruscotto cliente eseguite in sequenza sull'engine
+# sincrono con le stesse letture eseguite in parallelo da asincrono.in_parallelo().
+# Ritorna {percorso: secondi}.
+def confronta_async(meta, ripetizioni: int = 5) -> dict[str, float]:
+    import asyncio
+    import asincrono
+
+    ClientePrivato = meta.tables["ClientePrivato"]
+    cat = queries.catalogo(meta)
+    with engine.connect() as conn:
+        primo = conn.execute(select(ClientePrivato.c.nome, ClientePrivato.c.cognome).limit(1)).first()
+    cliente = {"nome": primo[0], "cognome": primo[1]} if primo else {"nome": "", "cognome": ""}
+    richieste = {
+        "dispositivi": (cat["q_dispositivi_cliente_privato"], cliente),
+        "appuntamenti": (cat["q_appuntamenti_cliente_privato"], cliente),
+        "riparazioni": (cat["q_riparazioni_con_appuntamento_prima_pagina"], {"limite": 50}),
+        "riparazioni_exists": (cat["q_riparazioni_con_appuntamento_exists"], {}),
+    }
+
+    def sequenziale():
+        with engine.connect() as conn:
+            for stmt, params in richieste.values():
+                conn.execute(stmt, params).fetchall()
+
+    async def parallelo():
+        migliore = float("inf")
+        await asincrono.in_parallelo(richieste)  # apre le connessioni del pool
+        for _ in range(ripetizioni):
+            t0 = time.perf_counter()
+            await asincrono.in_parallelo(richieste)
+            migliore = min(migliore, time.perf_counter() - t0)
+        await asincrono.chiudi()
+        return migliore
+
+    return {
+        f"sequenziale ({len(richieste)} query)": cronometra(sequenziale, ripetizioni),
+        "parallelo (asyncio.gather)": asyncio.run(parallelo()),
+    }
+
+
+
+# -------------------------
+# PROFILO CLIENTE: QUERY AL DATABASE
+# -------------------------
+
+# Crea su un SQLite temporaneo un cliente per ogni valore di `dispositivi`, con
+# quel numero di dispositivi e `riparazioni` riparazioni per dispositivo (ognuna
+# con appuntamento, preventivo, pagamento e garanzia), e confronta il profilo
+# (queries.profili_clienti) con la lettura annidata "N+1" (una query per ogni
+# dispositivo e per ogni riparazione). Ritorna {dispositivi: {percorso: (query, secondi)}}.
+def confronta_profilo(dispositivi=(1, 10, 100, 1000), riparazioni: int = 2) -> dict:
+    import dati_sintetici
+
+    risultati = {}
+    with tempfile.TemporaryDirectory() as cartella:
+        eng = create_engine(f"sqlite:///{os.path.join(cartella, 'profilo.db')}")
+        meta = dati_sintetici.crea_schema(eng)
+        t = meta.tables
+        righe = {nome: [] for nome in ("Cliente", "ClientePrivato", "Dispositivo", "Riparazione",
+                                       "Appuntamento", "Preventivo", "Pagamento", "Garanzia")}
+        id_disp = id_rip = 0
+        for id_cliente, n in enumerate(dispositivi, start=1):
+            righe["Cliente"].append({"idCliente": id_cliente, "tipoCliente": "Privato"})
+            righe["ClientePrivato"].append({"idCliente": id_cliente, "nome": "Prova", "cognome": f"Profilo{n}"})
+            for _ in range(n):
+                id_disp += 1
+                righe["Dispositivo"].append({"idDispositivo": id_disp, "idCliente": id_cliente, "marca": "Dell"})
+                for _ in range(riparazioni):
+                    id_rip += 1
+                    giorno = datetime(2024, 1, 1) + timedelta(hours=id_rip)
+                    righe["Riparazione"].append({"idRiparazione": id_rip, "idDispositivo": id_disp,
+                                                 "stato": "Chiusa", "dataIngresso": giorno})
+                    righe["Appuntamento"].append({"idAppuntamento": id_rip, "idRiparazione": id_rip, "dataOra": giorno})
+                    righe["Preventivo"].append({"idPreventivo": id_rip, "idRiparazione": id_rip, "data": giorno.date()})
+                    righe["Pagamento"].append({"idPagamento": id_rip, "idRiparazione": id_rip, "importo": 50,
+                                               "dataPagamento": giorno})
+                    righe["Garanzia"].append({"idGaranzia": id_rip, "idRiparazione": id_rip,
+                                              "dataInizio": giorno.date()})
+        with eng.begin() as conn:
+            for nome, valori in righe.items():
+                conn.execute(t[nome].insert(), valori)
+
+        contatore = {"query": 0}
+
+        @event.listens_for(eng, "before_cursor_execute")
+        def conta(*_args):
+            contatore["query"] += 1
+
+        def n_piu_uno(conn, id_cliente):
+            Dispositivo, Riparazione = t["Dispositivo"], t["Riparazione"]
+            cliente = conn.execute(select(t["Cliente"]).where(t["Cliente"].c.idCliente == id_cliente)).first()
+            conn.execute(select(t["ClientePrivato"]).where(t["ClientePrivato"].c.idCliente == id_cliente)).first()
+            for d in conn.execute(select(Dispositivo).where(Dispositivo.c.idCliente == id_cliente)).all():
+                for r in conn.execute(select(Riparazione).where(Riparazione.c.idDispositivo == d.idDispositivo)).all():
+                    for nome in ("Appuntamento", "Preventivo", "Pagamento", "Garanzia"):
+                        conn.execute(select(t[nome]).where(t[nome].c.idRiparazione == r.idRiparazione)).all()
+            return cliente
+
+        with eng.connect() as conn:
+            queries.profilo_cliente(conn, meta, 1)  # compila gli statement
+            for id_cliente, n in enumerate(dispositivi, start=1):
+                percorsi = {
+                    "profilo": lambda: queries.profilo_cliente(conn, meta, id_cliente),
+                    "N+1": lambda: n_piu_uno(conn, id_cliente),
+                }
+                misure = {}
+                for percorso, fn in percorsi.items():
+                    contatore["query"] = 0
+                    fn()
+                    misure[percorso] = (contatore["query"], cronometra(fn))
+                risultati[n] = misure
+        eng.dispose()
+    return risultati
+
+def _main_profilo(argv) -> int:
+    parser = argparse.ArgumentParser(prog="benchmark.py profilo",
+                                     description="Query al database del profilo cliente al crescere dei dispositivi")
+    parser.add_argument("--dispositivi", type=int, action="append", help="dispositivi del cliente (ripetibile)")
+    parser.add_argument("--riparazioni", type=int, default=2, help="riparazioni per dispositivo")
+    args = parser.parse_args(argv)
+
+    risultati = confronta_profilo(args.dispositivi or [1, 10, 100, 1000], args.riparazioni)
+    print(f"{'dispositivi':>11} {'query profilo':>14} {'ms profilo':>11} {'query N+1':>10} {'ms N+1':>9}")
+    for n, m in risultati.items():
+        (q_p, s_p), (q_n, s_n) = m["profilo"], m["N+1"]
+        print(f"{n:>11} {q_p:>14} {s_p * 1000:>11.2f} {q_n:>10} {s_n * 1000:>9.2f}")
+    return 0
+
+
+
+# -------------------------
+# MAGAZZINO RICAMBI
+# -------------------------
+
+# Su un SQLite temporaneo con `storico` forniture (e un quarto di righe d'ordine)
+# confronta l'aggiornamento incrementale del riepilogo dopo `nuove` forniture con
+# la ricostruzione completa, e la lettura dei ricambi sotto scorta dal riepilogo
+# con il calcolo dallo storico. Ritorna {storico: {misura: secondi}}.
+def confronta_magazzino(storici=(10_000, 100_000, 1_000_000), nuove: int = 100, ricambi: int = 2000,
+                        ripetizioni: int = 5) -> dict:
+    import dati_sintetici
+    import magazzino
+
+    rnd = random.Random(7)
+    risultati = {}
+    for storico in storici:
+        with tempfile.TemporaryDirectory() as cartella:
+            eng = create_engine(f"sqlite:///{os.path.join(cartella, 'magazzino.db')}")
+            meta = dati_sintetici.crea_schema(eng)
+            t = meta.tables
+            n_ordini = storico // 4
+            inizio = datetime(2020, 1, 1).date()
+
+            def forniture(da, a):
+                return [{"idFornitura": i, "idFornitore": rnd.randint(1, 10), "idRicambio": rnd.randint(1, ricambi),
+                         "quantita": rnd.randint(1, 50), "data": inizio + timedelta(days=i % 2000)}
+                        for i in range(da, a)]
+
+            with eng.begin() as conn:
+                conn.execute(t["Ricambio"].insert(), [{"idRicambio": i, "nome": f"Ricambio {i}",
+                                                       "scortaMinima": rnd.randint(1, 500)}
+                                                      for i in range(1, ricambi + 1)])
+                conn.execute(t["Fornitore"].insert(), [{"idFornitore": i, "ragioneSociale": f"Fornitore {i}"}
+                                                       for i in range(1, 11)])
+                for da in range(1, storico + 1, 100_000):
+                    conn.execute(t["Fornitura"].insert(), forniture(da, min(da + 100_000, storico + 1)))
+                for da in range(1, n_ordini + 1, 100_000):
+                    a = min(da + 100_000, n_ordini + 1)
+                    conn.execute(t["Ordine"].insert(), [{"idOrdine": i, "idFornitore": rnd.randint(1, 10),
+                                                         "data": inizio + timedelta(days=i % 2000)}
+                                                        for i in range(da, a)])
+                    conn.execute(t["DettaglioOrdine"].insert(), [{"idOrdine": i, "idRicambio": rnd.randint(1, ricambi),
+                                                                  "quantita": rnd.randint(1, 20)}
+                                                                 for i in range(da, a)])
+
+            misure = {}
+            with eng.begin() as conn:
+                magazzino.installa(conn, meta)  # tabelle, trigger e riepilogo iniziale
+            with eng.connect() as conn:
+                def ricostruisci():
+                    with conn.begin():
+                        magazzino.ricostruisci(conn, meta)
+                misure["ricostruzione completa"] = cronometra(ricostruisci, ripetizioni)
+
+                prossima = storico + 1
+                migliore = float("inf")
+                for _ in range(ripetizioni):
+                    with conn.begin():
+                        conn.execute(t["Fornitura"].insert(), forniture(prossima, prossima + nuove))
+                    prossima += nuove
+                    t0 = time.perf_counter()
+                    with conn.begin():
+                        magazzino.aggiorna(conn, meta)
+                    migliore = min(migliore, time.perf_counter() - t0)
+                misure[f"aggiornamento incrementale (+{nuove})"] = migliore
+                if magazzino.verifica(conn, meta):
+                    raise RuntimeError("Riepilogo incrementale diverso dal ricalcolo completo.")
+                conn.rollback()
+
+                sotto_scorta = magazzino.statement_giacenze(meta, sotto_scorta=True)
+                misure["sotto scorta dal riepilogo"] = cronometra(lambda: conn.execute(sotto_scorta).all(), ripetizioni)
+                misure["riepilogo dallo storico"] = cronometra(
+                    lambda: conn.execute(magazzino.statement_completo(meta)).all(), ripetizioni
+                )
+            eng.dispose()
+        risultati[storico] = misure
+    return risultati
+
+def _main_magazzino(argv) -> int:
+    parser = argparse.ArgumentParser(prog="benchmark.py magazzino",
+                                     description="Riepilogo giacenze: incrementale vs ricalcolo completo")
+    parser.add_argument("--storico", type=int, action="append", help="forniture già registrate (ripetibile)")
+    parser.add_argument("--nuove", type=int, default=100, help="forniture aggiunte prima di ogni aggiornamento")
+    parser.add_argument("--ricambi", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    risultati = confronta_magazzino(args.storico or [10_000, 100_000, 1_000_000], args.nuove, args.ricambi)
+    for storico, misure in risultati.items():
+        print(f"\n== {storico} forniture, {storico // 4} righe d'ordine, {args.ricambi} ricambi ==")
+        for nome, secondi in misure.items():
+            print(f"{nome:<40} {secondi * 1000:>10.2f} ms")
+    return 0
+
+
+
+# -------------------------
+# SUITE DI SCALA
+# -------------------------
+
+# Soglia di regressione: p95 oltre baseline * SOGLIA (e di almeno MARGINE_MS).
+SOGLIA_REGRESSIONE = 1.25
+MARGINE_MS = 0.5
+
+# Percentile (0-100) di una lista di valori.
+def percentile(valori, p: float) -> float:
+    ordinati = sorted(valori)
+    if not ordinati:
+        return 0.0
+    k = (len(ordinati) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordinati) - 1)
+    return ordinati[i] + (ordinati[j] - ordinati[i]) * (k - i)
+
+# Misura una funzione che ritorna il numero di righe lette/scritte:
+# latenze p50/p95, righe al secondo e picco di memoria (in una esecuzione a parte).
+def misura(fn, ripetizioni: int) -> dict:
+    tempi = []
+    righe = 0
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        righe += fn() or 0
+        tempi.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    fn()
+    _, picco = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    totale = sum(tempi)
+    return {
+        "p50_ms": percentile(tempi, 50) * 1000,
+        "p95_ms": percentile(tempi, 95) * 1000,
+        "righe_al_secondo": righe / totale if totale else 0.0,
+        "memoria_picco_kb": picco / 1024,
+    }
+
+# Misura tutte le query del catalogo e i percorsi di scrittura su un engine già popolato.
+# Ritorna {misura: risultati}.
+def misura_scala(eng, meta, ripetizioni: int = 10, seme: int = 7) -> dict:
+    import builtins
+    import main
+
+    rnd = random.Random(seme)
+    cat = queries.catalogo(meta)
+    ClientePrivato = meta.tables["ClientePrivato"]
+    ClienteBusiness = meta.tables["ClienteBusiness"]
+    Cliente = meta.tables["Cliente"]
+    risultati = {}
+
+    with eng.connect() as conn:
+        privati = [tuple(r) for r in conn.execute(select(ClientePrivato.c.nome, ClientePrivato.c.cognome).limit(1000))]
+        business = list(conn.execute(select(ClienteBusiness.c.ragioneSociale).limit(1000)).scalars())
+        id_clienti = list(conn.execute(select(Cliente.c.idCliente).limit(1000)).scalars())
+        # finestra dell'agenda: l'ultima settimana dei dati (il generatore non usa la data di oggi)
+        ultimo_app = conn.execute(select(func.max(meta.tables["Appuntamento"].c.dataOra))).scalar() or datetime.now()
+        if isinstance(ultimo_app, str):
+            ultimo_app = datetime.fromisoformat(ultimo_app)
+        conn.rollback()
+
+        def parametri(nome: str) -> dict:
+            if "profilo" in nome:
+                return {"id_clienti": [rnd.choice(id_clienti)]}
+            if "clienti_privati" in nome:
+                return {"clienti": rnd.sample(privati, min(100, len(privati)))}
+            if "clienti_business" in nome:
+                return {"ragioni_sociali": rnd.sample(business, min(100, len(business)))}
+            if "cliente_privato" in nome:
+                nome_c, cognome = rnd.choice(privati)
+                return {"nome": nome_c, "cognome": cognome}
+            if "cliente_business" in nome:
+                return {"ragione_sociale": rnd.choice(business)}
+            if "pagina" in nome:
+                return {"limite": 50, "ultima_data": datetime(2024, 6, 1), "ultimo_id": 0}
+            if "agenda" in nome:
+                return {"da": ultimo_app - timedelta(days=7), "a": ultimo_app}
+            return {}
+
+        # letture: tutte le SELECT del catalogo, lette in streaming fino all'ultima riga
+        for nome in [k for k in queries._COSTRUTTORI if k.startswith("q_")]:
+            def leggi(nome=nome):
+                res = conn.execution_options(stream_results=True, yield_per=1000).execute(cat[nome], parametri(nome))
+                n = sum(len(p) for p in res.partitions())
+                return n
+            risultati[nome] = misura(leggi, ripetizioni)
+            conn.rollback()
+
+        # scritture: id_successivo e inserisci_campi_richiesti, in transazioni annullate
+        with eng.begin() as c:
+            main.id_successivo(c, Cliente, "idCliente")  # crea la tabella delle sequenze
+
+        def in_rollback(fn):
+            def prova():
+                tx = conn.begin()
+                try:
+                    return fn()
+                finally:
+                    tx.rollback()
+            return prova
+
+        def id_successivo():
+            for _ in range(100):
+                main.id_successivo(conn, Cliente, "idCliente")
+            return 100
+
+        def inserisci():
+            for _ in range(100):
+                id_c = main.inserisci_campi_richiesti(conn, Cliente, preset={"tipoCliente": "Privato"}, pk_name="idCliente")
+                main.inserisci_campi_richiesti(
+                    conn, ClientePrivato, preset={"idCliente": id_c, "nome": "Prova", "cognome": "Benchmark"},
+                    pk_name="idCliente",
+                )
+            return 200
+
+        input_originale = builtins.input
+        builtins.input = lambda _prompt="": (_ for _ in ()).throw(RuntimeError("input non previsto nel benchmark"))
+        try:
+            risultati["id_successivo (x100)"] = misura(in_rollback(id_successivo), ripetizioni)
+            risultati["inserisci_campi_richiesti (x100 clienti)"] = misura(in_rollback(inserisci), ripetizioni)
+        finally:
+            builtins.input = input_originale
+
+    return risultati
+
+# Confronta i risultati con la baseline. Ritorna l'elenco delle regressioni (testo).
+def confronta_baseline(risultati: dict, baseline: dict, soglia: float = SOGLIA_REGRESSIONE) -> list[str]:
+    regressioni = []
+    for scala, misure in risultati.items():
+        for nome, m in misure.items():
+            base = baseline.get(scala, {}).get(nome)
+            if not base:
+                continue
+            limite = base["p95_ms"] * soglia
+            if m["p95_ms"] > limite and m["p95_ms"] - base["p95_ms"] > MARGINE_MS:
+                regressioni.append(
+                    f"[{scala}] {nome}: p95 {m['p95_ms']:.2f} ms > {base['p95_ms']:.2f} ms x {soglia}"
+                )
+    return regressioni
+
+# Esegue la suite alle scale indicate (numero di riparazioni) su un SQLite locale.
+# Ritorna {scala: {misura: risultati}}.
+def suite(scale, percorso_db: str | None = None, ripetizioni: int = 10, indici: bool = True) -> dict:
+    import dati_sintetici
+
+    risultati = {}
+    with tempfile.TemporaryDirectory() as cartella:
+        for scala in scale:
+            percorso = percorso_db or os.path.join(cartella, f"bench_{scala}.db")
+            eng = create_engine(f"sqlite:///{percorso}")
+            meta = dati_sintetici.crea_schema(eng, indici=indici)
+            generati = dati_sintetici.genera(eng, meta, riparazioni=scala)
+            print(f"scala {scala}: dati generati in {generati['secondi']:.1f}s", file=sys.stderr)
+            risultati[str(scala)] = misura_scala(eng, meta, ripetizioni)
+            eng.dispose()
+    return risultati
+
+# Stampa i risultati della suite come tabella.
+def stampa_suite(risultati: dict):
+    for scala, misure in risultati.items():
+        print(f"\n== {scala} riparazioni ==")
+        print(f"{'misura':<50} {'p50 ms':>9} {'p95 ms':>9} {'righe/s':>12} {'picco KB':>10}")
+        for nome, m in misure.items():
+            print(
+                f"{nome:<50} {m['p50_ms']:>9.2f} {m['p95_ms']:>9.2f} "
+                f"{m['righe_al_secondo']:>12.0f} {m['memoria_picco_kb']:>10.0f}"
+            )
+
+
+def _main_suite(argv) -> int:
+    parser = argparse.ArgumentParser(prog="benchmark.py suite", description="Suite di scala su dati sintetici")
+    parser.add_argument("--scala", type=int, action="append", help="numero di riparazioni (ripetibile)")
+    parser.add_argument("--db", help="file SQLite da usare (default: temporaneo)")
+    parser.add_argument("--ripetizioni", type=int, default=10)
+    parser.add_argument("--senza-indici", action="store_true", help="non crea gli indici consigliati")
+    parser.add_argument("--baseline", help="file JSON di baseline da confrontare")
+    parser.add_argument("--salva-baseline", action="store_true", help="scrive i risultati come nuova baseline")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE)
+    args = parser.parse_args(argv)
+
+    risultati = suite(args.scala or [1000], args.db, args.ripetizioni, indici=not args.senza_indici)
+    stampa_suite(risultati)
+
+    if args.baseline and args.salva_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(risultati, f, indent=2)
+        print(f"\nBaseline salvata in {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressioni = confronta_baseline(risultati, json.load(f), args.soglia)
+        print("\n== Confronto con la baseline ==")
+        for r in regressioni:
+            print("REGRESSIONE " + r)
+        if regressioni:
+            return 1
+        print("nessuna regressione")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        sys.exit(_main_suite(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "profilo":
+        sys.exit(_main_profilo(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "magazzino":
+        sys.exit(_main_magazzino(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Benchmark delle query del CentroRiparazioni")
+    parser.add_argument("--clienti", type=int, default=200, help="clienti per il confronto dei lookup")
+    parser.add_argument("--riparazioni", type=int, default=500, help="riparazioni per il confronto di update/delete")
+    parser.add_argument("--async", dest="con_async", action="store_true", help="confronta anche le letture in parallelo")
+    args = parser.parse_args()
+
+    meta = schema_riflesso()
+    controllo_tabelle_richieste(meta)
+
+    print("== Lookup per cliente: singoli vs multi-cliente ==")
+    for percorso, secondi in confronta_lookup_multipli(meta, args.clienti).items():
+        print(f"{percorso}: {secondi * 1000:.1f} ms")
+
+    print("\n== Update/delete: singoli vs multi-riparazione (in rollback) ==")
+    for percorso, secondi in confronta_update_delete(meta, args.riparazioni).items():
+        print(f"{percorso}: {secondi * 1000:.1f} ms")
+
+    if args.con_async:
+        print("\n== Cruscotto cliente: sequenziale vs parallelo ==")
+        for percorso, secondi in confronta_async(meta).items():
+            print(f"{percorso}: {secondi * 1000:.1f} ms")
@@ -0,0 +1,157 @@
+# cache_risultati.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO LA CACHE DEI RISULTATI DELLE RICERCHE PER CLIENTE
+# Cache in memoria (LRU + scadenza TTL) per le query per cliente del catalogo
+# (dispositivi e appuntamenti di un cliente privato o business), con chiave
+# statement + parametri. Ogni voce è "etichettata" con il cliente a cui si
+# riferisce: inserimenti, aggiornamenti ed eliminazioni invalidano solo le
+# voci del cliente coinvolto.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from sqlalchemy import select
+
+# Parametri della cache
+CACHE_MAX_VOCI = int(os.getenv("CACHE_MAX_VOCI", "1000"))   # voci massime (LRU oltre il limite)
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))            # secondi di validità di una voce
+CACHE_MAX_RIGHE = int(os.getenv("CACHE_MAX_RIGHE", "1000"))  # risultati più grandi non vengono salvati
+
+# Statement del catalogo che possono essere messi in cache.
+STATEMENT_CACHEABILI = {
+    "q_dispositivi_cliente_privato",
+    "q_appuntamenti_cliente_privato",
+    "q_dispositivi_cliente_business",
+    "q_appuntamenti_cliente_business",
+}
+
+
+# Etichetta del cliente a cui si riferiscono i parametri di una ricerca.
+def etichetta_cliente(params: dict):
+    if "ragione_sociale" in params:
+        return ("Business", params["ragione_sociale"])
+    if "nome" in params and "cognome" in params:
+        return ("Privato", params["nome"], params["cognome"])
+    return None
+
+
+class CacheRisultati:
+    def __init__(self, max_voci: int = CACHE_MAX_VOCI, ttl: float = CACHE_TTL, max_righe: int = CACHE_MAX_RIGHE):
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self.max_righe = max_righe
+        self._voci: OrderedDict = OrderedDict()  # chiave -> (scadenza, etichetta, colonne, righe)
+        self._per_etichetta: dict[tuple, set] = {}
+        self._lock = threading.Lock()
+        self.statistiche: Counter = Counter()
+
+    # Legge un risultato dalla cache o, se assente/scaduto, dal database.
+    # Ritorna (colonne, righe) con le righe come tuple.
+    def leggi(self, conn, meta, chiave_stmt: str, **params):
+        import queries
+
+        chiave = (chiave_stmt, tuple(sorted(params.items())))
+        adesso = time.monotonic()
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None:
+                if voce[0] > adesso:
+                    self._voci.move_to_end(chiave)
+                    self.statistiche["hit"] += 1
+                    return voce[2], voce[3]
+                self._rimuovi(chiave)
+                self.statistiche["scadute"] += 1
+            self.statistiche["miss"] += 1
+
+        res = conn.execute(queries.catalogo(meta)[chiave_stmt], params)
+        colonne = list(res.keys())
+        righe = [tuple(r) for r in res]
+        if len(righe) <= self.max_righe:
+            self._salva(chiave, etichetta_cliente(params), colonne, righe)
+        return colonne, righe
+
+    def _salva(self, chiave, etichetta, colonne, righe):
+        with self._lock:
+            if chiave in self._voci:
+                self._rimuovi(chiave)
+            self._voci[chiave] = (time.monotonic() + self.ttl, etichetta, colonne, righe)
+            if etichetta is not None:
+                self._per_etichetta.setdefault(etichetta, set()).add(chiave)
+            while len(self._voci) > self.max_voci:
+                vecchia = next(iter(self._voci))
+                self._rimuovi(vecchia)
+                self.statistiche["espulse"] += 1
+
+    def _rimuovi(self, chiave):
+        voce = self._voci.pop(chiave, None)
+        if voce is not None and voce[1] is not None:
+            chiavi = self._per_etichetta.get(voce[1])
+            if chiavi is not None:
+                chiavi.discard(chiave)
+                if not chiavi:
+                    del self._per_etichetta[voce[1]]
+
+    # Invalida le voci dei clienti indicati (etichette come quelle di etichetta_cliente).
+    # Ritorna il numero di voci rimosse.
+    def invalida(self, etichette) -> int:
+        n = 0
+        with self._lock:
+            for etichetta in etichette:
+                for chiave in list(self._per_etichetta.get(etichetta, ())):
+                    self._rimuovi(chiave)
+                    n += 1
+            self.statistiche["invalidate"] += n
+        return n
+
+    # Svuota la cache.
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self._per_etichetta.clear()
+
+    # Riepilogo su una riga dei contatori (per il menu).
+    def riepilogo(self) -> str:
+        s = self.statistiche
+        totale = s["hit"] + s["miss"]
+        rate = s["hit"] / totale * 100 if totale else 0.0
+        return (
+            f"cache risultati: voci={len(self._voci)}/{self.max_voci} hit={s['hit']} miss={s['miss']} "
+            f"hit_rate={rate:.1f}% espulse={s['espulse']} scadute={s['scadute']} invalidate={s['invalidate']}"
+        )
+
+
+# Cache condivisa dall'applicativo.
+cache = CacheRisultati()
+
+
+# Ritorna le etichette dei clienti proprietari delle riparazioni indicate
+# (da leggere PRIMA di eliminarle). Serve per invalidare solo quei clienti.
+def clienti_di_riparazioni(conn, meta, id_riparazioni) -> set:
+    Riparazione = meta.tables["Riparazione"]
+    Dispositivo = meta.tables["Dispositivo"]
+    ClientePrivato = meta.tables["ClientePrivato"]
+    ClienteBusiness = meta.tables["ClienteBusiness"]
+    ids = list(id_riparazioni)
+    if not ids:
+        return set()
+
+    base = (
+        Riparazione.join(Dispositivo, Riparazione.c.idDispositivo == Dispositivo.c.idDispositivo)
+    )
+    privati = conn.execute(
+        select(ClientePrivato.c.nome, ClientePrivato.c.cognome)
+        .select_from(base.join(ClientePrivato, Dispositivo.c.idCliente == ClientePrivato.c.idCliente))
+        .where(Riparazione.c.idRiparazione.in_(ids))
+    )
+    business = conn.execute(
+        select(ClienteBusiness.c.ragioneSociale)
+        .select_from(base.join(ClienteBusiness, Dispositivo.c.idCliente == ClienteBusiness.c.idCliente))
+        .where(Riparazione.c.idRiparazione.in_(ids))
+    )
+    etichette = {("Privato", r.nome, r.cognome) for r in privati}
+    etichette |= {("Business", r.ragioneSociale) for r in business}
+    return etichette
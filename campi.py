@@ -0,0 +1,58 @@
+# campi.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO I CONTROLLI SULLE COLONNE RIFLESSE E LA CONVERSIONE
+# DEI VALORI SCRITTI DALL'UTENTE (menu di main.py, comandi di cli.py e
+# importazione di importa.py).
+# Non importa nulla dell'applicativo: si può usare senza caricare il menu.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+
+
+# Controlla se una colonna ha un valore di default
+def colonna_ha_default(col) -> bool:
+    return (col.default is not None) or (col.server_default is not None)
+
+# Verifica se la PK è autoincrement
+def pk_autoincrementa(col) -> bool:
+    try:
+        return bool(getattr(col, "autoincrement", False))
+    except Exception:
+        return False
+
+# converte l’input stringa dell’utente nel tipo corretto
+def interprete(raw: str, col):
+    raw = raw.strip()
+    if raw == "":
+        return None
+
+# DateTime
+    try:
+        coltype = col.type.__class__.__name__.lower()
+        if "datetime" in coltype:
+            if len(raw) == 16:  # "YYYY-MM-DD HH:MM"
+                raw = raw + ":00"
+            return raw
+    except Exception:
+        pass
+
+    py = getattr(col.type, "python_type", None)
+    if py is None:
+        return raw
+
+    try:
+        if py is int:
+            return int(raw)
+        if py is float:
+            return float(raw)
+        return raw
+    except Exception:
+        return raw
+
+# legge uno o più id separati da virgola (es. "3, 7,12")
+def leggi_id(raw: str) -> list[int]:
+    ids = [int(x) for x in raw.replace(" ", "").split(",") if x]
+    if not ids:
+        raise ValueError("Nessun id indicato.")
+    return ids
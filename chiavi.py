@@ -0,0 +1,212 @@
+# chiavi.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'ALLOCATORE DELLE CHIAVI PRIMARIE (hi-lo)
+# Al posto di un SELECT MAX()+1 per ogni INSERT, ogni processo riserva un
+# intervallo di id con un solo statement atomico sulla tabella SequenzaChiavi
+# e poi distribuisce gli id dalla memoria. Due operatori che inseriscono
+# contemporaneamente ricevono intervalli diversi: niente chiavi duplicate.
+#
+# Uso: python chiavi.py  (prova con thread concorrenti su un DB SQLite locale)
+#      python -m pytest test_chiavi.py
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import (
+    MetaData, Table, Column, String, BigInteger, Integer,
+    create_engine, select, update, insert, func, literal,
+)
+from sqlalchemy.exc import IntegrityError
+from database import engine
+
+# Numero di id riservati a ogni accesso alla tabella delle sequenze.
+BLOCCO_CHIAVI = int(os.getenv("BLOCCO_CHIAVI", "50"))
+
+_meta_sequenze = MetaData()
+
+# Tabella delle sequenze: per ogni tabella, il prossimo id non ancora riservato.
+SequenzaChiavi = Table(
+    "SequenzaChiavi", _meta_sequenze,
+    Column("tabella", String(64), primary_key=True),
+    Column("prossimo", BigInteger, nullable=False),
+)
+
+
+class AllocatoreChiavi:
+    # engine: engine su cui vive la tabella SequenzaChiavi
+    # blocco: quanti id riservare per volta
+    def __init__(self, engine, blocco: int = BLOCCO_CHIAVI):
+        self.engine = engine
+        self.blocco = blocco
+        self._intervalli: dict[tuple, list[int]] = {}  # (database, tabella) -> [prossimo, limite escluso]
+        self._lock = threading.Lock()
+        self._tabelle_create: set[str] = set()  # database su cui SequenzaChiavi esiste già
+
+    # Ritorna il prossimo id per la tabella.
+    # conn (opzionale) è la connessione del chiamante: su SQLite, che ammette un solo
+    # scrittore, la riserva avviene sulla stessa connessione per non bloccarsi da sola;
+    # in quel caso si riserva un id alla volta, così un rollback del chiamante annulla
+    # insieme l'INSERT e la riserva (niente intervalli in memoria da invalidare).
+    def prossima(self, table, pk_name: str, conn=None) -> int:
+        with self._lock:
+            if self._usa_connessione_chiamante(conn):
+                return self._riserva(table, pk_name, 1, conn)
+            chiave = (self._database(conn), table.name)
+            intervallo = self._intervalli.get(chiave)
+            if intervallo is None or intervallo[0] >= intervallo[1]:
+                inizio = self._riserva(table, pk_name, self.blocco, conn)
+                intervallo = [inizio, inizio + self.blocco]
+                self._intervalli[chiave] = intervallo
+            valore = intervallo[0]
+            intervallo[0] += 1
+            return valore
+
+    # Riserva n id consecutivi (per i percorsi batch) e li ritorna come range.
+    def riserva(self, table, pk_name: str, n: int, conn=None) -> range:
+        with self._lock:
+            inizio = self._riserva(table, pk_name, n, conn)
+        return range(inizio, inizio + n)
+
+    # Esegue la riserva vera e propria: un solo statement atomico che sposta in avanti
+    # il contatore di n e ritorna il primo id dell'intervallo riservato.
+    def _riserva(self, table, pk_name: str, n: int, conn=None) -> int:
+        if self._usa_connessione_chiamante(conn):
+            return self._riserva_su(conn, table, pk_name, n)
+        with self.engine.begin() as c:
+            return self._riserva_su(c, table, pk_name, n)
+
+    @staticmethod
+    def _usa_connessione_chiamante(conn) -> bool:
+        return conn is not None and conn.dialect.name == "sqlite"
+
+    def _database(self, conn=None) -> str:
+        eng = conn.engine if self._usa_connessione_chiamante(conn) else self.engine
+        return eng.url.render_as_string(hide_password=True)
+
+    def _riserva_su(self, conn, table, pk_name: str, n: int) -> int:
+        # sulla connessione del chiamante la creazione può essere annullata da un
+        # suo rollback: in quel caso si ricontrolla ogni volta (costa poco su SQLite)
+        database = conn.engine.url.render_as_string(hide_password=True)
+        if database not in self._tabelle_create:
+            _meta_sequenze.create_all(conn, checkfirst=True)
+            if not self._usa_connessione_chiamante(conn):
+                self._tabelle_create.add(database)
+
+        for _ in range(2):
+            nuovo = self._avanza(conn, table.name, n)
+            if nuovo is not None:
+                return nuovo - n
+            self._inizializza(conn, table, pk_name)
+        raise RuntimeError(f"Impossibile riservare chiavi per la tabella {table.name}")
+
+    # Sposta il contatore in avanti e ritorna il nuovo valore (None se la sequenza non esiste).
+    def _avanza(self, conn, nome_tabella: str, n: int) -> int | None:
+        cond = SequenzaChiavi.c.tabella == nome_tabella
+        if conn.dialect.name == "mysql":
+            # LAST_INSERT_ID(expr) restituisce il valore nel pacchetto OK: nessun SELECT
+            res = conn.execute(
+                update(SequenzaChiavi).where(cond)
+                .values(prossimo=func.last_insert_id(SequenzaChiavi.c.prossimo + n))
+            )
+            return int(res.lastrowid) if res.rowcount == 1 else None
+        if conn.dialect.update_returning:
+            res = conn.execute(
+                update(SequenzaChiavi).where(cond)
+                .values(prossimo=SequenzaChiavi.c.prossimo + n)
+                .returning(SequenzaChiavi.c.prossimo)
+            )
+            valore = res.scalar_one_or_none()
+            return int(valore) if valore is not None else None
+        res = conn.execute(
+            update(SequenzaChiavi).where(cond).values(prossimo=SequenzaChiavi.c.prossimo + n)
+        )
+        if res.rowcount != 1:
+            return None
+        return int(conn.execute(select(SequenzaChiavi.c.prossimo).where(cond)).scalar_one())
+
+    # Crea la sequenza partendo da MAX(pk)+1 della tabella (una sola volta per tabella).
+    def _inizializza(self, conn, table, pk_name: str):
+        stmt = insert(SequenzaChiavi).from_select(
+            ["tabella", "prossimo"],
+            select(literal(table.name), func.coalesce(func.max(table.c[pk_name]), 0) + 1),
+        )
+        try:
+            with conn.begin_nested():
+                conn.execute(stmt)
+        except IntegrityError:
+            pass  # creata nel frattempo da un altro processo
+
+
+# Allocatore condiviso dall'applicativo (menu e importazione).
+allocatore = AllocatoreChiavi(engine)
+
+
+# -------------------------
+# PROVA DI CONCORRENZA
+# -------------------------
+
+# Inserisce righe da più thread su un DB SQLite temporaneo, una volta con
+# SELECT MAX()+1 e una volta con l'allocatore. Ritorna per ciascun metodo
+# righe inserite, collisioni (solo IntegrityError, cioè chiavi duplicate),
+# gli altri errori (es. lock di SQLite) come lista di messaggi e righe/s.
+def prova_concorrenza(thread: int = 8, righe_per_thread: int = 200) -> dict:
+    risultati = {}
+    for metodo in ("max_piu_uno", "allocatore"):
+        with tempfile.TemporaryDirectory() as cartella:
+            eng = create_engine(
+                f"sqlite:///{os.path.join(cartella, 'prova.db')}",
+                connect_args={"timeout": 30},
+            )
+            meta = MetaData()
+            tab = Table("Prova", meta, Column("id", Integer, primary_key=True, autoincrement=False))
+            meta.create_all(eng)
+            alloc = AllocatoreChiavi(eng)
+            collisioni = [0] * thread
+            errori: list[str] = []
+
+            def lavora(n: int):
+                for _ in range(righe_per_thread):
+                    try:
+                        with eng.begin() as c:
+                            if metodo == "max_piu_uno":
+                                nuovo = c.execute(select(func.coalesce(func.max(tab.c.id), 0) + 1)).scalar_one()
+                            else:
+                                nuovo = alloc.prossima(tab, "id")
+                            c.execute(tab.insert().values(id=nuovo))
+                    except IntegrityError:
+                        collisioni[n] += 1
+                    except Exception as e:
+                        # non è una chiave duplicata (es. SQLite "database is locked"):
+                        # riportato a parte, non contato come collisione
+                        errori.append(f"{type(e).__name__}: {str(getattr(e, 'orig', None) or e).splitlines()[0]}")
+
+            t0 = time.perf_counter()
+            lavoratori = [threading.Thread(target=lavora, args=(i,)) for i in range(thread)]
+            for t in lavoratori:
+                t.start()
+            for t in lavoratori:
+                t.join()
+            secondi = time.perf_counter() - t0
+
+            with eng.connect() as c:
+                inserite = c.execute(select(func.count()).select_from(tab)).scalar_one()
+            eng.dispose()
+            risultati[metodo] = {
+                "inserite": inserite,
+                "collisioni": sum(collisioni),
+                "errori": errori,
+                "righe_al_secondo": inserite / secondi if secondi else 0.0,
+            }
+    return risultati
+
+
+if __name__ == "__main__":
+    for metodo, r in prova_concorrenza().items():
+        print(f"{metodo}: {r['inserite']} righe, {r['collisioni']} collisioni, "
+              f"{len(r['errori'])} altri errori, {r['righe_al_secondo']:.0f} righe/s")
+        for motivo in sorted(set(r["errori"])):
+            print(f"  {r['errori'].count(motivo)} x {motivo}")
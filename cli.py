@@ -0,0 +1,204 @@
+# cli.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO LA MODALITÀ A COMANDI (non interattiva)
+# Permette a script e cron di eseguire una singola azione del menu:
+#
+#   python main.py query riparazioni-con-appuntamento --format ndjson
+#   python main.py query dispositivi-cliente-privato --nome Mario --cognome Rossi
+#   python main.py aggiorna-stato --id 3,7 --stato Chiusa
+#   python main.py elimina-riparazioni --id 12 --si
+#   python main.py tempi-avvio
+#
+# Gli stessi comandi si possono lanciare anche con python cli.py ...
+#
+# Viene riflesso solo il sottoinsieme di tabelle che serve al comando.
+# Codici di uscita: 0 ok, 1 errore, 2 uso errato, 3 nessuna riga modificata.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Comandi "query": nome -> (statement del catalogo, tabelle necessarie, parametri)
+COMANDI_QUERY = {
+    "dispositivi-cliente-privato": (
+        "q_dispositivi_cliente_privato",
+        ["ClientePrivato", "Dispositivo"],
+        ["nome", "cognome"],
+    ),
+    "dispositivi-cliente-business": (
+        "q_dispositivi_cliente_business",
+        ["ClienteBusiness", "Cliente", "Dispositivo"],
+        ["ragione_sociale"],
+    ),
+    "appuntamenti-cliente-privato": (
+        "q_appuntamenti_cliente_privato",
+        ["ClientePrivato", "Cliente", "Dispositivo", "Riparazione", "Appuntamento"],
+        ["nome", "cognome"],
+    ),
+    "appuntamenti-cliente-business": (
+        "q_appuntamenti_cliente_business",
+        ["ClienteBusiness", "Cliente", "Dispositivo", "Riparazione", "Appuntamento"],
+        ["ragione_sociale"],
+    ),
+    "riparazioni-con-appuntamento": (
+        "q_riparazioni_con_appuntamento",
+        ["ClientePrivato", "Dispositivo", "Riparazione", "Appuntamento"],
+        [],
+    ),
+    "riparazioni-con-appuntamento-exists": (
+        "q_riparazioni_con_appuntamento_exists",
+        ["Riparazione", "Appuntamento"],
+        [],
+    ),
+}
+
+# Tabelle necessarie ai comandi di modifica.
+TABELLE_RIPARAZIONI = ["Riparazione", "Appuntamento"]
+
+# Codici di uscita
+OK, ERRORE, USO_ERRATO, NESSUNA_RIGA = 0, 1, 2, 3
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="main.py", description="Centro Riparazioni - modalità a comandi")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    q = sub.add_parser("query", help="esegue una query di queries.py")
+    q.add_argument("nome", choices=sorted(COMANDI_QUERY))
+    q.add_argument("--nome", dest="p_nome")
+    q.add_argument("--cognome")
+    q.add_argument("--ragione-sociale")
+    q.add_argument("--format", choices=["tabella", "ndjson", "csv"], default="tabella")
+
+    a = sub.add_parser("aggiorna-stato", help="aggiorna lo stato di una o più riparazioni (opzione 5)")
+    a.add_argument("--id", required=True, help="id separati da virgola")
+    a.add_argument("--stato", required=True)
+
+    e = sub.add_parser("elimina-riparazioni", help="elimina riparazioni e righe collegate (opzione 7)")
+    e.add_argument("--id", required=True, help="id separati da virgola")
+    e.add_argument("--si", action="store_true", help="conferma l'eliminazione")
+
+    sub.add_parser("tempi-avvio", help="confronta il tempo di avvio con quello del menu interattivo")
+    return parser
+
+
+# Prepara lo schema con le sole tabelle indicate e ritorna il MetaData.
+def prepara(tabelle):
+    from schema_reflect import schema_riflesso
+
+    meta = schema_riflesso(tabelle=tabelle)
+    mancanti = [t for t in tabelle if t not in meta.tables]
+    if mancanti:
+        raise RuntimeError("Nel Database mancano le tabelle richieste: " + ", ".join(mancanti))
+    return meta
+
+
+def _query(args) -> int:
+    import output
+    import queries
+    from database import engine_lettura
+
+    chiave, tabelle, nomi_param = COMANDI_QUERY[args.nome]
+    valori = {"nome": args.p_nome, "cognome": args.cognome, "ragione_sociale": args.ragione_sociale}
+    params = {p: valori[p] for p in nomi_param}
+    mancanti = [p for p, v in params.items() if v is None]
+    if mancanti:
+        print(f"Parametri mancanti: {', '.join('--' + p.replace('_', '-') for p in mancanti)}", file=sys.stderr)
+        return USO_ERRATO
+
+    meta = prepara(tabelle)
+    with engine_lettura().connect() as conn:
+        res = output.risultato_in_streaming(conn, queries.catalogo(meta)[chiave], params)
+        output.SCRITTORI[args.format](list(res.keys()), res.partitions())
+    return OK
+
+
+def _aggiorna_stato(args) -> int:
+    import queries
+    from database import engine
+    from campi import leggi_id
+
+    meta = prepara(TABELLE_RIPARAZIONI)
+    ids = leggi_id(args.id)
+    with engine.begin() as conn:
+        n = queries.aggiorna_stato_riparazioni(conn, meta, {i: args.stato for i in ids})
+    print(f"Aggiornate {n} riparazioni su {len(ids)}")
+    return OK if n else NESSUNA_RIGA
+
+
+def _elimina_riparazioni(args) -> int:
+    import queries
+    from database import engine
+    from campi import leggi_id
+    from schema_reflect import TABELLE_RICHIESTE
+
+    if not args.si:
+        print("Eliminazione non confermata: aggiungere --si", file=sys.stderr)
+        return USO_ERRATO
+    # tutte le tabelle: le righe che dipendono dalle riparazioni si eliminano con loro
+    meta = prepara(TABELLE_RICHIESTE)
+    ids = leggi_id(args.id)
+    with engine.begin() as conn:
+        eliminate = queries.elimina_riparazioni(conn, meta, ids)
+    print(queries.riepilogo_eliminazione(eliminate, len(ids)))
+    return OK if eliminate["Riparazione"] else NESSUNA_RIGA
+
+
+# Misura in processi separati il tempo dei comandi veri: il menu interattivo
+# avviato e chiuso subito (scelta 0) e "main.py query" con l'output scartato.
+# Ritorna {percorso: secondi}, il migliore su più ripetizioni.
+def tempi_avvio(ripetizioni: int = 3) -> dict[str, float]:
+    cartella = os.path.dirname(os.path.abspath(__file__))
+    prove = {
+        "menu interattivo": (["main.py"], "0\n"),
+        "comando query riparazioni-con-appuntamento": (
+            ["main.py", "query", "riparazioni-con-appuntamento", "--format", "ndjson"], None
+        ),
+    }
+    tempi = {}
+    for nome, (argomenti, ingresso) in prove.items():
+        migliore = float("inf")
+        for _ in range(ripetizioni):
+            t0 = time.perf_counter()
+            subprocess.run(
+                [sys.executable, *argomenti], cwd=cartella, input=ingresso, text=True,
+                stdout=subprocess.DEVNULL, check=True,
+            )
+            migliore = min(migliore, time.perf_counter() - t0)
+        tempi[nome] = migliore
+    return tempi
+
+
+# Esegue il comando indicato dagli argomenti e ritorna il codice di uscita.
+def esegui_comando(argv) -> int:
+    try:
+        args = _parser().parse_args(argv)
+    except SystemExit as e:
+        return USO_ERRATO if e.code else OK
+
+    try:
+        if args.comando == "query":
+            return _query(args)
+        if args.comando == "aggiorna-stato":
+            return _aggiorna_stato(args)
+        if args.comando == "elimina-riparazioni":
+            return _elimina_riparazioni(args)
+        if args.comando == "tempi-avvio":
+            for nome, secondi in tempi_avvio().items():
+                print(f"{nome}: {secondi * 1000:.0f} ms")
+            return OK
+    except BrokenPipeError:
+        return OK
+    except Exception as e:
+        print(f"ERRORE: {e}", file=sys.stderr)
+        return ERRORE
+    return USO_ERRATO
+
+
+if __name__ == "__main__":
+    sys.exit(esegui_comando(sys.argv[1:]))
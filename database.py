@@ -4,14 +4,372 @@
 # ---------------------------------------------------------------------
 #
 
+import argparse
+import json
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import create_engine, event, inspect, text, MetaData, Table, Column, Integer, DateTime, select, update, insert
+from sqlalchemy.pool import QueuePool
 
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASS = os.getenv("DB_PASS", "password") # password originale nascosta
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1")
 DB_NAME = os.getenv("DB_NAME", "CentroRiparazioni")
 
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
+# URL completo (es. sqlite:///prova.db per le prove in locale); se assente si usa MySQL
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}",
+)
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
+# Parametri del pool di connessioni
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))            # connessioni tenute aperte
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))     # connessioni extra nei picchi
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))   # secondi, < wait_timeout di MySQL
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))   # attesa massima di una connessione
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"  # verifica la connessione prima dell'uso
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "0"))        # connessioni da aprire all'avvio
+
+# Repliche in sola lettura (URL separati da virgola, es. due file SQLite o due MySQL locali)
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+DB_REPLICA_LAG_MAX = float(os.getenv("DB_REPLICA_LAG_MAX", "5"))        # secondi di ritardo tollerati
+DB_REPLICA_CONTROLLO = float(os.getenv("DB_REPLICA_CONTROLLO", "10"))   # secondi tra due controlli
+DB_BATTITO_INTERVALLO = float(os.getenv("DB_BATTITO_INTERVALLO", "0"))  # secondi tra due battiti (0 = nessuno)
+
+
+# -------------------------
+# STATISTICHE DEL POOL
+# -------------------------
+
+_lock_statistiche = threading.Lock()
+_statistiche: dict[int, dict] = {}  # id(engine) -> contatori del suo pool
+
+
+def _nuove_statistiche() -> dict:
+    return {
+        "checkout": 0,
+        "connessioni_create": 0,
+        "invalidazioni": 0,
+        "attesa_totale_ms": 0.0,
+        "attesa_max_ms": 0.0,
+    }
+
+
+# Pool che misura quanto si aspetta per ottenere una connessione.
+# Ogni engine ha una sottoclasse con i propri contatori (vedi _classe_pool), che
+# resta anche quando SQLAlchemy ricrea il pool (dispose).
+class PoolConMetriche(QueuePool):
+    statistiche: dict = {}
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            attesa = (time.perf_counter() - t0) * 1000
+            with _lock_statistiche:
+                self.statistiche["attesa_totale_ms"] += attesa
+                self.statistiche["attesa_max_ms"] = max(self.statistiche["attesa_max_ms"], attesa)
+
+
+def _classe_pool(stat: dict):
+    return type("PoolConMetriche", (PoolConMetriche,), {"statistiche": stat})
+
+
+# Crea l'engine con i parametri del pool letti dall'ambiente.
+def crea_engine(url: str = DATABASE_URL):
+    stat = _nuove_statistiche()
+    opzioni = {"echo": False, "future": True, "pool_pre_ping": DB_POOL_PRE_PING}
+    if ":memory:" not in url:
+        opzioni.update(
+            poolclass=_classe_pool(stat),
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    eng = create_engine(url, **opzioni)
+    with _lock_statistiche:
+        _statistiche[id(eng)] = stat
+    _registra_eventi_pool(eng, stat)
+    return eng
+
+
+def _conta(stat: dict, nome: str):
+    def listener(*_args):
+        with _lock_statistiche:
+            stat[nome] += 1
+    return listener
+
+
+def _registra_eventi_pool(eng, stat: dict):
+    event.listen(eng, "checkout", _conta(stat, "checkout"))
+    event.listen(eng, "connect", _conta(stat, "connessioni_create"))
+    event.listen(eng, "invalidate", _conta(stat, "invalidazioni"))
+    event.listen(eng, "soft_invalidate", _conta(stat, "invalidazioni"))
+
+
+engine = crea_engine()
+
+
+# Apre n connessioni insieme e le rimette nel pool, così le prime azioni
+# dell'utente non pagano la latenza di connessione. Ritorna le connessioni aperte.
+def riscalda_pool(n: int = DB_POOL_WARMUP) -> int:
+    aperte = []
+    try:
+        for _ in range(n):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            aperte.append(conn)
+    finally:
+        for conn in aperte:
+            conn.close()
+    return len(aperte)
+
+
+# Ritorna le statistiche del pool di un engine (default il primario):
+# contatori cumulativi + stato attuale.
+def statistiche_pool(eng=None) -> dict:
+    eng = engine if eng is None else eng
+    with _lock_statistiche:
+        stat = dict(_statistiche.get(id(eng)) or _nuove_statistiche())
+    pool = eng.pool
+    stat["attesa_media_ms"] = stat["attesa_totale_ms"] / stat["checkout"] if stat["checkout"] else 0.0
+    if isinstance(pool, QueuePool):
+        stat.update(
+            dimensione=pool.size(),
+            in_uso=pool.checkedout(),
+            inattive=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+    return stat
+
+
+# Riepilogo delle statistiche dei pool, una riga per engine (per il menu).
+def riepilogo_pool() -> str:
+    righe = []
+    for eng in tutti_gli_engine():
+        s = statistiche_pool(eng)
+        riga = (
+            f"pool {nome_engine(eng)}: checkout={s['checkout']} connessioni_create={s['connessioni_create']} "
+            f"invalidazioni={s['invalidazioni']} attesa_media={s['attesa_media_ms']:.2f}ms "
+            f"attesa_max={s['attesa_max_ms']:.2f}ms"
+        )
+        if "dimensione" in s:
+            riga += f" | in_uso={s['in_uso']} inattive={s['inattive']} overflow={s['overflow']}"
+        righe.append(riga)
+    return "\n".join(righe)
+
+
+# Scrive le statistiche dei pool in un file JSON: {nome_engine: statistiche}.
+def esporta_statistiche_pool(percorso: str):
+    with open(percorso, "w", encoding="utf-8") as f:
+        json.dump({nome_engine(e): statistiche_pool(e) for e in tutti_gli_engine()}, f, indent=2)
+
+
+# -------------------------
+# REPLICHE E INSTRADAMENTO DELLE LETTURE
+# Le letture (query q_*, report, esportazioni) vanno a una replica sana e
+# aggiornata; scritture e letture subito dopo una scrittura restano sul primario.
+# -------------------------
+
+# Tabella del "battito" per misurare il ritardo delle repliche non MySQL:
+# un lavoro periodico separato (battito_periodico o "python database.py battito")
+# scrive l'ora sul primario, il controllo delle repliche ne legge solo l'età.
+_meta_battito = MetaData()
+BattitoReplica = Table(
+    "BattitoReplica", _meta_battito,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("istante", DateTime, nullable=False),
+)
+
+repliche = [crea_engine(url) for url in DATABASE_REPLICA_URLS]
+
+_lock_repliche = threading.Lock()
+_stato_repliche = {id(r): {"sana": False, "ritardo": None, "errore": None, "controllato_il": None} for r in repliche}
+_prossima_replica = 0
+_ultimo_controllo = None
+_ultima_scrittura = None
+_query_per_engine = Counter()
+
+
+def nome_engine(eng) -> str:
+    if eng is engine:
+        return "primario"
+    return f"replica{repliche.index(eng) + 1}"
+
+
+def _conta_query(nome: str):
+    def listener(*_args):
+        with _lock_repliche:
+            _query_per_engine[nome] += 1
+    return listener
+
+
+# Un errore di connessione su una replica la esclude fino al prossimo controllo.
+def _replica_in_errore(contesto):
+    if contesto.is_disconnect and contesto.engine is not None:
+        with _lock_repliche:
+            stato = _stato_repliche.get(id(contesto.engine))
+            if stato is not None:
+                stato.update(sana=False, errore=str(contesto.original_exception).splitlines()[0])
+
+
+def _registra_eventi_instradamento():
+    event.listen(engine, "before_cursor_execute", _conta_query("primario"))
+    for replica in repliche:
+        event.listen(replica, "before_cursor_execute", _conta_query(nome_engine(replica)))
+        event.listen(replica, "handle_error", _replica_in_errore)
+
+
+_registra_eventi_instradamento()
+
+
+# Tutti gli engine configurati (primario per primo).
+def tutti_gli_engine() -> list:
+    return [engine] + repliche
+
+
+# Crea la tabella del battito sul primario (una volta, all'avvio del lavoro periodico).
+def prepara_battito():
+    if engine.dialect.name != "mysql":
+        _meta_battito.create_all(engine, checkfirst=True)
+
+# Scrive il battito sul primario (solo per database diversi da MySQL).
+def battito():
+    if engine.dialect.name == "mysql":
+        return
+    with engine.begin() as conn:
+        adesso = datetime.now()
+        if conn.execute(update(BattitoReplica).where(BattitoReplica.c.id == 1).values(istante=adesso)).rowcount == 0:
+            conn.execute(insert(BattitoReplica).values(id=1, istante=adesso))
+
+# Avvia un thread che scrive il battito ogni `intervallo` secondi (0 = nessun thread).
+def battito_periodico(intervallo: float = DB_BATTITO_INTERVALLO):
+    if intervallo <= 0 or not repliche or engine.dialect.name == "mysql":
+        return None
+    prepara_battito()
+
+    def ciclo():
+        while True:
+            try:
+                battito()
+            except Exception:
+                pass  # il primario non accetta scritture: le repliche risulteranno in ritardo
+            time.sleep(intervallo)
+
+    t = threading.Thread(target=ciclo, name="battito-repliche", daemon=True)
+    t.start()
+    return t
+
+
+# Ritardo della replica in secondi (None se non misurabile).
+# MySQL: Seconds_Behind_Source di SHOW REPLICA STATUS; altri database: età del battito.
+def ritardo_replica(conn):
+    if conn.dialect.name == "mysql":
+        try:
+            riga = conn.execute(text("SHOW REPLICA STATUS")).mappings().first()
+            chiave = "Seconds_Behind_Source"
+        except Exception:
+            riga = conn.execute(text("SHOW SLAVE STATUS")).mappings().first()
+            chiave = "Seconds_Behind_Master"
+        if riga is None:
+            return 0.0  # non è configurata come replica: nessun ritardo
+        valore = riga.get(chiave)
+        return None if valore is None else float(valore)
+    if not inspect(conn).has_table(BattitoReplica.name):
+        return None
+    istante = conn.execute(select(BattitoReplica.c.istante).where(BattitoReplica.c.id == 1)).scalar()
+    return None if istante is None else max(0.0, (datetime.now() - istante).total_seconds())
+
+
+# Controlla tutte le repliche (connessione e ritardo) e aggiorna il loro stato.
+# Solo letture: il battito lo scrive battito_periodico.
+def controlla_repliche():
+    global _ultimo_controllo
+    if not repliche:
+        return {}
+    for replica in repliche:
+        stato = {"sana": False, "ritardo": None, "errore": None, "controllato_il": time.time()}
+        try:
+            with replica.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                stato["ritardo"] = ritardo_replica(conn)
+            if stato["ritardo"] is None:
+                stato["errore"] = "ritardo non misurabile"
+            elif stato["ritardo"] > DB_REPLICA_LAG_MAX:
+                stato["errore"] = f"ritardo {stato['ritardo']:.1f}s > {DB_REPLICA_LAG_MAX:.0f}s"
+            else:
+                stato["sana"] = True
+        except Exception as e:
+            stato["errore"] = str(e).splitlines()[0]
+        with _lock_repliche:
+            _stato_repliche[id(replica)] = stato
+    _ultimo_controllo = time.monotonic()
+    return stato_repliche()
+
+
+# Da chiamare dopo il commit di una scrittura: per DB_REPLICA_LAG_MAX secondi
+# le letture restano sul primario, così si rilegge ciò che si è appena scritto.
+def segna_scrittura():
+    global _ultima_scrittura
+    _ultima_scrittura = time.monotonic()
+
+
+# Engine da usare per una lettura: una replica sana (a rotazione), altrimenti il primario.
+def engine_lettura():
+    global _prossima_replica
+    if not repliche:
+        return engine
+    if _ultima_scrittura is not None and time.monotonic() - _ultima_scrittura < DB_REPLICA_LAG_MAX:
+        return engine
+    if _ultimo_controllo is None or time.monotonic() - _ultimo_controllo >= DB_REPLICA_CONTROLLO:
+        controlla_repliche()
+    with _lock_repliche:
+        for _ in range(len(repliche)):
+            replica = repliche[_prossima_replica % len(repliche)]
+            _prossima_replica += 1
+            if _stato_repliche[id(replica)]["sana"]:
+                return replica
+    return engine
+
+
+# Stato delle repliche: {nome: {sana, ritardo, errore, controllato_il}}.
+def stato_repliche() -> dict:
+    with _lock_repliche:
+        return {nome_engine(r): dict(_stato_repliche[id(r)]) for r in repliche}
+
+
+# Riepilogo dell'instradamento su una riga per engine (per il menu).
+def riepilogo_instradamento() -> str:
+    with _lock_repliche:
+        conteggi = dict(_query_per_engine)
+    righe = [f"primario: query={conteggi.get('primario', 0)}"]
+    for nome, stato in stato_repliche().items():
+        ritardo = "-" if stato["ritardo"] is None else f"{stato['ritardo']:.1f}s"
+        righe.append(
+            f"{nome}: query={conteggi.get(nome, 0)} sana={'si' if stato['sana'] else 'no'} "
+            f"ritardo={ritardo}" + (f" ({stato['errore']})" if stato["errore"] else "")
+        )
+    return "\n".join(righe)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lavori di servizio sul database")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    b = sub.add_parser("battito", help="scrive il battito per il ritardo delle repliche non MySQL")
+    b.add_argument("--intervallo", type=float, default=DB_BATTITO_INTERVALLO or 1.0, help="secondi tra due battiti")
+    b.add_argument("--una-volta", action="store_true", help="scrive un solo battito ed esce")
+    args = parser.parse_args()
+
+    if engine.dialect.name == "mysql":
+        parser.exit(0, "MySQL: il ritardo si legge da SHOW REPLICA STATUS, nessun battito da scrivere\n")
+    prepara_battito()
+    while True:
+        battito()
+        if args.una_volta:
+            break
+        time.sleep(args.intervallo)
@@ -0,0 +1,242 @@
+# dati_sintetici.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO LO SCHEMA DI PROVA E IL GENERATORE DI DATI SINTETICI
+# Lo schema riproduce le 18 tabelle richieste da controllo_tabelle_richieste
+# (con le colonne usate dall'applicativo) e viene creato su un database locale
+# (SQLite) per i benchmark. I dati sono "sbilanciati" come quelli reali:
+# pochi clienti hanno molti dispositivi, gli stati non sono equiprobabili,
+# gli appuntamenti si concentrano negli ultimi mesi.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import random
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, Date, Numeric, ForeignKey, Index,
+)
+from indici import INDICI_CONSIGLIATI, nome_indice
+
+# Righe inserite per ogni executemany durante la generazione.
+BLOCCO_GENERAZIONE = 10000
+
+STATI = ["Aperta", "In lavorazione", "In attesa ricambi", "Chiusa", "Consegnata"]
+PESI_STATI = [15, 10, 5, 40, 30]
+NOMI = ["Mario", "Luca", "Giulia", "Anna", "Marco", "Sara", "Paolo", "Elena", "Davide", "Chiara"]
+COGNOMI = ["Rossi", "Bianchi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco"]
+MARCHE = ["Apple", "Samsung", "Xiaomi", "Dell", "HP", "Lenovo", "Huawei", "Asus"]
+TIPI = ["Smartphone", "PC", "Tablet", "Notebook"]
+
+
+# Ritorna un MetaData con le 18 tabelle dello schema CentroRiparazioni.
+def schema_prova() -> MetaData:
+    m = MetaData()
+    pk = dict(primary_key=True, autoincrement=False)
+    Table("Cliente", m, Column("idCliente", Integer, **pk), Column("tipoCliente", String(20), nullable=False),
+          Column("email", String(100)))
+    Table("ClientePrivato", m, Column("idCliente", Integer, ForeignKey("Cliente.idCliente"), **pk),
+          Column("nome", String(50), nullable=False), Column("cognome", String(50), nullable=False),
+          Column("codiceFiscale", String(16)), Column("telefono", String(20)))
+    Table("ClienteBusiness", m, Column("idCliente", Integer, ForeignKey("Cliente.idCliente"), **pk),
+          Column("ragioneSociale", String(100), nullable=False), Column("partitaIVA", String(11)),
+          Column("telefono", String(20)))
+    Table("Dispositivo", m, Column("idDispositivo", Integer, **pk),
+          Column("idCliente", Integer, ForeignKey("Cliente.idCliente"), nullable=False),
+          Column("tipoDispositivo", String(30)), Column("marca", String(30)), Column("modello", String(30)),
+          Column("numeroSerie", String(40)))
+    Table("Riparazione", m, Column("idRiparazione", Integer, **pk),
+          Column("idDispositivo", Integer, ForeignKey("Dispositivo.idDispositivo"), nullable=False),
+          Column("stato", String(20), nullable=False), Column("dataIngresso", DateTime, nullable=False),
+          Column("dataChiusura", DateTime))
+    Table("Appuntamento", m, Column("idAppuntamento", Integer, **pk),
+          Column("idRiparazione", Integer, ForeignKey("Riparazione.idRiparazione"), nullable=False),
+          Column("dataOra", DateTime, nullable=False))
+    Table("Tecnico", m, Column("idTecnico", Integer, **pk), Column("nome", String(50), nullable=False),
+          Column("cognome", String(50), nullable=False))
+    Table("Intervento", m, Column("idIntervento", Integer, **pk),
+          Column("idRiparazione", Integer, ForeignKey("Riparazione.idRiparazione"), nullable=False),
+          Column("idTecnico", Integer, ForeignKey("Tecnico.idTecnico"), nullable=False),
+          Column("dataInizio", DateTime), Column("dataFine", DateTime), Column("descrizione", String(200)))
+    Table("Ricambio", m, Column("idRicambio", Integer, **pk), Column("nome", String(50), nullable=False),
+          Column("prezzo", Numeric(10, 2)), Column("scortaMinima", Integer))
+    Table("Preventivo", m, Column("idPreventivo", Integer, **pk),
+          Column("idRiparazione", Integer, ForeignKey("Riparazione.idRiparazione"), nullable=False),
+          Column("data", Date), Column("importoTotale", Numeric(10, 2)), Column("accettato", Integer))
+    Table("DettaglioPreventivo", m,
+          Column("idPreventivo", Integer, ForeignKey("Preventivo.idPreventivo"), primary_key=True),
+          Column("idRicambio", Integer, ForeignKey("Ricambio.idRicambio"), primary_key=True),
+          Column("quantita", Integer, nullable=False), Column("prezzoUnitario", Numeric(10, 2)))
+    Table("Pagamento", m, Column("idPagamento", Integer, **pk),
+          Column("idRiparazione", Integer, ForeignKey("Riparazione.idRiparazione"), nullable=False),
+          Column("importo", Numeric(10, 2), nullable=False), Column("dataPagamento", DateTime),
+          Column("metodo", String(20)))
+    Table("Fornitore", m, Column("idFornitore", Integer, **pk), Column("ragioneSociale", String(100), nullable=False))
+    Table("Fornitura", m, Column("idFornitura", Integer, **pk),
+          Column("idFornitore", Integer, ForeignKey("Fornitore.idFornitore"), nullable=False),
+          Column("idRicambio", Integer, ForeignKey("Ricambio.idRicambio"), nullable=False),
+          Column("quantita", Integer, nullable=False), Column("data", Date))
+    Table("Ordine", m, Column("idOrdine", Integer, **pk),
+          Column("idFornitore", Integer, ForeignKey("Fornitore.idFornitore")), Column("data", Date))
+    Table("DettaglioOrdine", m,
+          Column("idOrdine", Integer, ForeignKey("Ordine.idOrdine"), primary_key=True),
+          Column("idRicambio", Integer, ForeignKey("Ricambio.idRicambio"), primary_key=True),
+          Column("quantita", Integer, nullable=False))
+    Table("DocumentoFiscale", m, Column("idDocumento", Integer, **pk),
+          Column("idPagamento", Integer, ForeignKey("Pagamento.idPagamento"), nullable=False),
+          Column("numero", String(20)), Column("data", Date))
+    Table("Garanzia", m, Column("idGaranzia", Integer, **pk),
+          Column("idRiparazione", Integer, ForeignKey("Riparazione.idRiparazione"), nullable=False),
+          Column("dataInizio", Date), Column("dataFine", Date))
+    return m
+
+
+# Crea lo schema di prova sull'engine (e, se richiesto, gli indici consigliati).
+def crea_schema(engine, indici: bool = True) -> MetaData:
+    meta = schema_prova()
+    if indici:
+        for nome, colonne in INDICI_CONSIGLIATI:
+            t = meta.tables[nome]
+            Index(nome_indice(nome, colonne), *[t.c[c] for c in colonne])
+    meta.drop_all(engine)
+    meta.create_all(engine)
+    return meta
+
+
+# Inserisce le righe prodotte da un generatore con executemany a blocchi.
+def _inserisci(conn, table, righe) -> int:
+    n = 0
+    blocco = []
+    for r in righe:
+        blocco.append(r)
+        if len(blocco) >= BLOCCO_GENERAZIONE:
+            conn.execute(table.insert(), blocco)
+            n += len(blocco)
+            blocco = []
+    if blocco:
+        conn.execute(table.insert(), blocco)
+        n += len(blocco)
+    return n
+
+
+# Popola lo schema con dati sintetici proporzionati al numero di riparazioni.
+# Ritorna {tabella: righe inserite} e il tempo impiegato in "secondi".
+def genera(engine, meta, riparazioni: int = 1000, seme: int = 42) -> dict:
+    rnd = random.Random(seme)
+    t = meta.tables
+    n_clienti = max(10, riparazioni // 3)
+    n_dispositivi = max(10, riparazioni // 2)
+    n_tecnici = max(3, riparazioni // 2000)
+    n_ricambi = max(20, min(5000, riparazioni // 50))
+    n_fornitori = max(3, n_ricambi // 20)
+    oggi = datetime(2025, 1, 1)
+    conteggi = {}
+    t0 = time.perf_counter()
+
+    # distribuzione sbilanciata: pochi clienti con molti dispositivi (Pareto)
+    def cliente_a_caso():
+        return min(n_clienti, int(rnd.paretovariate(1.2))) if rnd.random() < 0.3 else rnd.randint(1, n_clienti)
+
+    def quando(giorni_max: int = 1500) -> datetime:
+        # più recenti più probabili
+        giorni = int(giorni_max * (rnd.random() ** 2))
+        return (oggi - timedelta(days=giorni)).replace(hour=rnd.randint(8, 18), minute=rnd.choice((0, 30)))
+
+    with engine.begin() as conn:
+        business = set(rnd.sample(range(1, n_clienti + 1), n_clienti // 5))
+        conteggi["Cliente"] = _inserisci(conn, t["Cliente"], (
+            {"idCliente": i, "tipoCliente": "Business" if i in business else "Privato", "email": f"c{i}@esempio.it"}
+            for i in range(1, n_clienti + 1)
+        ))
+        conteggi["ClientePrivato"] = _inserisci(conn, t["ClientePrivato"], (
+            {"idCliente": i, "nome": rnd.choice(NOMI), "cognome": f"{rnd.choice(COGNOMI)}{i % 997}",
+             "codiceFiscale": None, "telefono": f"3{rnd.randint(10**8, 10**9 - 1)}"}
+            for i in range(1, n_clienti + 1) if i not in business
+        ))
+        conteggi["ClienteBusiness"] = _inserisci(conn, t["ClienteBusiness"], (
+            {"idCliente": i, "ragioneSociale": f"Azienda {i} Srl", "partitaIVA": f"{i:011d}",
+             "telefono": f"0{rnd.randint(10**8, 10**9 - 1)}"}
+            for i in sorted(business)
+        ))
+        conteggi["Dispositivo"] = _inserisci(conn, t["Dispositivo"], (
+            {"idDispositivo": i, "idCliente": cliente_a_caso(), "tipoDispositivo": rnd.choice(TIPI),
+             "marca": rnd.choice(MARCHE), "modello": f"M{rnd.randint(1, 40)}", "numeroSerie": f"SN{i:09d}"}
+            for i in range(1, n_dispositivi + 1)
+        ))
+
+        def righe_riparazioni():
+            for i in range(1, riparazioni + 1):
+                ingresso = quando()
+                stato = rnd.choices(STATI, PESI_STATI)[0]
+                chiusura = ingresso + timedelta(days=rnd.randint(1, 30)) if stato in ("Chiusa", "Consegnata") else None
+                yield {"idRiparazione": i, "idDispositivo": rnd.randint(1, n_dispositivi), "stato": stato,
+                       "dataIngresso": ingresso, "dataChiusura": chiusura}
+        conteggi["Riparazione"] = _inserisci(conn, t["Riparazione"], righe_riparazioni())
+
+        # circa il 70% delle riparazioni ha un appuntamento, alcune più di uno
+        def righe_appuntamenti():
+            n = 0
+            for r in range(1, riparazioni + 1):
+                for _ in range(rnd.choices((0, 1, 2), (30, 60, 10))[0]):
+                    n += 1
+                    yield {"idAppuntamento": n, "idRiparazione": r, "dataOra": quando(1600)}
+        conteggi["Appuntamento"] = _inserisci(conn, t["Appuntamento"], righe_appuntamenti())
+
+        conteggi["Tecnico"] = _inserisci(conn, t["Tecnico"], (
+            {"idTecnico": i, "nome": rnd.choice(NOMI), "cognome": rnd.choice(COGNOMI)} for i in range(1, n_tecnici + 1)
+        ))
+        conteggi["Intervento"] = _inserisci(conn, t["Intervento"], (
+            {"idIntervento": i, "idRiparazione": i, "idTecnico": rnd.randint(1, n_tecnici),
+             "dataInizio": oggi - timedelta(days=rnd.randint(1, 1500)), "dataFine": None, "descrizione": None}
+            for i in range(1, riparazioni + 1)
+        ))
+        conteggi["Ricambio"] = _inserisci(conn, t["Ricambio"], (
+            {"idRicambio": i, "nome": f"Ricambio {i}", "prezzo": round(rnd.uniform(5, 300), 2),
+             "scortaMinima": rnd.randint(1, 20)}
+            for i in range(1, n_ricambi + 1)
+        ))
+        n_preventivi = riparazioni // 2
+        conteggi["Preventivo"] = _inserisci(conn, t["Preventivo"], (
+            {"idPreventivo": i, "idRiparazione": 2 * i - 1, "data": date(2024, 1, 1) + timedelta(days=i % 365),
+             "importoTotale": round(rnd.uniform(20, 600), 2), "accettato": rnd.choice((0, 1))}
+            for i in range(1, n_preventivi + 1)
+        ))
+        conteggi["DettaglioPreventivo"] = _inserisci(conn, t["DettaglioPreventivo"], (
+            {"idPreventivo": i, "idRicambio": rnd.randint(1, n_ricambi), "quantita": rnd.randint(1, 3),
+             "prezzoUnitario": round(rnd.uniform(5, 300), 2)}
+            for i in range(1, n_preventivi + 1)
+        ))
+        n_pagamenti = riparazioni * 6 // 10
+        conteggi["Pagamento"] = _inserisci(conn, t["Pagamento"], (
+            {"idPagamento": i, "idRiparazione": i, "importo": round(rnd.uniform(20, 600), 2),
+             "dataPagamento": quando(), "metodo": rnd.choice(("Contanti", "Carta", "Bonifico"))}
+            for i in range(1, n_pagamenti + 1)
+        ))
+        conteggi["DocumentoFiscale"] = _inserisci(conn, t["DocumentoFiscale"], (
+            {"idDocumento": i, "idPagamento": i, "numero": f"F{i:08d}", "data": date(2024, 1, 1)}
+            for i in range(1, n_pagamenti + 1)
+        ))
+        conteggi["Garanzia"] = _inserisci(conn, t["Garanzia"], (
+            {"idGaranzia": i, "idRiparazione": i * 3, "dataInizio": date(2024, 1, 1), "dataFine": date(2025, 1, 1)}
+            for i in range(1, riparazioni // 3 + 1)
+        ))
+        conteggi["Fornitore"] = _inserisci(conn, t["Fornitore"], (
+            {"idFornitore": i, "ragioneSociale": f"Fornitore {i}"} for i in range(1, n_fornitori + 1)
+        ))
+        conteggi["Fornitura"] = _inserisci(conn, t["Fornitura"], (
+            {"idFornitura": i, "idFornitore": rnd.randint(1, n_fornitori), "idRicambio": rnd.randint(1, n_ricambi),
+             "quantita": rnd.randint(1, 50), "data": date(2020, 1, 1) + timedelta(days=i % 1800)}
+            for i in range(1, riparazioni // 5 + 1)
+        ))
+        n_ordini = max(1, riparazioni // 20)
+        conteggi["Ordine"] = _inserisci(conn, t["Ordine"], (
+            {"idOrdine": i, "idFornitore": rnd.randint(1, n_fornitori), "data": date(2020, 1, 1) + timedelta(days=i % 1800)}
+            for i in range(1, n_ordini + 1)
+        ))
+        conteggi["DettaglioOrdine"] = _inserisci(conn, t["DettaglioOrdine"], (
+            {"idOrdine": i, "idRicambio": rnd.randint(1, n_ricambi), "quantita": rnd.randint(1, 10)}
+            for i in range(1, n_ordini + 1)
+        ))
+
+    conteggi["secondi"] = time.perf_counter() - t0
+    return conteggi
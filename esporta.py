@@ -0,0 +1,327 @@
+# esporta.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'ESPORTAZIONE DEI RISULTATI SU FILE
+# Esporta uno statement del catalogo di queries.py o un'intera tabella del
+# MetaData riflesso in CSV, NDJSON oppure (se pyarrow è installato) Parquet o
+# Arrow. Le righe arrivano dal cursore lato server a blocchi e ogni blocco
+# viene scritto subito: la memoria usata non dipende dalla dimensione della tabella.
+# Con mysql-connector (nessun cursore lato server) tabelle e statement del
+# catalogo si leggono a blocchi keyset (WHERE chiave > ultima ORDER BY chiave
+# LIMIT n), con chiave = ORDER BY (o GROUP BY) dello statement completato dalle
+# PK delle tabelle nella FROM; se una chiave stabile non c'è, l'esportazione
+# viene rifiutata invece di caricare tutto in memoria.
+#
+#   python esporta.py Riparazione --formato parquet --output riparazioni.parquet
+#   python esporta.py q_agenda_appuntamenti --param da=2024-06-03 --param a=2024-06-10
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime
+from sqlalchemy import select, types, and_, or_, Column, Label, UnaryExpression
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.util import find_tables
+import output
+import queries
+
+# pyarrow è opzionale: serve solo per Parquet e Arrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Righe lette dal cursore (e scritte) per ogni blocco. Per Parquet ogni blocco
+# diventa un row group, quindi conviene un blocco più grande di quello della stampa.
+BLOCCO_ESPORTAZIONE = int(os.getenv("BLOCCO_ESPORTAZIONE", "10000"))
+
+FORMATI = ("csv", "ndjson", "parquet", "arrow")
+
+
+# Ritorna lo statement da esportare: uno statement del catalogo oppure
+# SELECT * di una tabella del MetaData.
+def statement_sorgente(meta, sorgente: str):
+    if sorgente in queries._COSTRUTTORI:
+        if not sorgente.startswith("q_"):
+            raise ValueError(f"{sorgente} non è una SELECT: non si può esportare.")
+        return queries.catalogo(meta)[sorgente]
+    if sorgente in meta.tables:
+        return select(meta.tables[sorgente])
+    raise ValueError(f"Sorgente sconosciuta: {sorgente} (né statement di queries.py né tabella).")
+
+# Converte i parametri passati come testo nel tipo del rispettivo bindparam
+# (date e numeri); i parametri "expanding" si passano separati da virgola.
+def converti_parametri(stmt, grezzi: dict) -> dict:
+    binds = {bp.key: bp for bp in stmt.compile().binds.values()}
+    params = {}
+    for nome, testo in grezzi.items():
+        bp = binds.get(nome)
+        if bp is None:
+            raise ValueError(f"Parametro sconosciuto: {nome}")
+        valori = testo.split(",") if bp.expanding else [testo]
+        try:
+            py = bp.type.python_type
+        except NotImplementedError:
+            py = str
+        if py is datetime:
+            valori = [datetime.fromisoformat(v) for v in valori]
+        elif py is date:
+            valori = [date.fromisoformat(v) for v in valori]
+        elif py in (int, float):
+            valori = [py(v) for v in valori]
+        params[nome] = valori if bp.expanding else valori[0]
+    return params
+
+
+# -------------------------
+# TIPI ARROW DALLE COLONNE RIFLESSE
+# -------------------------
+
+# Tipo Arrow corrispondente al tipo SQLAlchemy di una colonna.
+def tipo_arrow(tipo):
+    if isinstance(tipo, types.Boolean):
+        return pa.bool_()
+    if isinstance(tipo, types.Integer):
+        return pa.int64()
+    if isinstance(tipo, types.Float):
+        return pa.float64()
+    if isinstance(tipo, types.Numeric):
+        if tipo.asdecimal and tipo.precision:
+            return pa.decimal128(tipo.precision, tipo.scale or 0)
+        return pa.float64()
+    if isinstance(tipo, types.DateTime):
+        return pa.timestamp("us")
+    if isinstance(tipo, types.Date):
+        return pa.date32()
+    if isinstance(tipo, types.Time):
+        return pa.time64("us")
+    if isinstance(tipo, types._Binary):
+        return pa.binary()
+    return pa.string()
+
+# Schema Arrow delle colonne selezionate dallo statement.
+def schema_arrow(stmt):
+    return pa.schema([(c.name, tipo_arrow(c.type)) for c in stmt.selected_columns])
+
+# Converte un blocco di righe in un RecordBatch (una colonna alla volta).
+def blocco_arrow(schema, blocco):
+    colonne = []
+    for i, campo in enumerate(schema):
+        valori = [r[i] for r in blocco]
+        if pa.types.is_string(campo.type):
+            valori = [v if v is None or isinstance(v, str) else output.formatta_valore(v) for v in valori]
+        colonne.append(pa.array(valori, type=campo.type))
+    return pa.RecordBatch.from_arrays(colonne, schema=schema)
+
+
+# -------------------------
+# SCRITTORI SU FILE
+# -------------------------
+
+def _scrivi_testo(scrittore, percorso, **apertura):
+    def scrivi(stmt, colonne, blocchi):
+        if percorso in (None, "-"):
+            return scrittore(colonne, blocchi, sys.stdout)
+        with open(percorso, "w", encoding="utf-8", **apertura) as f:
+            return scrittore(colonne, blocchi, f)
+    return scrivi
+
+def _scrivi_parquet(percorso):
+    def scrivi(stmt, colonne, blocchi):
+        schema = schema_arrow(stmt)
+        n = 0
+        with pq.ParquetWriter(percorso, schema) as w:
+            for blocco in blocchi:
+                if blocco:
+                    w.write_batch(blocco_arrow(schema, blocco))
+                    n += len(blocco)
+        return n
+    return scrivi
+
+def _scrivi_arrow(percorso):
+    def scrivi(stmt, colonne, blocchi):
+        schema = schema_arrow(stmt)
+        n = 0
+        with pa.ipc.new_file(percorso, schema) as w:
+            for blocco in blocchi:
+                if blocco:
+                    w.write_batch(blocco_arrow(schema, blocco))
+                    n += len(blocco)
+        return n
+    return scrivi
+
+def scrittore(formato: str, percorso: str | None):
+    if formato == "csv":
+        return _scrivi_testo(output.scrivi_csv, percorso, newline="")
+    if formato == "ndjson":
+        return _scrivi_testo(output.scrivi_ndjson, percorso)
+    if formato in ("parquet", "arrow"):
+        if pa is None:
+            raise RuntimeError(f"Il formato {formato} richiede pyarrow (pip install pyarrow).")
+        if percorso in (None, "-"):
+            raise ValueError(f"Il formato {formato} richiede un file di output.")
+        return _scrivi_parquet(percorso) if formato == "parquet" else _scrivi_arrow(percorso)
+    raise ValueError(f"Formato non valido: {formato} (ammessi: {', '.join(FORMATI)})")
+
+
+# Risolve un elemento di ORDER BY / GROUP BY nell'espressione da confrontare
+# (le etichette come "intervallo" nell'espressione selezionata con quel nome).
+def _espressione(stmt, elemento):
+    if isinstance(elemento, UnaryExpression):
+        elemento = elemento.element
+    if isinstance(elemento, Label):
+        return elemento.element
+    if isinstance(elemento, Column):
+        return elemento
+    nome = getattr(elemento, "name", None)
+    scelta = stmt.selected_columns.get(nome) if nome else None
+    if isinstance(scelta, Label):
+        return scelta.element
+    return scelta
+
+# Chiave per leggere lo statement a blocchi keyset: l'ORDER BY dello statement,
+# completato dal GROUP BY oppure dalle PK delle tabelle nella FROM, così ogni
+# riga ha una chiave diversa e l'ordine originale resta valido. Ritorna la lista
+# di espressioni, oppure None se lo statement non ha una chiave stabile
+# (DISTINCT, LIMIT/OFFSET, ORDER BY discendente o non risolvibile, tabelle senza PK).
+def chiave_keyset(stmt) -> list | None:
+    if stmt._distinct or stmt._limit_clause is not None or stmt._offset_clause is not None:
+        return None
+    chiave = []
+
+    def aggiungi(espr):
+        if not any(espr.compare(k) for k in chiave):
+            chiave.append(espr)
+
+    for elemento in stmt._order_by_clauses:
+        if isinstance(elemento, UnaryExpression) and elemento.modifier is not operators.asc_op:
+            return None
+        espr = _espressione(stmt, elemento)
+        if espr is None:
+            return None
+        aggiungi(espr)
+    if stmt._group_by_clauses:
+        for elemento in stmt._group_by_clauses:
+            espr = _espressione(stmt, elemento)
+            if espr is None:
+                return None
+            aggiungi(espr)
+        return chiave
+    for origine in stmt.get_final_froms():
+        for t in find_tables(origine):
+            if not t.primary_key.columns:
+                return None
+            for col in t.primary_key.columns:
+                aggiungi(col)
+    return chiave
+
+# Condizione "chiave > ultima" nell'ordine della chiave, scritta come OR di AND
+# (usa gli indici meglio del confronto tra tuple). I NULL vengono prima degli
+# altri valori in ordine crescente, come su MySQL e SQLite.
+def _dopo(chiave, ultima):
+    def uguale(c, v):
+        return c.is_(None) if v is None else c == v
+
+    def maggiore(c, v):
+        return c.is_not(None) if v is None else c > v
+
+    return or_(*[
+        and_(*[uguale(c, v) for c, v in zip(chiave[:i], ultima[:i])], maggiore(chiave[i], ultima[i]))
+        for i in range(len(chiave))
+    ])
+
+# Legge lo statement a blocchi keyset: una query per blocco, così la memoria
+# resta costante anche con driver senza cursori lato server. Le colonne della
+# chiave vengono aggiunte in coda alla SELECT e tolte dalle righe restituite.
+def blocchi_keyset(conn, stmt, chiave: list, params: dict, blocco: int, stat: dict):
+    n = len(stmt.selected_columns)
+    etichette = [c.label(f"_chiave_{i}") for i, c in enumerate(chiave)]
+    base = stmt.add_columns(*etichette).order_by(None).order_by(*etichette).limit(blocco)
+    ultima = None
+    while True:
+        corrente = base if ultima is None else base.where(_dopo(chiave, ultima))
+        parte = conn.execute(corrente, params).all()
+        if not parte:
+            return
+        stat["blocchi"] += 1
+        yield [r[:n] for r in parte]
+        if len(parte) < blocco:
+            return
+        ultima = tuple(parte[-1][n:])
+
+# Esporta una sorgente (statement del catalogo o tabella) nel formato indicato.
+# Ritorna le statistiche: righe, blocchi, secondi, righe_al_secondo.
+def esporta(conn, meta, sorgente: str, formato: str, percorso: str | None = None,
+            params: dict | None = None, blocco: int = BLOCCO_ESPORTAZIONE) -> dict:
+    stmt = statement_sorgente(meta, sorgente)
+    scrivi = scrittore(formato, percorso)
+    stat = {"righe": 0, "blocchi": 0}
+
+    def blocchi(res):
+        for parte in res.partitions():
+            stat["blocchi"] += 1
+            yield parte
+
+    t0 = time.perf_counter()
+    if output.streaming_reale(conn):
+        res = output.risultato_in_streaming(conn, stmt, params, blocco)
+        stat["righe"] = scrivi(stmt, list(res.keys()), blocchi(res))
+    else:
+        chiave = chiave_keyset(stmt)
+        if chiave is None:
+            raise ValueError(
+                f"{sorgente}: il driver {conn.dialect.driver} non ha cursori lato server e lo statement "
+                "non ha un ordinamento stabile per la lettura a blocchi (usare mysql+pymysql)."
+            )
+        colonne = list(stmt.selected_columns.keys())
+        stat["righe"] = scrivi(stmt, colonne, blocchi_keyset(conn, stmt, chiave, params or {}, blocco, stat))
+    stat["secondi"] = time.perf_counter() - t0
+    stat["righe_al_secondo"] = stat["righe"] / stat["secondi"] if stat["secondi"] else 0.0
+    return stat
+
+
+def _main(argv=None) -> int:
+    import tracemalloc
+    from database import engine_lettura
+    from schema_reflect import schema_riflesso
+
+    parser = argparse.ArgumentParser(description="Esporta uno statement di queries.py o una tabella su file")
+    parser.add_argument("sorgente", help="statement del catalogo (q_...) o nome di una tabella")
+    parser.add_argument("--formato", choices=FORMATI, default="csv")
+    parser.add_argument("--output", default="-", help="file di destinazione (- = stdout, solo csv/ndjson)")
+    parser.add_argument("--param", action="append", default=[], metavar="NOME=VALORE")
+    parser.add_argument("--blocco", type=int, default=BLOCCO_ESPORTAZIONE)
+    parser.add_argument("--memoria", action="store_true", help="misura il picco di memoria (più lento)")
+    args = parser.parse_args(argv)
+
+    if args.sorgente in queries._COSTRUTTORI:
+        meta = schema_riflesso()
+    else:
+        meta = schema_riflesso(tabelle=[args.sorgente])
+    stmt = statement_sorgente(meta, args.sorgente)
+    grezzi = dict(p.split("=", 1) for p in args.param)
+    params = converti_parametri(stmt, grezzi)
+
+    if args.memoria:
+        tracemalloc.start()
+    with engine_lettura().connect() as conn:
+        stat = esporta(conn, meta, args.sorgente, args.formato, args.output, params, args.blocco)
+    riga = (
+        f"{stat['righe']} righe in {stat['blocchi']} blocchi, {stat['secondi']:.2f}s "
+        f"({stat['righe_al_secondo']:.0f} righe/s)"
+    )
+    if args.memoria:
+        _, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        riga += f", picco memoria {picco / 1024 / 1024:.1f} MB"
+    print(riga, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
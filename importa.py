@@ -0,0 +1,318 @@
+# importa.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'IMPORTAZIONE MASSIVA DA FILE CSV / JSONL
+# della catena Cliente -> ClientePrivato/ClienteBusiness -> Dispositivo
+# -> Riparazione -> Appuntamento.
+#
+# Ogni record del file descrive una riga della catena. I campi possono essere
+# scritti come "Tabella.colonna" oppure solo "colonna" (se non ambigua).
+# Il tipo cliente (ISA) si ricava da tipoCliente oppure dalla presenza
+# della ragione sociale. I campi speciali rifCliente / rifDispositivo
+# permettono a più record di riferirsi allo stesso cliente / dispositivo.
+#
+# Uso: python importa.py file.csv|file.jsonl [--blocco N]
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+from database import engine
+from chiavi import AllocatoreChiavi
+from schema_reflect import schema_riflesso, controllo_tabelle_richieste
+from campi import colonna_ha_default, pk_autoincrementa, interprete
+
+# Numero di record importati per ogni transazione (executemany per tabella).
+BLOCCO_IMPORT = int(os.getenv("BLOCCO_IMPORT", "1000"))
+
+# Ordine di inserimento (rispetta le FK della catena).
+CATENA = ["Cliente", "ClientePrivato", "ClienteBusiness", "Dispositivo", "Riparazione", "Appuntamento"]
+
+# Colonna che collega ogni tabella alla precedente nella catena.
+COLLEGAMENTI = {
+    "ClientePrivato": ("idCliente", "Cliente"),
+    "ClienteBusiness": ("idCliente", "Cliente"),
+    "Dispositivo": ("idCliente", "Cliente"),
+    "Riparazione": ("idDispositivo", "Dispositivo"),
+    "Appuntamento": ("idRiparazione", "Riparazione"),
+}
+
+# Chiavi primarie delle tabelle della catena.
+PK = {
+    "Cliente": "idCliente",
+    "Dispositivo": "idDispositivo",
+    "Riparazione": "idRiparazione",
+    "Appuntamento": "idAppuntamento",
+}
+
+
+# -------------------------
+# LETTURA DEI FILE
+# -------------------------
+
+# Legge un file CSV o JSONL e ritorna i record (dizionari) uno alla volta.
+def leggi_record(percorso: str):
+    if percorso.lower().endswith((".jsonl", ".ndjson")):
+        with open(percorso, encoding="utf-8") as f:
+            for riga in f:
+                riga = riga.strip()
+                if riga:
+                    yield json.loads(riga)
+    else:
+        with open(percorso, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+
+# Raggruppa i record in blocchi di dimensione fissa.
+def a_blocchi(record, dimensione: int):
+    blocco = []
+    for r in record:
+        blocco.append(r)
+        if len(blocco) >= dimensione:
+            yield blocco
+            blocco = []
+    if blocco:
+        yield blocco
+
+
+# -------------------------
+# VALIDAZIONE
+# -------------------------
+
+# Ritorna le colonne che l'utente deve fornire (stessa logica di inserisci_campi_richiesti):
+# NOT NULL, senza default e non PK autoincrement.
+def colonne_obbligatorie(table) -> list[str]:
+    richieste = []
+    for col in table.c:
+        if col.primary_key and pk_autoincrementa(col):
+            continue
+        if colonna_ha_default(col) or col.nullable:
+            continue
+        richieste.append(col.name)
+    return richieste
+
+# Converte un valore del file nel tipo della colonna (riusa interprete di campi.py).
+# Le date arrivano come testo: vengono trasformate in oggetti datetime/date.
+def converti(valore, col):
+    if not isinstance(valore, str):
+        return valore
+    v = interprete(valore, col)
+    if isinstance(v, str):
+        nome_tipo = col.type.__class__.__name__.lower()
+        try:
+            if "datetime" in nome_tipo or "timestamp" in nome_tipo:
+                return datetime.fromisoformat(v)
+            if nome_tipo == "date":
+                return date.fromisoformat(v)
+        except ValueError:
+            raise ValueError(f"{col.table.name}.{col.name}: data non valida {valore!r}")
+    return v
+
+# Divide un record piatto nei campi delle singole tabelle della catena.
+# Ritorna (tipo_cliente, {tabella: {colonna: valore}}, riferimenti).
+def dividi_record(meta, record: dict):
+    campi: dict[str, dict] = {t: {} for t in CATENA}
+    rif = {"cliente": record.get("rifCliente") or None, "dispositivo": record.get("rifDispositivo") or None}
+
+    tipo = (record.get("tipoCliente") or record.get("Cliente.tipoCliente") or "").strip().capitalize()
+    if not tipo:
+        ha_ragione = record.get("ragioneSociale") or record.get("ClienteBusiness.ragioneSociale")
+        tipo = "Business" if ha_ragione else "Privato"
+    if tipo not in ("Privato", "Business"):
+        raise ValueError(f"tipoCliente non valido: {tipo!r}")
+    figlia = "ClientePrivato" if tipo == "Privato" else "ClienteBusiness"
+    tabelle = [t for t in CATENA if t not in ("ClientePrivato", "ClienteBusiness") or t == figlia]
+
+    for chiave, valore in record.items():
+        if chiave in ("rifCliente", "rifDispositivo") or valore is None or valore == "":
+            continue
+        if "." in chiave:
+            nome_t, nome_c = chiave.split(".", 1)
+            if nome_t not in tabelle:
+                continue
+            candidate = [nome_t] if nome_c in meta.tables[nome_t].c else []
+        else:
+            nome_c = chiave
+            candidate = [t for t in tabelle if nome_c in meta.tables[t].c]
+        if not candidate:
+            raise ValueError(f"campo sconosciuto: {chiave!r}")
+        if len(candidate) > 1:
+            raise ValueError(f"campo ambiguo: {chiave!r}, usare Tabella.colonna")
+        col = meta.tables[candidate[0]].c[nome_c]
+        campi[candidate[0]][nome_c] = converti(valore, col)
+
+    if "tipoCliente" in meta.tables["Cliente"].c:
+        campi["Cliente"]["tipoCliente"] = tipo
+    return tipo, {t: campi[t] for t in tabelle}, rif
+
+# Controlla che i campi di una tabella contengano tutte le colonne obbligatorie.
+def controlla_obbligatori(table, dati: dict, richieste: list[str]):
+    mancanti = [c for c in richieste if dati.get(c) is None]
+    if mancanti:
+        raise ValueError(f"{table.name}: mancano {', '.join(mancanti)}")
+
+
+# -------------------------
+# CHIAVI
+# -------------------------
+
+# Distribuisce le chiavi primarie di una tabella prendendole dall'allocatore
+# di chiavi.py, che le riserva a blocchi grandi quanto un blocco di import.
+class BloccoChiavi:
+    def __init__(self, allocatore, table, pk_name: str):
+        self.allocatore = allocatore
+        self.table = table
+        self.pk_name = pk_name
+
+    def prendi(self) -> int:
+        return self.allocatore.prossima(self.table, self.pk_name)
+
+
+# -------------------------
+# IMPORTAZIONE
+# -------------------------
+
+# Prepara le righe di un blocco di record, tabella per tabella.
+# I riferimenti già scritti nei blocchi precedenti sono in riferimenti (sola lettura);
+# quelli nuovi di questo blocco vengono raccolti a parte e uniti dal chiamante
+# solo dopo il commit del blocco.
+# Ritorna (righe_per_tabella, scarti, nuovi_riferimenti) dove scarti è una lista
+# di (numero_record, motivo).
+def prepara_blocco(meta, blocco, inizio: int, chiavi: dict, riferimenti: dict, richieste: dict):
+    righe: dict[str, list[dict]] = {t: [] for t in CATENA}
+    scarti = []
+    nuovi = {"cliente": {}, "dispositivo": {}}
+
+    def cerca(tipo: str, rif):
+        if not rif:
+            return None
+        return nuovi[tipo].get(rif) or riferimenti[tipo].get(rif)
+
+    for i, record in enumerate(blocco, start=inizio):
+        try:
+            tipo, campi, rif = dividi_record(meta, record)
+            nuove: dict[str, dict] = {}
+
+            # Cliente (+ figlia ISA): riusato se rifCliente è già stato visto
+            id_cliente = cerca("cliente", rif["cliente"])
+            if id_cliente is None:
+                figlia = "ClientePrivato" if tipo == "Privato" else "ClienteBusiness"
+                id_cliente = campi["Cliente"].get("idCliente") or chiavi["Cliente"].prendi()
+                nuove["Cliente"] = {**campi["Cliente"], "idCliente": id_cliente}
+                nuove[figlia] = {**campi[figlia], "idCliente": id_cliente}
+
+            # Dispositivo: riusato se rifDispositivo è già stato visto
+            id_disp = cerca("dispositivo", rif["dispositivo"])
+            if id_disp is None and (campi["Dispositivo"] or campi["Riparazione"]):
+                id_disp = campi["Dispositivo"].get("idDispositivo") or chiavi["Dispositivo"].prendi()
+                nuove["Dispositivo"] = {**campi["Dispositivo"], "idDispositivo": id_disp, "idCliente": id_cliente}
+
+            # Riparazione e Appuntamento (opzionali)
+            id_rip = None
+            if campi["Riparazione"] or campi["Appuntamento"]:
+                preset = {}
+                if "stato" in meta.tables["Riparazione"].c:
+                    preset["stato"] = "Aperta"
+                if "dataIngresso" in meta.tables["Riparazione"].c:
+                    preset["dataIngresso"] = datetime.now().replace(microsecond=0)
+                id_rip = campi["Riparazione"].get("idRiparazione") or chiavi["Riparazione"].prendi()
+                nuove["Riparazione"] = {**preset, **campi["Riparazione"], "idRiparazione": id_rip, "idDispositivo": id_disp}
+            if campi["Appuntamento"]:
+                id_app = campi["Appuntamento"].get("idAppuntamento") or chiavi["Appuntamento"].prendi()
+                nuove["Appuntamento"] = {**campi["Appuntamento"], "idAppuntamento": id_app, "idRiparazione": id_rip}
+
+            for nome, dati in nuove.items():
+                controlla_obbligatori(meta.tables[nome], dati, richieste[nome])
+
+        except (ValueError, KeyError) as e:
+            scarti.append((i, str(e)))
+            continue
+
+        for nome, dati in nuove.items():
+            righe[nome].append(dati)
+        if rif["cliente"]:
+            nuovi["cliente"][rif["cliente"]] = id_cliente
+        if rif["dispositivo"] and id_disp is not None:
+            nuovi["dispositivo"][rif["dispositivo"]] = id_disp
+
+    return righe, scarti, nuovi
+
+# Inserisce le righe preparate nell'ordine della catena, con un executemany per
+# ogni gruppo di righe che hanno le stesse colonne: executemany richiede le stesse
+# colonne in ogni riga e riempire quelle mancanti con None scavalcherebbe i default.
+def scrivi_blocco(conn, meta, righe: dict[str, list[dict]]) -> int:
+    n = 0
+    for nome in CATENA:
+        gruppi: dict[frozenset, list[dict]] = {}
+        for r in righe[nome]:
+            gruppi.setdefault(frozenset(r), []).append(r)
+        for valori in gruppi.values():
+            conn.execute(meta.tables[nome].insert(), valori)
+            n += len(valori)
+    return n
+
+# Importa un file CSV/JSONL a blocchi. Ogni blocco è una transazione:
+# se il database rifiuta un blocco, il blocco intero viene scartato e si prosegue.
+# Ritorna un dizionario di statistiche.
+def importa(percorso: str, meta=None, blocco: int = BLOCCO_IMPORT, verbose: bool = True) -> dict:
+    if meta is None:
+        meta = schema_riflesso()
+        controllo_tabelle_richieste(meta)
+
+    richieste = {t: colonne_obbligatorie(meta.tables[t]) for t in CATENA}
+    riferimenti = {"cliente": {}, "dispositivo": {}}
+    stat = {"record": 0, "righe": 0, "scartati": 0, "blocchi": 0, "secondi": 0.0}
+
+    t0 = time.perf_counter()
+    allocatore = AllocatoreChiavi(engine, blocco=blocco)
+    chiavi = {t: BloccoChiavi(allocatore, meta.tables[t], pk) for t, pk in PK.items()}
+    with engine.connect() as conn:
+
+        inizio = 1
+        for n_blocco, record in enumerate(a_blocchi(leggi_record(percorso), blocco), start=1):
+            righe, scarti, nuovi = prepara_blocco(meta, record, inizio, chiavi, riferimenti, richieste)
+            try:
+                with conn.begin():
+                    scritte = scrivi_blocco(conn, meta, righe)
+                # i riferimenti del blocco valgono solo se il blocco è stato scritto
+                for tipo in riferimenti:
+                    riferimenti[tipo].update(nuovi[tipo])
+            except Exception as e:
+                motivo = str(getattr(e, "orig", None) or e).splitlines()[0]
+                scarti = [(i, f"blocco rifiutato dal DB: {motivo}") for i in range(inizio, inizio + len(record))]
+                scritte = 0
+
+            stat["record"] += len(record)
+            stat["righe"] += scritte
+            stat["scartati"] += len(scarti)
+            stat["blocchi"] += 1
+            if verbose:
+                print(f"blocco {n_blocco}: {len(record)} record, {scritte} righe inserite, {len(scarti)} scartati")
+                for i, motivo in scarti[:10]:
+                    print(f"  record {i}: {motivo}")
+                if len(scarti) > 10:
+                    print(f"  ... altri {len(scarti) - 10} scarti")
+            inizio += len(record)
+
+    stat["secondi"] = time.perf_counter() - t0
+    stat["righe_al_secondo"] = stat["righe"] / stat["secondi"] if stat["secondi"] else 0.0
+    if verbose:
+        print(
+            f"Import completato: {stat['record']} record, {stat['righe']} righe, "
+            f"{stat['scartati']} scartati in {stat['secondi']:.2f}s "
+            f"({stat['righe_al_secondo']:.0f} righe/s)"
+        )
+    return stat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importazione massiva CSV/JSONL nel CentroRiparazioni")
+    parser.add_argument("file", help="file .csv oppure .jsonl")
+    parser.add_argument("--blocco", type=int, default=BLOCCO_IMPORT, help="record per transazione")
+    args = parser.parse_args()
+    risultato = importa(args.file, blocco=args.blocco)
+    sys.exit(1 if risultato["scartati"] else 0)
@@ -0,0 +1,198 @@
+# indici.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO L'ANALISI DEGLI INDICI (index advisor)
+# Per ogni SELECT del catalogo di queries.py si legge il piano di esecuzione
+# (EXPLAIN) cercando full scan e filesort; si propongono gli indici composti
+# che servono ai percorsi di accesso delle query e, a richiesta, si creano
+# quelli mancanti (operazione idempotente), mostrando il piano prima/dopo.
+#
+# Uso: python indici.py analizza
+#      python indici.py ensure-indexes
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import sys
+from datetime import date, datetime
+from sqlalchemy import Index
+from database import engine
+from schema_reflect import schema_riflesso, controllo_tabelle_richieste
+import queries
+
+# Indici che servono alle query di queries.py: (tabella, colonne).
+# Filtri per nome/cognome e ragione sociale, catena di join
+# Cliente -> Dispositivo -> Riparazione -> Appuntamento, ordinamento per dataOra.
+INDICI_CONSIGLIATI = [
+    ("ClientePrivato", ("cognome", "nome")),
+    ("ClienteBusiness", ("ragioneSociale",)),
+    ("Dispositivo", ("idCliente",)),
+    ("Riparazione", ("idDispositivo",)),
+    ("Appuntamento", ("idRiparazione", "dataOra")),
+    ("Appuntamento", ("dataOra", "idRiparazione")),
+    # filigrane dei report incrementali (report.py)
+    ("Riparazione", ("dataChiusura",)),
+    ("Preventivo", ("data",)),
+    ("Pagamento", ("dataPagamento",)),
+    # FK verso Riparazione e Pagamento, usate dall'archiviazione (archivio.py);
+    # MySQL le indicizza da sé, SQLite e PostgreSQL no
+    ("Intervento", ("idRiparazione",)),
+    ("Preventivo", ("idRiparazione",)),
+    ("Pagamento", ("idRiparazione",)),
+    ("Garanzia", ("idRiparazione",)),
+    ("DocumentoFiscale", ("idPagamento",)),
+    # ricalcolo per ricambio del riepilogo del magazzino (magazzino.py)
+    ("Fornitura", ("idRicambio",)),
+    ("DettaglioOrdine", ("idRicambio",)),
+]
+
+
+# -------------------------
+# INDICI ESISTENTI E MANCANTI
+# -------------------------
+
+# Nome dell'indice proposto per una tabella e un elenco di colonne.
+def nome_indice(tabella: str, colonne) -> str:
+    return f"idx_{tabella}_{'_'.join(colonne)}"[:64]
+
+# Elenchi di colonne già indicizzate su una tabella (indici, PK e vincoli unique).
+def colonne_indicizzate(table) -> list[tuple[str, ...]]:
+    esistenti = [tuple(c.name for c in idx.columns) for idx in table.indexes]
+    pk = tuple(c.name for c in table.primary_key.columns)
+    if pk:
+        esistenti.append(pk)
+    return esistenti
+
+# Un indice esistente copre quello proposto se le colonne proposte ne sono un prefisso.
+def indice_coperto(table, colonne) -> bool:
+    colonne = tuple(colonne)
+    return any(e[:len(colonne)] == colonne for e in colonne_indicizzate(table))
+
+# Ritorna gli indici consigliati che mancano nello schema: lista di (tabella, colonne).
+def indici_mancanti(meta) -> list[tuple[str, tuple[str, ...]]]:
+    mancanti = []
+    for nome, colonne in INDICI_CONSIGLIATI:
+        table = meta.tables.get(nome)
+        if table is None or any(c not in table.c for c in colonne):
+            continue
+        if not indice_coperto(table, colonne):
+            mancanti.append((nome, colonne))
+    return mancanti
+
+# Crea gli indici mancanti (idempotente: quelli già presenti vengono saltati).
+# Ritorna i nomi degli indici creati.
+def crea_indici_mancanti(meta) -> list[str]:
+    creati = []
+    with engine.begin() as conn:
+        for nome, colonne in indici_mancanti(meta):
+            table = meta.tables[nome]
+            idx = Index(nome_indice(nome, colonne), *[table.c[c] for c in colonne])
+            idx.create(conn, checkfirst=True)
+            creati.append(idx.name)
+    return creati
+
+
+# -------------------------
+# PIANI DI ESECUZIONE
+# -------------------------
+
+# Valore di esempio per un tipo di colonna.
+def _valore_esempio(tipo, nome: str):
+    try:
+        py = tipo.python_type
+    except NotImplementedError:
+        py = str
+    if py is int:
+        return 50 if nome == "limite" else 1
+    if py in (datetime, date):
+        return "2024-01-01 00:00:00"
+    return "x"
+
+# Valori di esempio per i parametri di uno statement (servono solo per EXPLAIN).
+# I parametri "expanding" (IN su una lista) ricevono una lista di un elemento.
+def parametri_esempio(stmt) -> dict:
+    esempi = {}
+    for bp in stmt.compile().binds.values():
+        if bp.expanding:
+            tipi = getattr(bp.type, "types", None)
+            if tipi:
+                esempi[bp.key] = [tuple(_valore_esempio(t, bp.key) for t in tipi)]
+            else:
+                esempi[bp.key] = [_valore_esempio(bp.type, bp.key)]
+        else:
+            esempi[bp.key] = _valore_esempio(bp.type, bp.key)
+    return esempi
+
+# Esegue EXPLAIN di uno statement e ritorna un riepilogo:
+# tabelle lette con full scan, presenza di filesort, righe stimate (solo MySQL) e piano grezzo.
+def spiega(conn, stmt) -> dict:
+    stato = stmt.compile(dialect=conn.dialect).construct_expanded_state(parametri_esempio(stmt))
+    sql = stato.statement
+    posizionali = tuple(stato.parameters[k] for k in stato.positiontup)
+
+    if conn.dialect.name == "sqlite":
+        righe = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, posizionali).fetchall()
+        dettagli = [r[-1] for r in righe]
+        return {
+            "full_scan": [d.split()[1] for d in dettagli if d.startswith("SCAN ") and "INDEX" not in d and "CONSTANT ROW" not in d],
+            "filesort": any("TEMP B-TREE" in d for d in dettagli),
+            "righe_stimate": None,
+            "piano": dettagli,
+        }
+
+    res = conn.exec_driver_sql("EXPLAIN " + sql, posizionali)
+    righe = [dict(r._mapping) for r in res]
+    return {
+        "full_scan": [r.get("table") for r in righe if r.get("type") == "ALL"],
+        "filesort": any("filesort" in (r.get("Extra") or "") for r in righe),
+        "righe_stimate": sum(int(r.get("rows") or 0) for r in righe),
+        "piano": righe,
+    }
+
+# Piano di tutte le SELECT del catalogo: {nome_query: riepilogo}.
+def piani_catalogo(meta) -> dict[str, dict]:
+    piani = {}
+    with engine.connect() as conn:
+        for nome, stmt in queries.catalogo(meta).completo().items():
+            if nome.startswith("q_"):
+                piani[nome] = spiega(conn, stmt)
+    return piani
+
+# Stampa il riepilogo dei piani (e, se presenti, il confronto con i piani precedenti).
+def stampa_piani(piani: dict, prima: dict | None = None):
+    for nome, p in piani.items():
+        riga = f"{nome}: full scan={p['full_scan'] or '-'} filesort={'si' if p['filesort'] else 'no'}"
+        if p["righe_stimate"] is not None:
+            riga += f" righe stimate={p['righe_stimate']}"
+            if prima and prima.get(nome, {}).get("righe_stimate") is not None:
+                riga += f" (prima {prima[nome]['righe_stimate']})"
+        print(riga)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analisi e creazione degli indici per le query di queries.py")
+    parser.add_argument("comando", choices=["analizza", "ensure-indexes"])
+    args = parser.parse_args()
+
+    # senza cache: gli indici appena creati (o rimossi a mano) vanno sempre riletti
+    meta = schema_riflesso(cache=False)
+    controllo_tabelle_richieste(meta)
+
+    prima = piani_catalogo(meta)
+    print("== Piani attuali ==")
+    stampa_piani(prima)
+
+    mancanti = indici_mancanti(meta)
+    print("\n== Indici consigliati mancanti ==")
+    for nome, colonne in mancanti:
+        print(f"{nome}({', '.join(colonne)})")
+    if not mancanti:
+        print("(nessuno)")
+
+    if args.comando == "ensure-indexes" and mancanti:
+        creati = crea_indici_mancanti(meta)
+        print(f"\nCreati: {', '.join(creati)}")
+        print("\n== Piani dopo la creazione ==")
+        stampa_piani(piani_catalogo(meta), prima)
+
+    sys.exit(1 if args.comando == "analizza" and mancanti else 0)
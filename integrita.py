@@ -0,0 +1,388 @@
+# integrita.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO IL CONTROLLO DI INTEGRITÀ DELLO SCHEMA
+# I controlli si generano dalle FK dello schema riflesso, senza elenchi scritti
+# a mano:
+#   - FK orfane: righe che puntano a una riga inesistente (es. Riparazione senza
+#     Dispositivo, o le righe figlie lasciate da delete_riparazione)
+#   - gerarchie ISA: ogni riga del padre (Cliente) deve avere esattamente un
+#     figlio tra le tabelle la cui PK è anche FK verso di lui (ClientePrivato,
+#     ClienteBusiness), coerente con la colonna tipo<Padre> se c'è
+#
+# Ogni controllo è diviso in intervalli di INTEGRITA_BLOCCO valori della prima
+# colonna della PK della tabella controllata (idCliente per Cliente, idRiparazione
+# per Riparazione, ...) ed eseguito in un pool di INTEGRITA_PROCESSI processi,
+# ciascuno con il proprio engine e pool di connessioni. I risultati vengono uniti
+# in un unico report; con --correggi si applicano le correzioni a blocchi di
+# BLOCCO_IN righe, una transazione per blocco:
+#   - FK orfana annullabile: la FK viene messa a NULL
+#   - FK orfana obbligatoria: la riga viene eliminata con le righe che ne dipendono,
+#     solo con --elimina-orfane (tutti i controlli, o solo quelli elencati); prima
+#     si stampano le righe che verrebbero eliminate per tabella, e senza il flag
+#     ci si ferma a quel piano
+#   - gerarchia ISA non valida: nessuna correzione automatica, le chiavi vengono
+#     elencate per la revisione a mano (i dati del figlio non si possono inventare)
+# Ogni correzione ricontrolla nello stesso statement la condizione del controllo,
+# così una riga sistemata dopo la verifica non viene toccata. L'uscita è 1 se
+# resta qualche problema non corretto.
+#
+# Uso: python integrita.py [--processi 4] [--blocco 50000] [--correggi [--elimina-orfane [CONTROLLO ...]]]
+#      python integrita.py --confronta-processi 1 2 4 8
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import (
+    select, update, delete, func, and_, or_, case, literal, bindparam, tuple_, types,
+)
+import archivio
+import database
+from queries import BLOCCO_IN
+
+# Valori della chiave di ripartizione per ogni intervallo.
+INTEGRITA_BLOCCO = int(os.getenv("INTEGRITA_BLOCCO", "50000"))
+
+# Processi del pool (default: uno per CPU).
+INTEGRITA_PROCESSI = int(os.getenv("INTEGRITA_PROCESSI", str(os.cpu_count() or 1)))
+
+# Chiavi riportate come esempio per ogni controllo nel report.
+ESEMPI = 5
+
+
+# -------------------------
+# CONTROLLI DALLE FK
+# -------------------------
+
+# Un controllo: statement che ritorna la PK delle righe non valide (più colonne
+# di contesto) nell'intervallo [:da, :a) della colonna di ripartizione; la
+# condizione che rende non valida una riga resta in `condizione` per le correzioni.
+class Controllo:
+    def __init__(self, nome: str, tipo: str, tabella, statement, descrizione: str, condizione,
+                 fk=None, figli=()):
+        self.nome = nome
+        self.tipo = tipo            # "fk" oppure "isa"
+        self.tabella = tabella
+        self.chiave = list(tabella.primary_key.columns)
+        self.ripartizione = self.chiave[0]
+        self.fk = fk
+        self.figli = figli
+        self.descrizione = descrizione
+        self.condizione = condizione
+        self.statement = statement.execution_options(nome_query=f"integrita_{nome}")
+        self.a_intervalli = isinstance(self.ripartizione.type, types.Integer)
+        if self.a_intervalli:
+            self.statement = self.statement.where(
+                self.ripartizione >= bindparam("da"), self.ripartizione < bindparam("a")
+            )
+
+# Figli ISA di una tabella: tabelle la cui PK coincide con una FK verso la sua PK.
+def figli_isa(meta, padre) -> list:
+    pk_padre = set(padre.primary_key.columns)
+    figli = []
+    for t in meta.sorted_tables:
+        if t is padre:
+            continue
+        pk = set(t.primary_key.columns)
+        for fk in t.foreign_key_constraints:
+            if (fk.referred_table is padre and {e.parent for e in fk.elements} == pk
+                    and {e.column for e in fk.elements} == pk_padre):
+                figli.append(t)
+    return figli
+
+def _controllo_fk(t, fk) -> Controllo:
+    locali = [e.parent for e in fk.elements]
+    riferita = fk.referred_table
+    if riferita is t:
+        riferita = t.alias()  # FK verso la stessa tabella
+    remote = [riferita.c[e.column.name] for e in fk.elements]
+    esiste = select(literal(1)).select_from(riferita).where(*[r == l for l, r in zip(locali, remote)]).exists()
+    chiave = list(t.primary_key.columns)
+    condizione = and_(*[l.is_not(None) for l in locali], ~esiste)
+    stmt = select(*chiave, *[l for l in locali if l not in chiave]).where(condizione)
+    colonne = ",".join(l.name for l in locali)
+    return Controllo(
+        f"fk_{t.name}_{colonne.replace(',', '_')}", "fk", t, stmt,
+        f"{t.name}({colonne}) senza riga in {fk.referred_table.name}", condizione, fk=fk,
+    )
+
+def _controllo_isa(padre, figli) -> Controllo:
+    pk = list(padre.primary_key.columns)
+    presenze = {}
+    for figlio in figli:
+        pk_figlio = list(figlio.primary_key.columns)
+        presenze[figlio.name] = select(literal(1)).select_from(figlio).where(
+            *[c == p for c, p in zip(pk_figlio, pk)]
+        ).exists()
+    n = sum((case((e, 1), else_=0) for e in presenze.values()), literal(0))
+    colonne = [*pk, n.label("figli")]
+    condizioni = [n != 1]
+    tipo = padre.c.get("tipo" + padre.name)
+    if tipo is not None:
+        colonne.append(tipo)
+        suffissi = {f.name[len(padre.name):]: f.name for f in figli if f.name.startswith(padre.name)}
+        condizioni.append(tipo.is_(None) | tipo.not_in(list(suffissi)))
+        condizioni += [and_(tipo == s, ~presenze[nome]) for s, nome in suffissi.items()]
+    condizione = or_(*condizioni)
+    return Controllo(
+        f"isa_{padre.name}", "isa", padre, select(*colonne).where(condizione),
+        f"{padre.name} senza esattamente un figlio tra {', '.join(f.name for f in figli)}", condizione,
+        figli=figli,
+    )
+
+# Tutti i controlli dello schema, in ordine padri -> figli. Ritorna {nome: Controllo}.
+def controlli(meta) -> dict[str, Controllo]:
+    risultato = {}
+    for t in meta.sorted_tables:
+        if not t.primary_key.columns:
+            continue
+        figli = figli_isa(meta, t)
+        if len(figli) > 1:
+            c = _controllo_isa(t, figli)
+            risultato[c.nome] = c
+        for fk in t.foreign_key_constraints:
+            c = _controllo_fk(t, fk)
+            risultato[c.nome] = c
+    return risultato
+
+
+# -------------------------
+# ESECUZIONE NEL POOL
+# -------------------------
+
+# Stato di ciascun processo del pool: engine proprio e controlli ricostruiti dal MetaData.
+_lavoratore: dict = {}
+
+def _inizializza_lavoratore(url: str, meta):
+    # le connessioni ereditate dal processo padre (fork) non vanno usate né chiuse qui
+    database.engine.dispose(close=False)
+    _lavoratore["engine"] = database.crea_engine(url)
+    _lavoratore["controlli"] = controlli(meta)
+
+def _esegui_intervallo(nome: str, da, a) -> tuple:
+    c = _lavoratore["controlli"][nome]
+    t0 = time.perf_counter()
+    with _lavoratore["engine"].connect() as conn:
+        righe = [tuple(r) for r in conn.execute(c.statement, {"da": da, "a": a} if c.a_intervalli else {})]
+    return nome, righe, time.perf_counter() - t0
+
+# Intervalli [da, a) da controllare per ogni controllo (uno solo se la chiave non è intera).
+def intervalli(conn, controlli_: dict, blocco: int = INTEGRITA_BLOCCO) -> list[tuple]:
+    lavori = []
+    estremi = {}
+    for nome, c in controlli_.items():
+        if not c.a_intervalli:
+            lavori.append((nome, None, None))
+            continue
+        col = c.ripartizione
+        if c.tabella.name not in estremi:
+            estremi[c.tabella.name] = conn.execute(select(func.min(col), func.max(col))).one()
+        minimo, massimo = estremi[c.tabella.name]
+        if minimo is None:
+            continue
+        for da in range(minimo, massimo + 1, blocco):
+            lavori.append((nome, da, min(da + blocco, massimo + 1)))
+    return lavori
+
+# Esegue tutti i controlli nel pool e unisce i risultati.
+# Ritorna {nome: {"controllo", "righe", "intervalli", "secondi"}} e il tempo totale.
+def verifica(meta, processi: int = INTEGRITA_PROCESSI, blocco: int = INTEGRITA_BLOCCO,
+             url: str = database.DATABASE_URL) -> tuple[dict, float]:
+    tutti = controlli(meta)
+    t0 = time.perf_counter()
+    with database.engine.connect() as conn:
+        lavori = intervalli(conn, tutti, blocco)
+    report = {nome: {"controllo": c, "righe": [], "intervalli": 0, "secondi": 0.0} for nome, c in tutti.items()}
+    with ProcessPoolExecutor(max_workers=processi, initializer=_inizializza_lavoratore,
+                             initargs=(url, meta)) as pool:
+        for nome, righe, secondi in pool.map(_esegui_intervallo, *zip(*lavori)) if lavori else ():
+            r = report[nome]
+            r["righe"] += righe
+            r["intervalli"] += 1
+            r["secondi"] += secondi
+    return report, time.perf_counter() - t0
+
+# Stampa il report: una riga per controllo con problemi trovati ed esempi di chiavi.
+def stampa_report(report: dict, secondi: float):
+    import output
+
+    righe = []
+    for nome, r in report.items():
+        n_pk = len(r["controllo"].chiave)
+        esempi = ", ".join(str(x[0] if n_pk == 1 else x[:n_pk]) for x in r["righe"][:ESEMPI])
+        righe.append((nome, r["controllo"].descrizione, len(r["righe"]), r["intervalli"], f"{r['secondi']:.2f}", esempi))
+    output.scrivi_tabella(["controllo", "descrizione", "problemi", "intervalli", "secondi", "esempi"], [righe])
+    problemi = sum(len(r["righe"]) for r in report.values())
+    print(f"\n{len(report)} controlli, {problemi} problemi, {secondi:.2f}s")
+
+
+# -------------------------
+# CORREZIONI
+# -------------------------
+
+def _a_blocchi(valori, dimensione: int):
+    for i in range(0, len(valori), dimensione):
+        yield valori[i:i + dimensione]
+
+def _annullabile(c: Controllo) -> bool:
+    return all(e.parent.nullable for e in c.fk.elements)
+
+# Righe che l'eliminazione delle orfane toglierebbe, per tabella: le orfane e,
+# se la PK è una sola colonna, quelle che ne dipendono lungo le FK.
+# Ritorna {nome controllo: {tabella: righe}} per i controlli con FK obbligatoria.
+def piano_eliminazioni(eng, meta, report: dict, blocco: int = BLOCCO_IN) -> dict[str, dict[str, int]]:
+    piano = {}
+    for nome, r in report.items():
+        c, righe = r["controllo"], r["righe"]
+        if not righe or c.tipo == "isa" or _annullabile(c):
+            continue
+        if len(c.chiave) > 1:
+            piano[nome] = {c.tabella.name: len(righe)}
+            continue
+        cond = archivio.condizioni(meta, c.tabella.name)
+        conteggi = {}
+        with eng.connect() as conn:
+            for parte in _a_blocchi([x[0] for x in righe], blocco):
+                for t, _ in archivio.dipendenze(meta, c.tabella.name):
+                    n = conn.execute(select(func.count()).select_from(t).where(cond[t.name]),
+                                     {"id_riparazioni": parte}).scalar_one()
+                    conteggi[t.name] = conteggi.get(t.name, 0) + n
+        piano[nome] = conteggi
+    return piano
+
+# Applica le correzioni possibili, a blocchi di `blocco` righe per transazione.
+# Le orfane con FK obbligatoria si eliminano solo per i controlli in `elimina`
+# (vedi piano_eliminazioni); le gerarchie ISA non si correggono (vedi da_rivedere).
+# Ritorna {nome controllo: righe corrette}.
+def correggi(eng, meta, report: dict, blocco: int = BLOCCO_IN, elimina=()) -> dict[str, int]:
+    corrette = {}
+    for nome, r in report.items():
+        c, righe = r["controllo"], r["righe"]
+        if not righe or c.tipo == "isa" or not (_annullabile(c) or nome in elimina):
+            continue
+        n = 0
+        if _annullabile(c):
+            pk = c.chiave
+            for parte in _a_blocchi([x[:len(pk)] for x in righe], blocco):
+                with eng.begin() as conn:
+                    n += conn.execute(
+                        update(c.tabella).where(_in_chiavi(pk, parte), c.condizione)
+                        .values({e.parent.name: None for e in c.fk.elements})
+                    ).rowcount
+        else:
+            n = _elimina_con_dipendenti(eng, meta, c, [x[:len(c.chiave)] for x in righe], blocco)
+        corrette[nome] = n
+    return corrette
+
+# Chiavi dei controlli ISA con problemi, da sistemare a mano. Ritorna {nome controllo: [chiavi]}.
+def da_rivedere(report: dict) -> dict[str, list]:
+    rivedere = {}
+    for nome, r in report.items():
+        c = r["controllo"]
+        if c.tipo == "isa" and r["righe"]:
+            rivedere[nome] = [x[0] if len(c.chiave) == 1 else x[:len(c.chiave)] for x in r["righe"]]
+    return rivedere
+
+def _in_chiavi(pk, chiavi):
+    if len(pk) == 1:
+        return pk[0].in_([k[0] for k in chiavi])
+    return tuple_(*pk).in_(chiavi)
+
+# Elimina le righe orfane e, se la PK è una sola colonna, le righe che ne
+# dipendono lungo le FK (figli prima), come l'archiviazione. Le chiavi ancora
+# orfane si rileggono (e bloccano) nella transazione del blocco, così i dipendenti
+# di una riga nel frattempo sistemata restano. Ritorna le righe orfane eliminate.
+def _elimina_con_dipendenti(eng, meta, c: Controllo, chiavi: list, blocco: int) -> int:
+    n = 0
+    if len(c.chiave) > 1:
+        for parte in _a_blocchi(chiavi, blocco):
+            with eng.begin() as conn:
+                n += conn.execute(delete(c.tabella).where(_in_chiavi(c.chiave, parte), c.condizione)).rowcount
+        return n
+    cond = archivio.condizioni(meta, c.tabella.name)
+    ordine = [t for t, _ in archivio.dipendenze(meta, c.tabella.name)]
+    pk = c.chiave[0]
+    for parte in _a_blocchi([k[0] for k in chiavi], blocco):
+        with eng.begin() as conn:
+            ancora = list(conn.execute(
+                select(pk).where(pk.in_(parte), c.condizione).with_for_update()
+            ).scalars())
+            if not ancora:
+                continue
+            for t in reversed(ordine):
+                stmt = delete(t).where(cond[t.name])
+                if t is c.tabella:
+                    stmt = stmt.where(c.condizione)
+                res = conn.execute(stmt, {"id_riparazioni": ancora})
+                if t is c.tabella:
+                    n += res.rowcount
+    return n
+
+
+# -------------------------
+# CONFRONTO TRA NUMERO DI PROCESSI
+# -------------------------
+
+# Esegue la verifica con ciascun numero di processi. Ritorna {processi: (secondi, speedup)}.
+def confronta_processi(meta, processi=(1, 2, 4, 8), blocco: int = INTEGRITA_BLOCCO) -> dict:
+    risultati = {}
+    base = None
+    for p in processi:
+        _, secondi = verifica(meta, p, blocco)
+        base = base or secondi
+        risultati[p] = (secondi, base / secondi if secondi else 0.0)
+    return risultati
+
+
+if __name__ == "__main__":
+    from schema_reflect import schema_riflesso
+
+    parser = argparse.ArgumentParser(description="Controllo di integrità (FK e ISA) in parallelo")
+    parser.add_argument("--processi", type=int, default=INTEGRITA_PROCESSI)
+    parser.add_argument("--blocco", type=int, default=INTEGRITA_BLOCCO, help="valori di chiave per intervallo")
+    parser.add_argument("--correggi", action="store_true", help="applica le correzioni possibili")
+    parser.add_argument("--elimina-orfane", nargs="*", metavar="CONTROLLO",
+                        help="con --correggi elimina le orfane con FK obbligatoria (e i dipendenti) "
+                             "di tutti i controlli o solo di quelli elencati")
+    parser.add_argument("--confronta-processi", type=int, nargs="+", metavar="N",
+                        help="misura il tempo con diversi numeri di processi")
+    args = parser.parse_args()
+    if args.elimina_orfane is not None and not args.correggi:
+        parser.error("--elimina-orfane richiede --correggi")
+
+    meta = schema_riflesso()
+    if args.confronta_processi:
+        print(f"{'processi':>8} {'secondi':>9} {'speedup':>8}  (CPU disponibili: {os.cpu_count()})")
+        for p, (secondi, speedup) in confronta_processi(meta, args.confronta_processi, args.blocco).items():
+            print(f"{p:>8} {secondi:>9.2f} {speedup:>7.2f}x")
+        sys.exit(0)
+
+    report, secondi = verifica(meta, args.processi, args.blocco)
+    stampa_report(report, secondi)
+    corrette = {}
+    if args.correggi:
+        piano = piano_eliminazioni(database.engine, meta, report)
+        elimina = set()
+        if args.elimina_orfane is not None:
+            elimina = set(args.elimina_orfane or piano)
+            ignoti = elimina - set(piano)
+            if ignoti:
+                parser.error(f"nessuna orfana da eliminare per: {', '.join(sorted(ignoti))}")
+        for nome, conteggi in piano.items():
+            stato = "da eliminare" if nome in elimina else "non eliminate (serve --elimina-orfane)"
+            dettaglio = ", ".join(f"{t} {n}" for t, n in conteggi.items())
+            print(f"{nome}: righe {stato}: {dettaglio}")
+        corrette = correggi(database.engine, meta, report, elimina=elimina)
+        for nome, n in corrette.items():
+            print(f"{nome}: {n} righe corrette")
+        for nome, chiavi in da_rivedere(report).items():
+            print(f"{nome}: {len(chiavi)} righe da rivedere a mano: {', '.join(map(str, chiavi))}")
+    rimasti = sum(len(r["righe"]) for r in report.values()) - sum(corrette.values())
+    if args.correggi:
+        print(f"Corrette {sum(corrette.values())} righe; da sistemare a mano (o da ricontrollare): {rimasti}")
+    # uscita 1 se resta qualcosa da sistemare, anche dopo --correggi
+    sys.exit(1 if rimasti else 0)
@@ -0,0 +1,337 @@
+# magazzino.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO IL MAGAZZINO DEI RICAMBI
+# Tiene in una tabella di riepilogo (GiacenzaRicambio) una riga per Ricambio
+# con le quantità ricevute (Fornitura) e ordinate ai fornitori (DettaglioOrdine),
+# il numero di righe e l'ultima data di ciascuna. Lo schema non registra gli
+# scarichi: la giacenza è il ricevuto, l'ordinato non ancora ricevuto è "in
+# arrivo" e sotto la scortaMinima del ricambio si propone un riordino.
+#
+#   - registro delle variazioni: dei trigger su Fornitura, DettaglioOrdine e
+#     Ordine scrivono in VariazioneMagazzino l'idRicambio di ogni riga inserita,
+#     modificata o cancellata, nella stessa transazione della modifica
+#   - aggiornamento incrementale: per i soli ricambi del registro si ricalcola
+#     la riga del riepilogo dallo storico, poi si tolgono dal registro le voci
+#     lette (non si usano filigrane sugli id: con l'allocatore a blocchi gli id
+#     non seguono l'ordine dei commit, e le righe aggiunte a un ordine già
+#     contato hanno un idOrdine vecchio)
+#   - ricostruzione completa: ricalcola il riepilogo da tutto lo storico
+#     (serve anche per verificare che l'incrementale sia allineato)
+#
+# Le letture delle giacenze leggono solo il riepilogo e Ricambio: il costo
+# dipende dal numero di ricambi, non dalla storia di forniture e ordini.
+# Tabelle e trigger si creano una volta con --installa, mai dal menu.
+#
+# Uso: python magazzino.py [--installa] [--ricostruisci] [--verifica] [--sotto-scorta]
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, BigInteger, Date, DateTime,
+    select, insert, delete, func, bindparam, case, literal, inspect,
+)
+from queries import BLOCCO_IN
+
+_meta_magazzino = MetaData()
+
+# Riepilogo per ricambio: totali e ultime date di forniture e ordini.
+GiacenzaRicambio = Table(
+    "GiacenzaRicambio", _meta_magazzino,
+    Column("idRicambio", Integer, primary_key=True, autoincrement=False),
+    Column("fornito", BigInteger, nullable=False),
+    Column("forniture", Integer, nullable=False),
+    Column("ultimaFornitura", Date),
+    Column("ordinato", BigInteger, nullable=False),
+    Column("righeOrdine", Integer, nullable=False),
+    Column("ultimoOrdine", Date),
+    Column("aggiornato", DateTime, nullable=False),
+)
+
+# Registro dei ricambi da ricalcolare, scritto dai trigger (vedi TRIGGER).
+VariazioneMagazzino = Table(
+    "VariazioneMagazzino", _meta_magazzino,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("idRicambio", Integer, nullable=False),
+)
+
+# Trigger che alimentano il registro: nome -> (momento, evento, tabella, corpo).
+# Ordine conta per la data (ultimoOrdine) e, cancellato, per le sue righe.
+_REGISTRA = "INSERT INTO VariazioneMagazzino (idRicambio) "
+TRIGGER = {
+    "trg_magazzino_fornitura_ins": ("AFTER", "INSERT", "Fornitura", [_REGISTRA + "VALUES (NEW.idRicambio)"]),
+    "trg_magazzino_fornitura_upd": ("AFTER", "UPDATE", "Fornitura",
+                                    [_REGISTRA + "VALUES (OLD.idRicambio)", _REGISTRA + "VALUES (NEW.idRicambio)"]),
+    "trg_magazzino_fornitura_del": ("AFTER", "DELETE", "Fornitura", [_REGISTRA + "VALUES (OLD.idRicambio)"]),
+    "trg_magazzino_dettaglio_ins": ("AFTER", "INSERT", "DettaglioOrdine", [_REGISTRA + "VALUES (NEW.idRicambio)"]),
+    "trg_magazzino_dettaglio_upd": ("AFTER", "UPDATE", "DettaglioOrdine",
+                                    [_REGISTRA + "VALUES (OLD.idRicambio)", _REGISTRA + "VALUES (NEW.idRicambio)"]),
+    "trg_magazzino_dettaglio_del": ("AFTER", "DELETE", "DettaglioOrdine", [_REGISTRA + "VALUES (OLD.idRicambio)"]),
+    "trg_magazzino_ordine_upd": ("AFTER", "UPDATE", "Ordine",
+                                 [_REGISTRA + "SELECT idRicambio FROM DettaglioOrdine WHERE idOrdine = NEW.idOrdine"]),
+    "trg_magazzino_ordine_del": ("BEFORE", "DELETE", "Ordine",
+                                 [_REGISTRA + "SELECT idRicambio FROM DettaglioOrdine WHERE idOrdine = OLD.idOrdine"]),
+}
+
+_statistiche = {"incrementali": 0, "completi": 0, "righe": 0, "ultimo_ms": None, "ultimo_modo": None}
+_installato: set[str] = set()  # database su cui le tabelle del magazzino esistono già
+
+
+# -------------------------
+# STATEMENT
+# -------------------------
+
+# Aggregati per ricambio delle due sorgenti. Con per_ricambi=True solo i
+# ricambi del parametro "ricambi" (lista, IN espanso).
+def aggregati_forniture(meta, per_ricambi: bool = False):
+    Fornitura = meta.tables["Fornitura"]
+    stmt = (
+        select(
+            Fornitura.c.idRicambio,
+            func.sum(Fornitura.c.quantita).label("fornito"),
+            func.count().label("forniture"),
+            func.max(Fornitura.c.data).label("ultimaFornitura"),
+        )
+        .group_by(Fornitura.c.idRicambio)
+    )
+    if per_ricambi:
+        stmt = stmt.where(Fornitura.c.idRicambio.in_(bindparam("ricambi", expanding=True)))
+    return stmt
+
+def aggregati_ordini(meta, per_ricambi: bool = False):
+    Ordine = meta.tables["Ordine"]
+    DettaglioOrdine = meta.tables["DettaglioOrdine"]
+    stmt = (
+        select(
+            DettaglioOrdine.c.idRicambio,
+            func.sum(DettaglioOrdine.c.quantita).label("ordinato"),
+            func.count().label("righeOrdine"),
+            func.max(Ordine.c.data).label("ultimoOrdine"),
+        )
+        .join_from(DettaglioOrdine, Ordine, DettaglioOrdine.c.idOrdine == Ordine.c.idOrdine)
+        .group_by(DettaglioOrdine.c.idRicambio)
+    )
+    if per_ricambi:
+        stmt = stmt.where(DettaglioOrdine.c.idRicambio.in_(bindparam("ricambi", expanding=True)))
+    return stmt
+
+# Riepilogo calcolato dallo storico: una riga per ogni ricambio (o solo per
+# quelli del parametro "ricambi"), con le stesse colonne di GiacenzaRicambio
+# (tranne aggiornato).
+def statement_completo(meta, per_ricambi: bool = False):
+    Ricambio = meta.tables["Ricambio"]
+    f = aggregati_forniture(meta, per_ricambi).subquery("f")
+    o = aggregati_ordini(meta, per_ricambi).subquery("o")
+    stmt = (
+        select(
+            Ricambio.c.idRicambio,
+            func.coalesce(f.c.fornito, 0).label("fornito"),
+            func.coalesce(f.c.forniture, 0).label("forniture"),
+            f.c.ultimaFornitura,
+            func.coalesce(o.c.ordinato, 0).label("ordinato"),
+            func.coalesce(o.c.righeOrdine, 0).label("righeOrdine"),
+            o.c.ultimoOrdine,
+        )
+        .outerjoin(f, f.c.idRicambio == Ricambio.c.idRicambio)
+        .outerjoin(o, o.c.idRicambio == Ricambio.c.idRicambio)
+        .order_by(Ricambio.c.idRicambio)
+    )
+    if per_ricambi:
+        stmt = stmt.where(Ricambio.c.idRicambio.in_(bindparam("ricambi", expanding=True)))
+    return stmt.execution_options(nome_query="magazzino_ricambi" if per_ricambi else "magazzino_completo")
+
+# Giacenze lette dal riepilogo: giacenza (ricevuto), in arrivo (ordinato non
+# ancora ricevuto) e quantità da riordinare per tornare alla scorta minima.
+# Con sotto_scorta=True solo i ricambi da riordinare.
+def statement_giacenze(meta, sotto_scorta: bool = False):
+    Ricambio = meta.tables["Ricambio"]
+    G = GiacenzaRicambio
+    giacenza = func.coalesce(G.c.fornito, 0)
+    in_arrivo = case((G.c.ordinato > G.c.fornito, G.c.ordinato - G.c.fornito), else_=0)
+    disponibile = giacenza + in_arrivo
+    scorta = func.coalesce(Ricambio.c.scortaMinima, 0)
+    da_ordinare = case((scorta > disponibile, scorta - disponibile), else_=0)
+    stmt = (
+        select(
+            Ricambio.c.idRicambio,
+            Ricambio.c.nome,
+            Ricambio.c.scortaMinima,
+            giacenza.label("giacenza"),
+            in_arrivo.label("in_arrivo"),
+            da_ordinare.label("da_ordinare"),
+            G.c.ultimaFornitura,
+            G.c.ultimoOrdine,
+        )
+        .outerjoin(G, G.c.idRicambio == Ricambio.c.idRicambio)
+    )
+    if sotto_scorta:
+        stmt = stmt.where(scorta > disponibile).order_by(da_ordinare.desc(), Ricambio.c.idRicambio)
+    else:
+        stmt = stmt.order_by(Ricambio.c.idRicambio)
+    return stmt.execution_options(nome_query="magazzino_sotto_scorta" if sotto_scorta else "magazzino_giacenze")
+
+
+# -------------------------
+# INSTALLAZIONE
+# -------------------------
+
+# Crea tabelle e trigger del magazzino e calcola il riepilogo iniziale.
+# Da eseguire una volta (python magazzino.py --installa): su MySQL i DDL
+# chiudono la transazione in corso, quindi non vanno mai nel percorso del menu.
+def installa(conn, meta) -> int:
+    _meta_magazzino.create_all(conn, checkfirst=True)
+    for nome, (momento, evento, tabella, corpo) in TRIGGER.items():
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {nome}")
+        if conn.dialect.name == "mysql":
+            istruzioni = corpo[0] if len(corpo) == 1 else "BEGIN " + "; ".join(corpo) + "; END"
+            conn.exec_driver_sql(f"CREATE TRIGGER {nome} {momento} {evento} ON {tabella} FOR EACH ROW {istruzioni}")
+        else:
+            conn.exec_driver_sql(
+                f"CREATE TRIGGER {nome} {momento} {evento} ON {tabella} FOR EACH ROW BEGIN {'; '.join(corpo)}; END"
+            )
+    return ricostruisci(conn, meta)
+
+# Controlla (una volta per database) che --installa sia stato eseguito.
+def _controlla_installazione(conn):
+    database = conn.engine.url.render_as_string(hide_password=True)
+    if database in _installato:
+        return
+    mancanti = [t.name for t in _meta_magazzino.sorted_tables if not inspect(conn).has_table(t.name)]
+    if mancanti:
+        raise RuntimeError(
+            f"Magazzino non installato (mancano {', '.join(mancanti)}): eseguire python magazzino.py --installa"
+        )
+    _installato.add(database)
+
+
+# -------------------------
+# AGGIORNAMENTO
+# -------------------------
+
+# Voci del registro visibili ora: {id voce: idRicambio}.
+def _variazioni(conn) -> dict:
+    return dict(conn.execute(select(VariazioneMagazzino.c.id, VariazioneMagazzino.c.idRicambio)).all())
+
+# Toglie dal registro le voci lette (per id: quelle scritte nel frattempo restano).
+def _consuma(conn, voci):
+    voci = list(voci)
+    for i in range(0, len(voci), BLOCCO_IN):
+        conn.execute(delete(VariazioneMagazzino).where(VariazioneMagazzino.c.id.in_(voci[i:i + BLOCCO_IN])))
+
+# Ricalcola il riepilogo da tutto lo storico e svuota le voci del registro
+# già lette. Ritorna il numero di ricambi scritti.
+def ricostruisci(conn, meta) -> int:
+    t0 = time.perf_counter()
+    _controlla_installazione(conn)
+    voci = _variazioni(conn)
+    adesso = datetime.now().replace(microsecond=0)
+    conn.execute(delete(GiacenzaRicambio))
+    completo = statement_completo(meta).add_columns(literal(adesso, DateTime).label("aggiornato"))
+    conn.execute(insert(GiacenzaRicambio).from_select([c.name for c in GiacenzaRicambio.c], completo))
+    _consuma(conn, voci)
+    n = conn.execute(select(func.count()).select_from(GiacenzaRicambio)).scalar_one()
+    _registra("completo", n, t0)
+    return n
+
+# Ricalcola dallo storico le righe del riepilogo dei soli ricambi presenti nel
+# registro delle variazioni, poi toglie le voci lette. Il ricalcolo per ricambio
+# è idempotente: due aggiornamenti concorrenti, o una variazione già vista da
+# una ricostruzione, danno lo stesso risultato.
+# Ritorna {"modo", "ricambi" (righe del riepilogo ricalcolate), "voci"}.
+def aggiorna(conn, meta) -> dict:
+    t0 = time.perf_counter()
+    _controlla_installazione(conn)
+    voci = _variazioni(conn)
+    ricambi = sorted(set(voci.values()))
+    adesso = datetime.now().replace(microsecond=0)
+    stmt = statement_completo(meta, per_ricambi=True)
+    for i in range(0, len(ricambi), BLOCCO_IN):
+        blocco = ricambi[i:i + BLOCCO_IN]
+        righe = [dict(r._mapping, aggiornato=adesso) for r in conn.execute(stmt, {"ricambi": blocco})]
+        conn.execute(delete(GiacenzaRicambio).where(GiacenzaRicambio.c.idRicambio.in_(blocco)))
+        if righe:
+            conn.execute(insert(GiacenzaRicambio).execution_options(nome_query="magazzino_incrementale"), righe)
+    _consuma(conn, voci)
+    _registra("incrementale", len(ricambi), t0)
+    return {"modo": "incrementale", "ricambi": len(ricambi), "voci": len(voci)}
+
+def _registra(modo: str, righe: int, t0: float):
+    _statistiche["completi" if modo == "completo" else "incrementali"] += 1
+    _statistiche["righe"] += righe
+    _statistiche["ultimo_ms"] = (time.perf_counter() - t0) * 1000
+    _statistiche["ultimo_modo"] = modo
+
+
+# -------------------------
+# LETTURA E VERIFICA
+# -------------------------
+
+# Aggiorna il riepilogo (incrementale) e ritorna (colonne, righe) delle giacenze.
+def giacenze(conn, meta, sotto_scorta: bool = False, aggiorna_prima: bool = True):
+    if aggiorna_prima:
+        aggiorna(conn, meta)
+    res = conn.execute(statement_giacenze(meta, sotto_scorta))
+    return list(res.keys()), [tuple(r) for r in res]
+
+# Confronta il riepilogo con il ricalcolo dallo storico, senza scrivere (da
+# eseguire dopo aggiorna: le voci ancora nel registro risultano differenze).
+# Ritorna le differenze: [(idRicambio, riepilogo, storico)].
+def verifica(conn, meta) -> list[tuple]:
+    _controlla_installazione(conn)
+    attesi = {r[0]: tuple(r[1:]) for r in conn.execute(statement_completo(meta))}
+    colonne = [c for c in GiacenzaRicambio.c if c.name not in ("idRicambio", "aggiornato")]
+    salvati = {r[0]: tuple(r[1:]) for r in conn.execute(select(GiacenzaRicambio.c.idRicambio, *colonne))}
+    vuoto = (0, 0, None, 0, 0, None)
+    differenze = []
+    for id_ricambio in sorted(set(attesi) | set(salvati)):
+        a, s = attesi.get(id_ricambio, vuoto), salvati.get(id_ricambio, vuoto)
+        if a != s:
+            differenze.append((id_ricambio, s, a))
+    return differenze
+
+# Stato del riepilogo in memoria del processo (per il menu statistiche).
+def riepilogo() -> str:
+    s = _statistiche
+    ultimo = f"{s['ultimo_ms']:.1f} ms ({s['ultimo_modo']})" if s["ultimo_ms"] is not None else "mai"
+    return (
+        f"magazzino: ultimo aggiornamento {ultimo} "
+        f"incrementali={s['incrementali']} completi={s['completi']} ricambi aggiornati={s['righe']}"
+    )
+
+
+if __name__ == "__main__":
+    import output
+    from database import engine
+    from schema_reflect import schema_riflesso
+
+    parser = argparse.ArgumentParser(description="Giacenze dei ricambi da forniture e ordini")
+    parser.add_argument("--installa", action="store_true",
+                        help="crea tabelle e trigger del magazzino e calcola il riepilogo (una volta)")
+    parser.add_argument("--ricostruisci", action="store_true", help="ricalcola il riepilogo da tutto lo storico")
+    parser.add_argument("--verifica", action="store_true", help="confronta il riepilogo con il ricalcolo completo")
+    parser.add_argument("--sotto-scorta", action="store_true", help="solo i ricambi da riordinare")
+    args = parser.parse_args()
+
+    meta = schema_riflesso(tabelle=["Ricambio", "Fornitura", "Ordine", "DettaglioOrdine"])
+    with engine.begin() as conn:
+        t0 = time.perf_counter()
+        if args.installa:
+            esito = {"modo": "installazione", "ricambi": installa(conn, meta)}
+        elif args.ricostruisci:
+            esito = {"modo": "completo", "ricambi": ricostruisci(conn, meta)}
+        else:
+            esito = aggiorna(conn, meta)
+        print(f"Riepilogo {esito['modo']}: {esito['ricambi']} ricambi in {(time.perf_counter() - t0) * 1000:.1f} ms",
+              file=sys.stderr)
+        if args.verifica:
+            differenze = verifica(conn, meta)
+            for id_ricambio, salvato, atteso in differenze:
+                print(f"DIFFERENZA ricambio {id_ricambio}: riepilogo {salvato}, storico {atteso}", file=sys.stderr)
+            print(f"Verifica: {len(differenze)} differenze", file=sys.stderr)
+        colonne, righe = giacenze(conn, meta, args.sotto_scorta, aggiorna_prima=False)
+    output.scrivi_tabella(colonne, [righe])
+    sys.exit(1 if args.verifica and differenze else 0)
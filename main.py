@@ -6,96 +6,100 @@
 #
 
 from __future__ import annotations
-from datetime import datetime
+import sys
+
+# con argomenti: modalità a comandi non interattiva (vedi cli.py), smistata
+# prima degli import del menu così il comando carica solo ciò che gli serve
+if __name__ == "__main__" and len(sys.argv) > 1:
+    import cli
+    sys.exit(cli.esegui_comando(sys.argv[1:]))
+
+from datetime import datetime, timedelta
 from typing import Any
-from sqlalchemy import select, func
-from database import engine
+import time
+from database import (
+    engine, engine_lettura, segna_scrittura, tutti_gli_engine, riscalda_pool, riepilogo_pool,
+    riepilogo_instradamento, battito_periodico,
+)
 from schema_reflect import schema_riflesso, controllo_tabelle_richieste
+from campi import colonna_ha_default, pk_autoincrementa, interprete, leggi_id
+import agenda
+import cache_risultati
+import chiavi
+import magazzino
+import metriche
+import output
 import queries
+import report
+import ricerca
 
 # -------------------------
 # FUNZIONI DI SUPPORTO
 # -------------------------
 
 
-# Esegue una query SELECT e stampa tutte le righe ottenute.
-# Serve solo per visualizzare i risultati a schermo.
-def stampa_risultato(conn, stmt):
-    rows = conn.execute(stmt).fetchall()
-    if not rows:
+# Esegue una query SELECT e stampa le righe ottenute come tabella.
+# Le righe arrivano in streaming (cursore lato server) e vengono stampate a blocchi.
+def stampa_risultato(conn, stmt, params: dict | None = None):
+    output.stampa_streaming(conn, stmt, params)
+
+# Esegue uno statement del catalogo di queries.py passando solo i parametri
+# e stampa il risultato.
+def stampa_catalogo(conn, meta, chiave: str, **params):
+    if chiave in cache_risultati.STATEMENT_CACHEABILI:
+        colonne, righe = cache_risultati.cache.leggi(conn, meta, chiave, **params)
+        if not output.scrivi_tabella(colonne, [righe]):
+            print("(nessun risultato)")
+    elif queries.usa_preparato(conn, chiave):
+        res = queries.esegui(conn, meta, chiave, **params)
+        if not output.scrivi_tabella(list(res.keys()), [res.all()]):
+            print("(nessun risultato)")
+    else:
+        stampa_risultato(conn, queries.catalogo(meta)[chiave], params)
+
+# Stampa le riparazioni con appuntamento una pagina alla volta (paginazione keyset).
+def stampa_a_pagine(conn, meta, dimensione: int = output.PAGINA_RIGHE):
+    n = 0
+    for i, pagina in enumerate(queries.pagine_riparazioni_con_appuntamento(conn, meta, dimensione), 1):
+        output.scrivi_tabella(list(pagina[0]._mapping.keys()), [pagina])
+        n += len(pagina)
+        if len(pagina) == dimensione:
+            if input(f"-- pagina {i}: invio per continuare, q per uscire -- ").strip().lower() == "q":
+                break
+    if n == 0:
         print("(nessun risultato)")
-        return
-    for r in rows:
-        print(dict(r._mapping))
-
-# Controlla se una colonna ha un valore di default
-def colonna_ha_default(col) -> bool:
-    return (col.default is not None) or (col.server_default is not None)
-
-# Verifica se la PK è autoincrement
-def pk_autoincrementa(col) -> bool:
-    try:
-        return bool(getattr(col, "autoincrement", False))
-    except Exception:
-        return False
-
-# Calcola e inserisce la PK se non autoincrementa
-def id_successivo(conn, table, pk_name: str) -> int:
-    stmt = select(func.coalesce(func.max(table.c[pk_name]), 0) + 1)
-    return int(conn.execute(stmt).scalar_one())
-
-# converte l’input stringa dell’utente nel tipo corretto
-def interprete(raw: str, col):
-    raw = raw.strip()
-    if raw == "":
-        return None
-
-# DateTime
-    try:
-        coltype = col.type.__class__.__name__.lower()
-        if "datetime" in coltype:
-            if len(raw) == 16:  # "YYYY-MM-DD HH:MM"
-                raw = raw + ":00"
-            return raw
-    except Exception:
-        pass
-
-    py = getattr(col.type, "python_type", None)
-    if py is None:
-        return raw
-
-    try:
-        if py is int:
-            return int(raw)
-        if py is float:
-            return float(raw)
-        return raw
-    except Exception:
-        return raw
-
-# inserisce una riga chiedendo solo i campi obbligatori
-def inserisci_campi_richiesti(conn, table, preset: dict | None = None, pk_name: str | None = None):
-
-    preset = dict(preset or {})
-    cols = list(table.c)
 
-# PK singola (se non fornita)
-    if pk_name is None:
-        pks = [c.name for c in cols if c.primary_key]
-        pk_name = pks[0] if len(pks) == 1 else None
-
-# se PK singola e non autoincrement, genero valore
-    if pk_name and pk_name not in preset:
-        pk_col = table.c[pk_name]
-        if (not pk_autoincrementa(pk_col)) and (not colonna_ha_default(pk_col)):
-            preset[pk_name] = id_successivo(conn, table, pk_name)
+# Stampa il profilo di un cliente (queries.profilo_cliente): anagrafica e una
+# tabella per dispositivi, riparazioni e ciascuna tabella figlia delle riparazioni.
+def stampa_profilo(profilo: dict):
+    anagrafica = ", ".join(f"{k}={v}" for k, v in profilo["anagrafica"].items() if v is not None)
+    print(f"\nCliente {profilo['idCliente']} ({profilo.get('tipoCliente') or '-'}): {anagrafica}")
+    dispositivi = profilo["dispositivi"]
+    riparazioni = [r for d in dispositivi for r in d["riparazioni"]]
+    sezioni = [("Dispositivi", dispositivi), ("Riparazioni", riparazioni)]
+    sezioni += [(chiave.capitalize(), [f for r in riparazioni for f in r[chiave]]) for chiave, _ in queries.PROFILO_FIGLI]
+    for titolo, righe in sezioni:
+        print(f"\n{titolo} ({len(righe)})")
+        if righe:
+            colonne = [c for c in righe[0] if not isinstance(righe[0][c], list)]
+            output.scrivi_tabella(colonne, [[[r[c] for c in colonne] for r in righe]])
+
+# Calcola e inserisce la PK se non autoincrementa.
+# Gli id arrivano dall'allocatore a blocchi di chiavi.py (niente MAX()+1 per riga).
+def id_successivo(conn, table, pk_name: str) -> int:
+    return chiavi.allocatore.prossima(table, pk_name, conn=conn)
 
-    data: dict[str, Any] = dict(preset)
+# chiede all'utente solo i campi obbligatori di una riga, senza toccare il database.
+# Le colonne in da_collegare (FK verso righe non ancora scritte) e la PK generata
+# vengono lasciate a scrivi_riga.
+def raccogli_campi_richiesti(table, preset: dict | None = None, pk_name: str | None = None,
+                             da_collegare=()) -> dict[str, Any]:
+    data: dict[str, Any] = dict(preset or {})
 
-    for col in cols:
+    for col in table.c:
         name = col.name
 
-        if name in data:
+        if name in data or name in da_collegare or name == pk_name:
             continue
 
 # PK autoincrement o default => non richiesto
@@ -115,15 +119,158 @@ def inserisci_campi_richiesti(conn, table, preset: dict | None = None, pk_name:
             raw = input(prompt)
         data[name] = interprete(raw, col)
 
+    return data
+
+# scrive una riga già raccolta: se la PK è singola e non autoincrementa la genera
+# con l'allocatore, poi esegue l'INSERT. Ritorna il valore della PK.
+def scrivi_riga(conn, table, data: dict, pk_name: str | None = None):
+    data = dict(data)
+
+# PK singola (se non fornita)
+    if pk_name is None:
+        pks = [c.name for c in table.c if c.primary_key]
+        pk_name = pks[0] if len(pks) == 1 else None
+
+# se PK singola e non autoincrement, genero valore
+    if pk_name and pk_name not in data:
+        pk_col = table.c[pk_name]
+        if (not pk_autoincrementa(pk_col)) and (not colonna_ha_default(pk_col)):
+            data[pk_name] = id_successivo(conn, table, pk_name)
+
     if not data:
         raise RuntimeError(f"Insert vuoto su {table.name}: impossibile.")
 
-    res = conn.execute(table.insert().values(**data))
+    res = conn.execute(table.insert().values(**data).execution_options(nome_query=f"insert_{table.name}"))
 
     if pk_name:
         return data.get(pk_name, getattr(res, "lastrowid", None))
     return getattr(res, "lastrowid", None)
 
+# inserisce una riga chiedendo solo i campi obbligatori
+def inserisci_campi_richiesti(conn, table, preset: dict | None = None, pk_name: str | None = None):
+    return scrivi_riga(conn, table, raccogli_campi_richiesti(table, preset, pk_name), pk_name)
+
+# scrive in sequenza le righe raccolte, collegando ciascuna alle precedenti.
+# righe: lista di (tabella, dati, pk, collegamenti), dove collegamenti mappa una
+# colonna FK sull'indice della riga (già scritta) da cui prende l'id.
+# Ritorna gli id delle righe nello stesso ordine.
+def scrivi_righe_collegate(conn, righe) -> list:
+    ids = []
+    for table, data, pk_name, collegamenti in righe:
+        data = {**data, **{col: ids[i] for col, i in collegamenti.items()}}
+        ids.append(scrivi_riga(conn, table, data, pk_name))
+    return ids
+
+# chiede un campo opzionale e lo aggiunge ai dati se la colonna esiste ed è stato indicato
+def chiedi_campo(table, data: dict, colonna: str, prompt: str):
+    if colonna in table.c:
+        v = input(prompt).strip()
+        if v:
+            data[colonna] = v
+
+
+# Prima fase dell'INSERT guidato (menu 6): raccoglie e controlla tutti i campi di
+# Cliente, figlio Privato/Business, Dispositivo, Riparazione e Appuntamento
+# (opzionale) senza aprire connessioni. Ritorna le righe per scrivi_righe_collegate
+# e i dati che servono dopo il commit (cache, indice di ricerca, agenda).
+def raccogli_inserimento_guidato(meta) -> dict:
+    Cliente = meta.tables["Cliente"]
+    Dispositivo = meta.tables["Dispositivo"]
+    Riparazione = meta.tables["Riparazione"]
+    Appuntamento = meta.tables["Appuntamento"]
+
+    # ----- scelta tipo cliente -----
+    print("\nTipo cliente:")
+    print("1) Privato")
+    print("2) Business")
+    tipo_sel = input("Scelta (1/2): ").strip()
+    if tipo_sel not in ("1", "2"):
+        raise RuntimeError("Tipo cliente non valido.")
+
+    tipo_cliente = "Privato" if tipo_sel == "1" else "Business"
+    nome_spec = "ClientePrivato" if tipo_cliente == "Privato" else "ClienteBusiness"
+    if nome_spec not in meta.tables:
+        raise RuntimeError(f"Tabella '{nome_spec}' non trovata nel DB.")
+    ClienteSpec = meta.tables[nome_spec]
+
+    # ----- 1) Cliente (padre) -----
+    preset_cliente = {}
+    if "tipoCliente" in Cliente.c:
+        preset_cliente["tipoCliente"] = tipo_cliente
+    print("\n>> Cliente")
+    dati_cliente = raccogli_campi_richiesti(Cliente, preset_cliente, "idCliente")
+
+    # ----- 2) ClientePrivato / ClienteBusiness -----
+    print(f"\n>> {nome_spec}")
+    spec = {}
+    if tipo_cliente == "Privato":
+        chiedi_campo(ClienteSpec, spec, "nome", "Nome: ")
+        chiedi_campo(ClienteSpec, spec, "cognome", "Cognome: ")
+        chiedi_campo(ClienteSpec, spec, "codiceFiscale", "Codice Fiscale (invio per saltare): ")
+        chiedi_campo(ClienteSpec, spec, "telefono", "numero di telefono (invio per saltare): ")
+        etichetta = ("Privato", spec.get("nome"), spec.get("cognome"))
+        cliente_ricerca = {"nome": spec.get("nome"), "cognome": spec.get("cognome"), "telefono": spec.get("telefono")}
+    else:
+        chiedi_campo(ClienteSpec, spec, "ragioneSociale", "Ragione Sociale: ")
+        chiedi_campo(ClienteSpec, spec, "partitaIVA", "Partita IVA (invio per saltare): ")
+        chiedi_campo(ClienteSpec, spec, "telefono", "numero di telefono (invio per saltare): ")
+        etichetta = ("Business", spec.get("ragioneSociale"))
+        cliente_ricerca = {"ragione_sociale": spec.get("ragioneSociale"), "telefono": spec.get("telefono")}
+    dati_spec = raccogli_campi_richiesti(ClienteSpec, spec, "idCliente", da_collegare=("idCliente",))
+
+    # ----- 3) Dispositivo -----
+    print("\n>> Dispositivo")
+    disp = {}
+    # tipo dispositivo: può chiamarsi tipo o tipoDispositivo
+    v_tipo = input("Tipo dispositivo (es. Smartphone/PC) [invio per saltare]: ").strip()
+    if v_tipo:
+        if "tipoDispositivo" in Dispositivo.c:
+            disp["tipoDispositivo"] = v_tipo
+        elif "tipo" in Dispositivo.c:
+            disp["tipo"] = v_tipo
+    chiedi_campo(Dispositivo, disp, "marca", "Marca [invio per saltare]: ")
+    chiedi_campo(Dispositivo, disp, "modello", "Modello [invio per saltare]: ")
+    chiedi_campo(Dispositivo, disp, "numeroSerie", "Seriale [invio per saltare]: ")
+    dati_disp = raccogli_campi_richiesti(Dispositivo, disp, "idDispositivo", da_collegare=("idCliente",))
+
+    # ----- 4) Riparazione -----
+    print("\n>> Riparazione")
+    rip = {}
+    if "stato" in Riparazione.c:
+        rip["stato"] = "Aperta"
+    if "dataIngresso" in Riparazione.c:
+        rip["dataIngresso"] = datetime.now().replace(microsecond=0)
+    dati_rip = raccogli_campi_richiesti(Riparazione, rip, "idRiparazione", da_collegare=("idDispositivo",))
+
+    righe = [
+        (Cliente, dati_cliente, "idCliente", {}),
+        (ClienteSpec, dati_spec, "idCliente", {"idCliente": 0}),
+        (Dispositivo, dati_disp, "idDispositivo", {"idCliente": 0}),
+        (Riparazione, dati_rip, "idRiparazione", {"idDispositivo": 2}),
+    ]
+
+    # ----- 5) Appuntamento (opzionale) -----
+    data_ora = None
+    if input("Vuoi inserire un Appuntamento? (s/n): ").strip().lower() == "s":
+        print("\n>> Appuntamento")
+        app = {}
+        if "dataOra" in Appuntamento.c:
+            dt_str = input("DataOra (YYYY-MM-DD HH:MM oppure YYYY-MM-DD HH:MM:SS): ").strip()
+            if len(dt_str) == 16:
+                dt_str += ":00"
+            data_ora = app["dataOra"] = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
+        dati_app = raccogli_campi_richiesti(Appuntamento, app, "idAppuntamento", da_collegare=("idRiparazione",))
+        righe.append((Appuntamento, dati_app, "idAppuntamento", {"idRiparazione": 3}))
+
+    return {
+        "righe": righe,
+        "etichetta": etichetta,
+        "cliente_ricerca": cliente_ricerca,
+        "numero_serie": dati_disp.get("numeroSerie"),
+        "data_ora": data_ora,
+    }
+
+
 
 # --------------------------------------------------------------------------------
 # INTERFACCIA UTENTE (lavora su riga di comando), non è prevista una GUI (per ora)
@@ -138,19 +285,48 @@ def menu():
     print("4) Riparazioni con almeno un appuntamento (EXISTS)")
     print("5) Update stato riparazione")
     print("6) INSERT guidato (Cliente Privato/Business + Dispositivo + Riparazione + opz. Appuntamento)")
-    print("7) Elimina riparazione (e relativi appuntamenti)")
+    print("7) Elimina riparazione (e righe collegate)")
+    print("8) Statistiche (cache degli statement e pool di connessioni)")
+    print("9) Metriche delle query (latenze, esportazione JSON/Prometheus)")
+    print("10) Agenda appuntamenti (intervallo di date e carico per ora/giorno/settimana)")
+    print("11) Report direzionali (stati, tempi per tecnico, ricavi per mese)")
+    print("12) Ricerca approssimata (cliente, telefono o seriale)")
+    print("13) Profilo cliente (dispositivi, riparazioni, appuntamenti, preventivi, pagamenti, garanzie)")
+    print("14) Magazzino ricambi (giacenze e ricambi da riordinare)")
     print("0) Esci")
 
+# l'indice di ricerca si prepara alla prima ricerca (opzioni 12 e 13), non all'avvio:
+# su tabelle grandi costa tempo e memoria anche a chi non cerca
+def indice_ricerca(conn, meta):
+    if not ricerca.indice.pronto:
+        print("Preparazione dell'indice di ricerca...")
+        t0 = time.perf_counter()
+        modo = ricerca.indice.assicura(conn, meta)
+        if modo:
+            print(f"Indice pronto ({modo} in {time.perf_counter() - t0:.1f}s)")
+    return ricerca.indice
+
+# scelte del menu che fanno solo letture: possono andare su una replica
+SCELTE_LETTURA = {"1", "2", "3", "4", "10", "11", "12", "13"}
+
 # punto centrale dell'applicativo
-def main():
+# prepara l'applicativo: schema, catalogo degli statement e pool
+def avvio():
     meta = schema_riflesso()
     controllo_tabelle_richieste(meta)
+    queries.catalogo(meta).completo()
+    for eng in tutti_gli_engine():
+        queries.attiva_contatori(eng)
+        metriche.attiva(eng)
+    metriche.scrivi_periodicamente()
+    battito_periodico()
+    riscalda_pool()
+    with engine_lettura().connect() as conn:
+        agenda.settimana.carica(conn, meta)
+    return meta
 
-# tabelle base
-    Cliente = meta.tables["Cliente"]
-    Dispositivo = meta.tables["Dispositivo"]
-    Riparazione = meta.tables["Riparazione"]
-    Appuntamento = meta.tables["Appuntamento"]
+def main():
+    meta = avvio()
 
     while True:
         menu()
@@ -160,8 +336,43 @@ def main():
             print("Ciao, alla prossima!.")
             break
 
+        if scelta == "8":
+            print(queries.riepilogo_contatori())
+            print(riepilogo_pool())
+            print(cache_risultati.cache.riepilogo())
+            print(report.riepilogo())
+            print(riepilogo_instradamento())
+            print(ricerca.indice.riepilogo())
+            print(magazzino.riepilogo())
+            continue
+
+        if scelta == "9":
+            print(metriche.riepilogo())
+            percorso = input("Esporta su file (.json o .prom, invio per saltare): ").strip()
+            if percorso:
+                metriche.scrivi(percorso)
+                print(f"Metriche scritte in {percorso}")
+            continue
+
+        # clienti i cui risultati in cache vanno invalidati dopo il commit
+        clienti_modificati = set()
+        # modifiche da riportare sull'agenda della settimana dopo il commit
+        appuntamenti_inseriti = []
+        riparazioni_eliminate = []
+        # clienti e dispositivi da aggiungere all'indice di ricerca dopo il commit
+        clienti_inseriti = []
+        dispositivi_inseriti = []
+
         try:
-            with engine.begin() as conn:
+            # letture su una replica (se configurata), scritture sul primario
+            eng = engine_lettura() if scelta in SCELTE_LETTURA else engine
+            # INSERT guidato: i campi si raccolgono prima di aprire la transazione,
+            # così nessun lock resta aperto mentre si aspetta l'utente
+            guidato = inizio_scrittura = None
+            if scelta == "6":
+                print("\n--- INSERT GUIDATO (popola tutti i campi obbligatori dal tuo DB) ---")
+                guidato = raccogli_inserimento_guidato(meta)
+            with eng.begin() as conn:
 
                 if scelta == "1":
                     print("\nTipo cliente per ricerca dispositivi:")
@@ -172,18 +383,73 @@ def main():
                     if t == "1":
                         nome = input("Nome: ").strip()
                         cognome = input("Cognome: ").strip()
-                        stmt = queries.q_dispositivi_cliente_privato(meta, nome, cognome)
-                        stampa_risultato(conn, stmt)
+                        stampa_catalogo(conn, meta, "q_dispositivi_cliente_privato", nome=nome, cognome=cognome)
                     elif t == "2":
                         ragione_sociale = input("Ragione Sociale: ").strip()
-                        stmt = queries.q_dispositivi_cliente_business(meta, ragione_sociale)
-                        stampa_risultato(conn, stmt)
+                        stampa_catalogo(conn, meta, "q_dispositivi_cliente_business", ragione_sociale=ragione_sociale)
                     else:
                         print("Scelta non valida.")
 
                 elif scelta == "2":
-                    stmt = queries.q_riparazioni_con_appuntamento(meta)
-                    stampa_risultato(conn, stmt)
+                    stampa_a_pagine(conn, meta)
+
+                elif scelta == "12":
+                    testo = input("Cerca (nome, ragione sociale, telefono o seriale): ").strip()
+                    colonne = ["punteggio", "tipo", "testo", "idCliente", "id"]
+                    risultati = indice_ricerca(conn, meta).cerca(testo)
+                    if not output.scrivi_tabella(colonne, [[[r[c] for c in colonne] for r in risultati]]):
+                        print("(nessun risultato)")
+
+                elif scelta == "13":
+                    raw = input("idCliente (oppure nome, telefono o seriale da cercare): ").strip()
+                    if raw.isdigit():
+                        id_cliente = int(raw)
+                    else:
+                        trovati = indice_ricerca(conn, meta).cerca(raw, limite=1)
+                        if not trovati:
+                            raise RuntimeError(f"Nessun cliente trovato per '{raw}'.")
+                        id_cliente = trovati[0]["idCliente"]
+                        print(f"Trovato: {trovati[0]['testo']} (idCliente={id_cliente})")
+                    profilo = queries.profilo_cliente(conn, meta, id_cliente)
+                    if profilo is None:
+                        print("(nessun risultato)")
+                    else:
+                        stampa_profilo(profilo)
+
+                elif scelta == "14":
+                    # il riepilogo si aggiorna (incrementale) sul primario prima della lettura
+                    sotto_scorta = input("Solo i ricambi da riordinare? (s/n): ").strip().lower() == "s"
+                    colonne, righe = magazzino.giacenze(conn, meta, sotto_scorta)
+                    if not output.scrivi_tabella(colonne, [righe]):
+                        print("(nessun risultato)")
+                    print(magazzino.riepilogo())
+
+                elif scelta == "11":
+                    nomi = list(report.REPORT)
+                    for i, nome in enumerate(nomi, 1):
+                        print(f"{i}) {report.REPORT[nome].titolo}")
+                    nome = nomi[int(input("Report: ").strip()) - 1]
+                    modo = "completo" if input("Ricalcolo completo? (s/n): ").strip().lower() == "s" else "auto"
+                    colonne, righe = report.leggi(conn, meta, nome, modo)
+                    if not output.scrivi_tabella(colonne, [righe]):
+                        print("(nessun risultato)")
+                    print(report.REPORT[nome].riepilogo())
+
+                elif scelta == "10":
+                    da = input("Dal giorno (YYYY-MM-DD, invio = settimana corrente): ").strip()
+                    a = None
+                    if da:
+                        da = datetime.strptime(da, "%Y-%m-%d")
+                        a = input("Al giorno escluso (YYYY-MM-DD, invio = giorno successivo): ").strip()
+                        a = datetime.strptime(a, "%Y-%m-%d") if a else da + timedelta(days=1)
+                    else:
+                        da = None
+                    granularita = input("Carico per (ora/giorno/settimana) [giorno]: ").strip().lower() or "giorno"
+                    righe, conteggi = agenda.agenda(conn, meta, da, a, granularita)
+                    if not output.scrivi_tabella(["idAppuntamento", "dataOra", "idRiparazione"], [righe]):
+                        print("(nessun appuntamento)")
+                    print()
+                    output.scrivi_tabella([granularita, "appuntamenti"], [conteggi])
 
                 elif scelta == "3":
                     print("\nTipo cliente per ricerca appuntamenti:")
@@ -194,179 +460,78 @@ def main():
                     if t == "1":
                         nome = input("Nome: ").strip()
                         cognome = input("Cognome: ").strip()
-                        stmt = queries.q_appuntamenti_cliente_privato(meta, nome, cognome)
-                        stampa_risultato(conn, stmt)
+                        stampa_catalogo(conn, meta, "q_appuntamenti_cliente_privato", nome=nome, cognome=cognome)
                     elif t == "2":
                         ragione_sociale = input("Ragione Sociale: ").strip()
-                        stmt = queries.q_appuntamenti_cliente_business(meta, ragione_sociale)
-                        stampa_risultato(conn, stmt)
+                        stampa_catalogo(conn, meta, "q_appuntamenti_cliente_business", ragione_sociale=ragione_sociale)
                     else:
                         print("Scelta non valida.")
 
                 elif scelta == "4":
-                    stmt = queries.q_riparazioni_con_appuntamento_exists(meta)
-                    stampa_risultato(conn, stmt)
+                    stampa_catalogo(conn, meta, "q_riparazioni_con_appuntamento_exists")
 
                 elif scelta == "5":
-                    idr = int(input("idRiparazione: ").strip())
+                    ids = leggi_id(input("idRiparazione (più id separati da virgola): "))
                     stato = input("Nuovo stato: ").strip()
-                    stmt = queries.update_stato_riparazione(meta, idr, stato)
-                    res = conn.execute(stmt)
-                    print("OK" if res.rowcount == 1 else "Nessuna riga aggiornata")
+                    clienti_modificati |= cache_risultati.clienti_di_riparazioni(conn, meta, ids)
+                    if len(ids) == 1:
+                        res = queries.esegui(conn, meta, "update_stato_riparazione", id_riparazione=ids[0], nuovo_stato=stato)
+                        print("OK" if res.rowcount == 1 else "Nessuna riga aggiornata")
+                    else:
+                        n = queries.aggiorna_stato_riparazioni(conn, meta, {i: stato for i in ids})
+                        print(f"Aggiornate {n} riparazioni su {len(ids)}")
 
                 elif scelta == "6":
-                    print("\n--- INSERT GUIDATO (popola tutti i campi obbligatori dal tuo DB) ---")
-
-                    # ----- scelta tipo cliente -----
-                    print("\nTipo cliente:")
-                    print("1) Privato")
-                    print("2) Business")
-                    tipo_sel = input("Scelta (1/2): ").strip()
-                    if tipo_sel not in ("1", "2"):
-                        raise RuntimeError("Tipo cliente non valido.")
-
-                    tipo_cliente = "Privato" if tipo_sel == "1" else "Business"
-
-                    # ----- 1) INSERT Cliente (padre) -----
-                    preset_cliente = {}
-
-                    # colonna tipoCliente
-                    if "tipoCliente" in Cliente.c:
-                        preset_cliente["tipoCliente"] = tipo_cliente
-
-
-                    print("\n>> Inserimento Cliente")
-                    id_cliente = inserisci_campi_richiesti(conn, Cliente, preset=preset_cliente, pk_name="idCliente")
-                    print(f"Creato Cliente n. idCliente={id_cliente}")
-
-                    # ----- 2) INSERT ClientePrivato / ClienteBusiness -----
-                    if tipo_cliente == "Privato":
-                        if "ClientePrivato" not in meta.tables:
-                            raise RuntimeError("Tabella 'ClientePrivato' non trovata nel DB.")
-                        ClienteSpec = meta.tables["ClientePrivato"]
-                        print("\n>> Inserimento Cliente Privato")
-                        preset_spec = {"idCliente": id_cliente}
-
-                        # campi esempio
-                        if "nome" in ClienteSpec.c:
-                            v = input("Nome: ").strip()
-                            if v:
-                                preset_spec["nome"] = v
-                        if "cognome" in ClienteSpec.c:
-                            v = input("Cognome: ").strip()
-                            if v:
-                                preset_spec["cognome"] = v
-                        if "codiceFiscale" in ClienteSpec.c:
-                            v = input("Codice Fiscale (invio per saltare): ").strip()
-                            if v:
-                                preset_spec["codiceFiscale"] = v
-                        if "telefono" in ClienteSpec.c:
-                            v = input("numero di telefono (invio per saltare): ").strip()
-                            if v:
-                                preset_spec["telefono"] = v
-
-                        inserisci_campi_richiesti(conn, ClienteSpec, preset=preset_spec, pk_name="idCliente")
-                        print("Creato Cliente Privato")
-
-                    else:
-                        if "ClienteBusiness" not in meta.tables:
-                            raise RuntimeError("Tabella 'ClienteBusiness' non trovata nel DB.")
-                        ClienteSpec = meta.tables["ClienteBusiness"]
-                        print("\n>> Inserimento ClienteBusiness")
-                        preset_spec = {"idCliente": id_cliente}
-
-                        if "ragioneSociale" in ClienteSpec.c:
-                            v = input("Ragione Sociale: ").strip()
-                            if v:
-                                preset_spec["ragioneSociale"] = v
-                        if "partitaIVA" in ClienteSpec.c:
-                            v = input("Partita IVA (invio per saltare): ").strip()
-                            if v:
-                                preset_spec["partitaIVA"] = v
-                        if "telefono" in ClienteSpec.c:
-                            v = input("numero di telefono (invio per saltare): ").strip()
-                            if v:
-                                preset_spec["telefono"] = v
-
-                        inserisci_campi_richiesti(conn, ClienteSpec, preset=preset_spec, pk_name="idCliente")
-                        print("Creato ClienteBusiness")
-
-                    # ----- 3) INSERT Dispositivo -----
-                    print("\n>> Inserimento Dispositivo")
-                    preset_disp = {"idCliente": id_cliente}
-
-                    # tipo dispositivo: può chiamarsi tipo o tipoDispositivo
-                    v_tipo = input("Tipo dispositivo (es. Smartphone/PC) [invio per saltare]: ").strip()
-                    if v_tipo:
-                        if "tipoDispositivo" in Dispositivo.c:
-                            preset_disp["tipoDispositivo"] = v_tipo
-                        elif "tipo" in Dispositivo.c:
-                            preset_disp["tipo"] = v_tipo
-
-                    if "marca" in Dispositivo.c:
-                        v = input("Marca [invio per saltare]: ").strip()
-                        if v:
-                            preset_disp["marca"] = v
-                    if "modello" in Dispositivo.c:
-                        v = input("Modello [invio per saltare]: ").strip()
-                        if v:
-                            preset_disp["modello"] = v
-                    if "numeroSerie" in Dispositivo.c:
-                        v = input("Seriale [invio per saltare]: ").strip()
-                        if v:
-                            preset_disp["numeroSerie"] = v
-
-                    id_disp = inserisci_campi_richiesti(conn, Dispositivo, preset=preset_disp, pk_name="idDispositivo")
-                    print(f"Creato Dispositivo idDispositivo={id_disp}")
-
-                    # ----- 4) INSERT Riparazione -----
-                    print("\n>> Inserimento Riparazione")
-                    preset_rip = {"idDispositivo": id_disp}
-
-                    if "stato" in Riparazione.c:
-                        preset_rip["stato"] = "Aperta"
-                    if "dataIngresso" in Riparazione.c:
-                        preset_rip["dataIngresso"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                    id_rip = inserisci_campi_richiesti(conn, Riparazione, preset=preset_rip, pk_name="idRiparazione")
-                    print(f"Creata Riparazione idRiparazione={id_rip}")
-
-                    # ----- 5) INSERT Appuntamento (opzionale) -----
-                    add_app = input("Vuoi inserire un Appuntamento? (s/n): ").strip().lower()
-                    if add_app == "s":
-                        print("\n>> Inserimento Appuntamento")
-                        preset_app = {"idRiparazione": id_rip}
-
-                        if "dataOra" in Appuntamento.c:
-                            dt_str = input("DataOra (YYYY-MM-DD HH:MM oppure YYYY-MM-DD HH:MM:SS): ").strip()
-                            if len(dt_str) == 16:
-                                dt_str += ":00"
-                            preset_app["dataOra"] = dt_str
-
-                        id_app = inserisci_campi_richiesti(conn, Appuntamento, preset=preset_app, pk_name="idAppuntamento")
-                        print(f"Creato Appuntamento idAppuntamento={id_app}")
-
-                    print("INSERT completato (transazione OK).")
+                    # seconda fase: tutte le INSERT una dopo l'altra, senza input né letture
+                    inizio_scrittura = time.perf_counter()
+                    ids = scrivi_righe_collegate(conn, guidato["righe"])
+                    id_cliente, _, id_disp, id_rip = ids[:4]
+                    clienti_modificati.add(guidato["etichetta"])
+                    clienti_inseriti.append(guidato["cliente_ricerca"])
+                    dispositivi_inseriti.append((id_disp, guidato["numero_serie"]))
+                    if guidato["data_ora"] is not None:
+                        appuntamenti_inseriti.append((ids[4], guidato["data_ora"], id_rip))
 
                     # -----  delete riparazione -----
                 elif scelta == "7":
-                    idr = int(input("idRiparazione da eliminare: ").strip())
+                    ids = leggi_id(input("idRiparazione da eliminare (più id separati da virgola): "))
                     conferma = input(
-                    "Confermi eliminazione riparazione e appuntamenti associati? (s/n): "
+                    "Confermi eliminazione riparazione e righe collegate (appuntamenti, interventi, "
+                    "preventivi, pagamenti, garanzie)? (s/n): "
                     ).strip().lower()
 
                     if conferma != "s":
                         print("Operazione annullata.")
                     else:
-                        stmt_app, stmt_rip = queries.delete_riparazione(meta, idr)
-                        conn.execute(stmt_app)
-                        res = conn.execute(stmt_rip)
-                        print("OK" if res.rowcount == 1 else "Nessuna riparazione eliminata")
+                        clienti_modificati |= cache_risultati.clienti_di_riparazioni(conn, meta, ids)
+                        riparazioni_eliminate = ids
+                        eliminate = queries.elimina_riparazioni(conn, meta, ids)
+                        print(queries.riepilogo_eliminazione(eliminate, len(ids)))
 
 
                 else:
                     print("Scelta non valida.")
 
+            if inizio_scrittura is not None:
+                # durata della transazione di scrittura, commit compreso
+                ms = (time.perf_counter() - inizio_scrittura) * 1000
+                metriche.registra("inserimento_guidato", ms, len(ids))
+                print(f"Creati idCliente={id_cliente}, idDispositivo={id_disp}, idRiparazione={id_rip}"
+                      + (f", idAppuntamento={ids[4]}" if len(ids) > 4 else ""))
+                print(f"INSERT completato: {len(ids)} righe in {ms:.1f} ms di transazione "
+                      f"({ms / len(ids):.1f} ms per INSERT).")
+            if scelta not in SCELTE_LETTURA:
+                segna_scrittura()
+            cache_risultati.cache.invalida(clienti_modificati)
+            for id_app, data_ora, id_rip in appuntamenti_inseriti:
+                agenda.settimana.aggiungi(id_app, data_ora, id_rip)
+            if riparazioni_eliminate:
+                agenda.settimana.rimuovi_riparazioni(riparazioni_eliminate)
+            for campi in clienti_inseriti:
+                ricerca.indice.aggiungi_cliente(id_cliente, **campi)
+            for id_disp, numero_serie in dispositivi_inseriti:
+                ricerca.indice.aggiungi_dispositivo(id_disp, id_cliente, numero_serie)
+
         except Exception as e:
             print(f"ERRORE: {e}")
 
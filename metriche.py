@@ -0,0 +1,258 @@
+# metriche.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO LA STRUMENTAZIONE DELLE QUERY
+# Tramite gli eventi before/after_cursor_execute di SQLAlchemy si registrano,
+# per ogni query "logica" (il nome dello statement nel catalogo di queries.py,
+# es. q_riparazioni_con_appuntamento), numero di chiamate, righe e istogramma
+# delle latenze. Le query oltre la soglia finiscono nel log delle query lente
+# con parametri ed EXPLAIN: l'EXPLAIN viene messo in coda ed eseguito da un
+# thread a parte, fuori dal percorso della query. Le metriche si esportano in
+# JSON o in formato testuale Prometheus, dal menu o periodicamente su file.
+#
+# Nota: la latenza misurata è quella dell'esecuzione sul cursore (fino alla
+# prima risposta del server), non include la lettura delle righe.
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event
+
+# Soglia (ms) oltre la quale una query viene scritta nel log delle query lente.
+SOGLIA_LENTA_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+# File del log delle query lente (vuoto per disattivarlo).
+LOG_QUERY_LENTE = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+# Esportazione periodica delle metriche: file (.json oppure testo Prometheus) e intervallo in secondi.
+METRICHE_FILE = os.getenv("METRICHE_FILE", "")
+METRICHE_INTERVALLO = float(os.getenv("METRICHE_INTERVALLO", "60"))
+
+# Limiti superiori (ms) dei bucket dell'istogramma delle latenze.
+BUCKET_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf")]
+
+# Nome usato per gli statement che non vengono dal catalogo.
+ALTRE_QUERY = "altro"
+
+# Query lente in attesa di EXPLAIN: oltre questo numero vengono scritte senza piano.
+CODA_QUERY_LENTE = 100
+
+_lock = threading.Lock()
+_metriche: dict[str, dict] = {}
+_coda_lente: queue.Queue = queue.Queue(maxsize=CODA_QUERY_LENTE)
+_thread_lente: threading.Thread | None = None
+
+
+# righe resta None finché il driver non riporta un conteggio (rowcount -1 per le
+# SELECT su SQLite): meglio un valore assente che uno zero falso.
+def _nuova_metrica() -> dict:
+    return {"chiamate": 0, "righe": None, "errori": 0, "somma_ms": 0.0, "max_ms": 0.0, "bucket": [0] * len(BUCKET_MS)}
+
+
+# -------------------------
+# EVENTI
+# -------------------------
+
+# Registra gli eventi di misura sull'engine (una sola volta).
+def attiva(engine):
+    if event.contains(engine, "before_cursor_execute", _prima):
+        return
+    event.listen(engine, "before_cursor_execute", _prima)
+    event.listen(engine, "after_cursor_execute", _dopo)
+    event.listen(engine, "handle_error", _errore)
+
+
+def _nome_query(context) -> str:
+    opzioni = getattr(context, "execution_options", None) or {}
+    return opzioni.get("nome_query", ALTRE_QUERY)
+
+
+def _prima(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inizio_query", []).append(time.perf_counter())
+
+
+def _dopo(conn, cursor, statement, parameters, context, executemany):
+    inizi = conn.info.get("inizio_query")
+    if not inizi:
+        return
+    ms = (time.perf_counter() - inizi.pop()) * 1000
+    if statement.lstrip().upper().startswith("EXPLAIN"):
+        return
+    righe = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    misura(conn.engine, _nome_query(context), ms, righe, statement, parameters)
+
+
+def _errore(contesto_eccezione):
+    conn = contesto_eccezione.connection
+    if conn is not None and conn.info.get("inizio_query"):
+        conn.info["inizio_query"].pop()
+    nome = _nome_query(contesto_eccezione.execution_context) if contesto_eccezione.execution_context else ALTRE_QUERY
+    with _lock:
+        _metriche.setdefault(nome, _nuova_metrica())["errori"] += 1
+
+
+# Registra una query eseguita e, se oltre la soglia, la accoda al log delle query
+# lente. Usata dagli eventi e dalle esecuzioni che non passano da SQLAlchemy
+# (i prepared statement di queries.esegui_preparato).
+def misura(engine, nome: str, ms: float, righe: int | None, statement: str, parameters):
+    registra(nome, ms, righe)
+    if ms >= SOGLIA_LENTA_MS and LOG_QUERY_LENTE:
+        _accoda_query_lenta(engine, nome, ms, statement, parameters)
+
+# Aggiunge una misura alla query indicata (righe None = conteggio non disponibile).
+def registra(nome: str, ms: float, righe: int | None = None):
+    with _lock:
+        m = _metriche.setdefault(nome, _nuova_metrica())
+        m["chiamate"] += 1
+        if righe is not None:
+            m["righe"] = (m["righe"] or 0) + righe
+        m["somma_ms"] += ms
+        m["max_ms"] = max(m["max_ms"], ms)
+        for i, limite in enumerate(BUCKET_MS):
+            if ms <= limite:
+                m["bucket"][i] += 1
+                break
+
+
+# Mette in coda una query lenta per il thread del log (avviato alla prima).
+# Se la coda è piena la query viene scritta subito, senza EXPLAIN.
+def _accoda_query_lenta(engine, nome: str, ms: float, statement: str, parameters):
+    global _thread_lente
+    voce = {
+        "quando": datetime.now().isoformat(timespec="seconds"),
+        "query": nome,
+        "ms": round(ms, 2),
+        "sql": statement,
+        "parametri": parameters,
+        "explain": None,
+    }
+    with _lock:
+        if _thread_lente is None:
+            _thread_lente = threading.Thread(target=_ciclo_query_lente, name="query-lente", daemon=True)
+            _thread_lente.start()
+    try:
+        _coda_lente.put_nowait((engine, voce))
+    except queue.Full:
+        voce["explain"] = "EXPLAIN saltato: coda delle query lente piena"
+        _scrivi_voce(voce)
+
+def _ciclo_query_lente():
+    while True:
+        engine, voce = _coda_lente.get()
+        try:
+            _scrivi_query_lenta(engine, voce)
+        finally:
+            _coda_lente.task_done()
+
+# Attende che le query lente in coda siano scritte nel log.
+def attendi_query_lente():
+    _coda_lente.join()
+
+# Scrive una query lenta nel log, con parametri ed EXPLAIN (letto su una
+# connessione del pool, dal thread del log).
+def _scrivi_query_lenta(engine, voce: dict):
+    if voce["sql"].lstrip().upper().startswith("SELECT"):
+        try:
+            prefisso = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+            with engine.connect() as altra:
+                voce["explain"] = [list(r) for r in altra.exec_driver_sql(prefisso + voce["sql"], voce["parametri"])]
+        except Exception as e:
+            voce["explain"] = f"EXPLAIN non disponibile: {e}"
+    _scrivi_voce(voce)
+
+def _scrivi_voce(voce: dict):
+    try:
+        with open(LOG_QUERY_LENTE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(voce, default=str, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+
+# -------------------------
+# ESPORTAZIONE
+# -------------------------
+
+# Copia delle metriche: {query: {chiamate, righe, errori, somma_ms, media_ms, max_ms, bucket}}.
+def istantanea() -> dict:
+    with _lock:
+        copia = {n: {**m, "bucket": list(m["bucket"])} for n, m in _metriche.items()}
+    for m in copia.values():
+        m["media_ms"] = m["somma_ms"] / m["chiamate"] if m["chiamate"] else 0.0
+    return copia
+
+# Azzera le metriche raccolte.
+def azzera():
+    with _lock:
+        _metriche.clear()
+
+# Metriche in formato JSON.
+def in_json() -> str:
+    dati = istantanea()
+    for m in dati.values():
+        m["bucket"] = {("+Inf" if b == float("inf") else str(b)): n for b, n in zip(BUCKET_MS, m["bucket"])}
+    return json.dumps(dati, indent=2)
+
+# Metriche nel formato testuale di Prometheus (istogramma cumulativo per query).
+def in_prometheus() -> str:
+    righe = [
+        "# HELP centro_query_durata_ms Latenza delle query in millisecondi",
+        "# TYPE centro_query_durata_ms histogram",
+    ]
+    dati = istantanea()
+    for nome, m in sorted(dati.items()):
+        cumulato = 0
+        for limite, n in zip(BUCKET_MS, m["bucket"]):
+            cumulato += n
+            le = "+Inf" if limite == float("inf") else str(limite)
+            righe.append(f'centro_query_durata_ms_bucket{{query="{nome}",le="{le}"}} {cumulato}')
+        righe.append(f'centro_query_durata_ms_sum{{query="{nome}"}} {m["somma_ms"]:.3f}')
+        righe.append(f'centro_query_durata_ms_count{{query="{nome}"}} {m["chiamate"]}')
+    righe += ["# HELP centro_query_righe_total Righe restituite o modificate", "# TYPE centro_query_righe_total counter"]
+    righe += [
+        f'centro_query_righe_total{{query="{n}"}} {m["righe"]}'
+        for n, m in sorted(dati.items()) if m["righe"] is not None
+    ]
+    righe += ["# HELP centro_query_errori_total Esecuzioni fallite", "# TYPE centro_query_errori_total counter"]
+    righe += [f'centro_query_errori_total{{query="{n}"}} {m["errori"]}' for n, m in sorted(dati.items())]
+    return "\n".join(righe) + "\n"
+
+# Riepilogo leggibile (per il menu): una riga per query, ordinate per tempo totale.
+def riepilogo() -> str:
+    dati = istantanea()
+    if not dati:
+        return "(nessuna query registrata)"
+    righe = [f"{'query':<50} {'chiamate':>8} {'media ms':>9} {'max ms':>9} {'righe':>8} {'errori':>6}"]
+    for nome, m in sorted(dati.items(), key=lambda x: -x[1]["somma_ms"]):
+        righe.append(
+            f"{nome:<50} {m['chiamate']:>8} {m['media_ms']:>9.2f} {m['max_ms']:>9.2f} "
+            f"{'-' if m['righe'] is None else m['righe']:>8} {m['errori']:>6}"
+        )
+    return "\n".join(righe)
+
+# Scrive le metriche su file: JSON se il nome finisce con .json, altrimenti Prometheus.
+def scrivi(percorso: str):
+    contenuto = in_json() if percorso.endswith(".json") else in_prometheus()
+    tmp = percorso + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(contenuto)
+    os.replace(tmp, percorso)
+
+# Avvia un thread che scrive le metriche su file ogni `intervallo` secondi.
+def scrivi_periodicamente(percorso: str = METRICHE_FILE, intervallo: float = METRICHE_INTERVALLO):
+    if not percorso:
+        return None
+
+    def ciclo():
+        while True:
+            time.sleep(intervallo)
+            try:
+                scrivi(percorso)
+            except OSError:
+                pass
+
+    t = threading.Thread(target=ciclo, name="metriche", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,140 @@
+# output.py
+# -----------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO LA STAMPA DEI RISULTATI IN STREAMING:
+# le righe arrivano dal cursore lato server a blocchi e vengono scritte
+# a blocchi, senza mai tenere in memoria l'intero risultato.
+# Attenzione: il driver mysql-connector (mysql+mysqlconnector, il default)
+# non ha cursori lato server in SQLAlchemy: stream_results viene ignorato
+# e il risultato arriva tutto in memoria. Per la memoria costante su MySQL
+# serve mysql+pymysql o mysql+mysqldb (vedi streaming_reale()).
+# -----------------------------------------------------------------------
+#
+
+import csv
+import json
+import os
+import sys
+import warnings
+from datetime import date, datetime
+from decimal import Decimal
+
+# Numero di righe lette dal cursore (e scritte) per ogni blocco.
+BLOCCO_RIGHE = int(os.getenv("BLOCCO_RIGHE", "500"))
+
+# Righe per pagina nella consultazione paginata (menu 2).
+PAGINA_RIGHE = int(os.getenv("PAGINA_RIGHE", "50"))
+
+# Larghezza massima di una colonna nella tabella stampata.
+LARGHEZZA_MAX = 40
+
+# Vero se il driver legge davvero le righe a blocchi: cursori lato server
+# (pymysql, mysqldb, psycopg2) oppure SQLite, il cui cursore avanza solo a
+# ogni fetch. Con mysql-connector il risultato viene caricato tutto.
+
+def streaming_reale(conn) -> bool:
+    return bool(conn.dialect.supports_server_side_cursors) or conn.dialect.name == "sqlite"
+
+# Esegue lo statement con un cursore lato server (stream_results)
+# e ritorna il Result, da consumare a blocchi con .partitions().
+# Se il driver non lo permette lo segnala (una volta): le righe arrivano
+# comunque a blocchi, ma sono già tutte in memoria.
+
+def risultato_in_streaming(conn, stmt, params: dict | None = None, blocco: int = BLOCCO_RIGHE):
+    if not streaming_reale(conn):
+        warnings.warn(
+            f"il driver {conn.dialect.driver} non ha cursori lato server: "
+            "il risultato viene caricato tutto in memoria (usare mysql+pymysql per lo streaming)",
+            RuntimeWarning, stacklevel=2,
+        )
+    return conn.execution_options(stream_results=True, yield_per=blocco).execute(stmt, params or {})
+
+# Converte un valore in testo per la tabella.
+
+def formatta_valore(v) -> str:
+    if v is None:
+        return "NULL"
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.isoformat()
+    return str(v)
+
+# Scrive una tabella di testo a partire da blocchi di righe.
+# Le larghezze delle colonne sono calcolate sul primo blocco, così la stampa
+# può iniziare subito. Ritorna il numero di righe scritte.
+
+def scrivi_tabella(colonne, blocchi, out=None) -> int:
+    out = out or sys.stdout
+    larghezze = None
+    n = 0
+
+    for blocco in blocchi:
+        testi = [[formatta_valore(v)[:LARGHEZZA_MAX] for v in r] for r in blocco]
+        if not testi:
+            continue
+        if larghezze is None:
+            larghezze = [
+                max([len(c)] + [len(r[i]) for r in testi])
+                for i, c in enumerate(colonne)
+            ]
+            intestazione = " | ".join(c.ljust(w) for c, w in zip(colonne, larghezze))
+            out.write(intestazione + "\n" + "-+-".join("-" * w for w in larghezze) + "\n")
+        out.write("\n".join(
+            " | ".join(t.ljust(w) for t, w in zip(r, larghezze)) for r in testi
+        ) + "\n")
+        n += len(testi)
+
+    out.flush()
+    return n
+
+# Converte un valore per JSON (date in formato ISO, decimali come numeri).
+def valore_json(v):
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    if isinstance(v, date):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, bytes):
+        return v.hex()
+    return str(v)
+
+# Scrive i blocchi di righe come NDJSON (un oggetto JSON per riga).
+# Ritorna il numero di righe scritte.
+def scrivi_ndjson(colonne, blocchi, out=None) -> int:
+    out = out or sys.stdout
+    n = 0
+    for blocco in blocchi:
+        if not blocco:
+            continue
+        out.write("\n".join(
+            json.dumps(dict(zip(colonne, r)), default=valore_json, ensure_ascii=False) for r in blocco
+        ) + "\n")
+        n += len(blocco)
+    out.flush()
+    return n
+
+# Scrive i blocchi di righe come CSV con intestazione. Ritorna il numero di righe scritte.
+def scrivi_csv(colonne, blocchi, out=None) -> int:
+    out = out or sys.stdout
+    w = csv.writer(out)
+    w.writerow(colonne)
+    n = 0
+    for blocco in blocchi:
+        w.writerows([["" if v is None else formatta_valore(v) for v in r] for r in blocco])
+        n += len(blocco)
+    out.flush()
+    return n
+
+# Scrittori disponibili per formato.
+SCRITTORI = {"tabella": scrivi_tabella, "ndjson": scrivi_ndjson, "csv": scrivi_csv}
+
+# Esegue uno statement in streaming e lo stampa come tabella a blocchi.
+# Ritorna il numero di righe stampate.
+
+def stampa_streaming(conn, stmt, params: dict | None = None, blocco: int = BLOCCO_RIGHE, out=None) -> int:
+    res = risultato_in_streaming(conn, stmt, params, blocco)
+    n = scrivi_tabella(list(res.keys()), res.partitions(), out)
+    if n == 0:
+        print("(nessun risultato)")
+    return n
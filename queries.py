@@ -3,12 +3,39 @@
 # IN QUESTO FILE DEFINIAMO LE QUERIES
 # -----------------------------------------------
 #
-from sqlalchemy import select, and_, exists, delete
+import os
+import time
+import weakref
+from collections import Counter
+from sqlalchemy import (
+    select, and_, or_, exists, delete, bindparam, event, tuple_, case, func, literal_column, String,
+    LABEL_STYLE_TABLENAME_PLUS_COL,
+)
+from sqlalchemy.engine.default import CacheStats
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+import metriche
 
-# Restituisce i dispositivi (id, marca, modello) associati a un cliente business,
-# filtrando per ragione sociale.
+# Se attivo (DB_PREPARED=1) e il driver è mysql-connector, gli statement del
+# catalogo vengono eseguiti come prepared statement lato server.
+DB_PREPARED = os.getenv("DB_PREPARED", "0") == "1"
 
-def q_dispositivi_cliente_business(meta, ragione_sociale):
+# Numero massimo di clienti per ogni query multipla (IN ...): resta ben sotto
+# il limite di parametri del driver.
+BLOCCO_IN = int(os.getenv("BLOCCO_IN", "500"))
+
+# -----------------------------------------------
+# COSTRUZIONE DEGLI STATEMENT (con segnaposto bindparam)
+# Ogni statement viene costruito una sola volta per MetaData (vedi catalogo()):
+# i valori dell'utente arrivano come parametri al momento dell'esecuzione.
+# -----------------------------------------------
+
+# Dispositivi (id, marca, modello) associati a un cliente business,
+# filtrando per ragione sociale. Parametri: ragione_sociale.
+
+def _s_dispositivi_cliente_business(meta):
     ClienteBusiness = meta.tables["ClienteBusiness"]
     Cliente = meta.tables["Cliente"]
     Dispositivo = meta.tables["Dispositivo"]
@@ -24,14 +51,14 @@ def q_dispositivi_cliente_business(meta, ragione_sociale):
             .join(Cliente, ClienteBusiness.c.idCliente == Cliente.c.idCliente)
             .join(Dispositivo, Cliente.c.idCliente == Dispositivo.c.idCliente)
         )
-        .where(ClienteBusiness.c.ragioneSociale == ragione_sociale)
+        .where(ClienteBusiness.c.ragioneSociale == bindparam("ragione_sociale"))
     )
     return stmt
 
-# Restituisce le date degli appuntamenti associati a un cliente business,
-# ordinati per data, filtrando per ragione sociale.
+# Date degli appuntamenti associati a un cliente business,
+# ordinati per data, filtrando per ragione sociale. Parametri: ragione_sociale.
 
-def q_appuntamenti_cliente_business(meta, ragione_sociale):
+def _s_appuntamenti_cliente_business(meta):
     ClienteBusiness = meta.tables["ClienteBusiness"]
     Cliente = meta.tables["Cliente"]
     Dispositivo = meta.tables["Dispositivo"]
@@ -47,30 +74,30 @@ def q_appuntamenti_cliente_business(meta, ragione_sociale):
             .join(Riparazione, Dispositivo.c.idDispositivo == Riparazione.c.idDispositivo)
             .join(Appuntamento, Riparazione.c.idRiparazione == Appuntamento.c.idRiparazione)
         )
-        .where(ClienteBusiness.c.ragioneSociale == ragione_sociale)
+        .where(ClienteBusiness.c.ragioneSociale == bindparam("ragione_sociale"))
         .order_by(Appuntamento.c.dataOra.asc())
     )
     return stmt
 
-# Restituisce i dispositivi (id, marca, modello) di un cliente privato,
-# identificato tramite nome e cognome.
+# Dispositivi (id, marca, modello) di un cliente privato,
+# identificato tramite nome e cognome. Parametri: nome, cognome.
 
-def q_dispositivi_cliente_privato(meta, nome, cognome):
+def _s_dispositivi_cliente_privato(meta):
     Dispositivo = meta.tables["Dispositivo"]
     ClientePrivato = meta.tables["ClientePrivato"]
 
     stmt = (
         select(Dispositivo.c.idDispositivo, Dispositivo.c.marca, Dispositivo.c.modello)
         .select_from(Dispositivo.join(ClientePrivato, Dispositivo.c.idCliente == ClientePrivato.c.idCliente))
-        .where(and_(ClientePrivato.c.nome == nome, ClientePrivato.c.cognome == cognome))
+        .where(and_(ClientePrivato.c.nome == bindparam("nome"), ClientePrivato.c.cognome == bindparam("cognome")))
     )
     return stmt
 
-# Restituisce le riparazioni che hanno un appuntamento,
+# Riparazioni che hanno un appuntamento,
 # mostrando i dati del cliente privato, del dispositivo e della riparazione,
-# con ordinamento per data dell’appuntamento.
+# con ordinamento per data dell’appuntamento. Nessun parametro.
 
-def q_riparazioni_con_appuntamento(meta):
+def _s_riparazioni_con_appuntamento(meta):
     ClientePrivato = meta.tables["ClientePrivato"]
     Dispositivo = meta.tables["Dispositivo"]
     Riparazione = meta.tables["Riparazione"]
@@ -96,10 +123,40 @@ def q_riparazioni_con_appuntamento(meta):
     )
     return stmt
 
-# Restituisce le date degli appuntamenti associati a un cliente privato,
-# identificato tramite nome e cognome, ordinate per data.
+# Pagine (keyset) delle riparazioni con appuntamento, ordinate per
+# (dataOra, idRiparazione). La prima pagina non ha condizioni; le successive
+# ripartono dall'ultima chiave vista, quindi ogni pagina costa come la prima
+# anche in fondo allo storico. Parametri: limite (+ ultima_data, ultimo_id).
 
-def q_appuntamenti_cliente_privato(meta, nome, cognome):
+# (si ordina su Appuntamento.idRiparazione, uguale per join a Riparazione.idRiparazione,
+# così l'indice (dataOra, idRiparazione) di Appuntamento evita il filesort)
+
+def _s_riparazioni_con_appuntamento_prima_pagina(meta):
+    Appuntamento = meta.tables["Appuntamento"]
+    return (
+        _s_riparazioni_con_appuntamento(meta)
+        .order_by(None)
+        .order_by(Appuntamento.c.dataOra.asc(), Appuntamento.c.idRiparazione.asc())
+        .limit(bindparam("limite"))
+    )
+
+def _s_riparazioni_con_appuntamento_pagina_successiva(meta):
+    Appuntamento = meta.tables["Appuntamento"]
+    return (
+        _s_riparazioni_con_appuntamento_prima_pagina(meta)
+        .where(or_(
+            Appuntamento.c.dataOra > bindparam("ultima_data"),
+            and_(
+                Appuntamento.c.dataOra == bindparam("ultima_data"),
+                Appuntamento.c.idRiparazione > bindparam("ultimo_id"),
+            ),
+        ))
+    )
+
+# Date degli appuntamenti associati a un cliente privato,
+# identificato tramite nome e cognome, ordinate per data. Parametri: nome, cognome.
+
+def _s_appuntamenti_cliente_privato(meta):
     ClientePrivato = meta.tables["ClientePrivato"]
     Cliente = meta.tables["Cliente"]
     Dispositivo = meta.tables["Dispositivo"]
@@ -115,15 +172,15 @@ def q_appuntamenti_cliente_privato(meta, nome, cognome):
             .join(Riparazione, Dispositivo.c.idDispositivo == Riparazione.c.idDispositivo)
             .join(Appuntamento, Riparazione.c.idRiparazione == Appuntamento.c.idRiparazione)
         )
-        .where(and_(ClientePrivato.c.nome == nome, ClientePrivato.c.cognome == cognome))
+        .where(and_(ClientePrivato.c.nome == bindparam("nome"), ClientePrivato.c.cognome == bindparam("cognome")))
         .order_by(Appuntamento.c.dataOra.asc())
     )
     return stmt
 
-# Restituisce tutte le riparazioni che hanno almeno un appuntamento,
-# utilizzando una sottoquery con EXISTS.
+# Tutte le riparazioni che hanno almeno un appuntamento,
+# utilizzando una sottoquery con EXISTS. Nessun parametro.
 
-def q_riparazioni_con_appuntamento_exists(meta):
+def _s_riparazioni_con_appuntamento_exists(meta):
     Riparazione = meta.tables["Riparazione"]
     Appuntamento = meta.tables["Appuntamento"]
 
@@ -136,9 +193,680 @@ def q_riparazioni_con_appuntamento_exists(meta):
     stmt = select(Riparazione).where(exists(sub))
     return stmt
 
+# Versioni multi-cliente delle query per cliente: un'unica query con IN
+# su una lista di clienti. Oltre ai dati restituiscono le colonne di
+# identificazione del cliente, per poter raggruppare i risultati.
+# Parametri: clienti (lista di coppie (nome, cognome)) oppure ragioni_sociali.
+
+def _s_dispositivi_clienti_privati(meta):
+    Dispositivo = meta.tables["Dispositivo"]
+    ClientePrivato = meta.tables["ClientePrivato"]
+    return (
+        select(ClientePrivato.c.nome, ClientePrivato.c.cognome,
+               Dispositivo.c.idDispositivo, Dispositivo.c.marca, Dispositivo.c.modello)
+        .select_from(Dispositivo.join(ClientePrivato, Dispositivo.c.idCliente == ClientePrivato.c.idCliente))
+        .where(tuple_(ClientePrivato.c.nome, ClientePrivato.c.cognome).in_(bindparam("clienti", expanding=True)))
+    )
+
+def _s_dispositivi_clienti_business(meta):
+    ClienteBusiness = meta.tables["ClienteBusiness"]
+    Dispositivo = meta.tables["Dispositivo"]
+    return (
+        select(ClienteBusiness.c.ragioneSociale,
+               Dispositivo.c.idDispositivo, Dispositivo.c.marca, Dispositivo.c.modello)
+        .select_from(ClienteBusiness.join(Dispositivo, ClienteBusiness.c.idCliente == Dispositivo.c.idCliente))
+        .where(ClienteBusiness.c.ragioneSociale.in_(bindparam("ragioni_sociali", expanding=True)))
+    )
+
+def _s_appuntamenti_clienti_privati(meta):
+    ClientePrivato = meta.tables["ClientePrivato"]
+    Dispositivo = meta.tables["Dispositivo"]
+    Riparazione = meta.tables["Riparazione"]
+    Appuntamento = meta.tables["Appuntamento"]
+    return (
+        select(ClientePrivato.c.nome, ClientePrivato.c.cognome, Appuntamento.c.dataOra)
+        .select_from(
+            ClientePrivato
+            .join(Dispositivo, ClientePrivato.c.idCliente == Dispositivo.c.idCliente)
+            .join(Riparazione, Dispositivo.c.idDispositivo == Riparazione.c.idDispositivo)
+            .join(Appuntamento, Riparazione.c.idRiparazione == Appuntamento.c.idRiparazione)
+        )
+        .where(tuple_(ClientePrivato.c.nome, ClientePrivato.c.cognome).in_(bindparam("clienti", expanding=True)))
+        .order_by(Appuntamento.c.dataOra.asc())
+    )
+
+def _s_appuntamenti_clienti_business(meta):
+    ClienteBusiness = meta.tables["ClienteBusiness"]
+    Dispositivo = meta.tables["Dispositivo"]
+    Riparazione = meta.tables["Riparazione"]
+    Appuntamento = meta.tables["Appuntamento"]
+    return (
+        select(ClienteBusiness.c.ragioneSociale, Appuntamento.c.dataOra)
+        .select_from(
+            ClienteBusiness
+            .join(Dispositivo, ClienteBusiness.c.idCliente == Dispositivo.c.idCliente)
+            .join(Riparazione, Dispositivo.c.idDispositivo == Riparazione.c.idDispositivo)
+            .join(Appuntamento, Riparazione.c.idRiparazione == Appuntamento.c.idRiparazione)
+        )
+        .where(ClienteBusiness.c.ragioneSociale.in_(bindparam("ragioni_sociali", expanding=True)))
+        .order_by(Appuntamento.c.dataOra.asc())
+    )
+
+# Aggiornamento dello stato di una riparazione specifica.
+# Parametri: id_riparazione, nuovo_stato.
+
+def _s_update_stato_riparazione(meta):
+    Riparazione = meta.tables["Riparazione"]
+    return (
+        Riparazione.update()
+        .where(Riparazione.c.idRiparazione == bindparam("id_riparazione"))
+        .values(stato=bindparam("nuovo_stato"))
+    )
+
+# Eliminazione degli appuntamenti di una riparazione. Parametri: id_riparazione.
+
+def _s_delete_appuntamenti_riparazione(meta):
+    Appuntamento = meta.tables["Appuntamento"]
+    return delete(Appuntamento).where(
+        Appuntamento.c.idRiparazione == bindparam("id_riparazione")
+    )
+
+# Eliminazione di una riparazione. Parametri: id_riparazione.
+
+def _s_delete_riparazione(meta):
+    Riparazione = meta.tables["Riparazione"]
+    return delete(Riparazione).where(
+        Riparazione.c.idRiparazione == bindparam("id_riparazione")
+    )
+
+# Versioni multi-riparazione di update e delete: IN su una lista di id.
+# Parametri: id_riparazioni (+ nuovo_stato per l'update).
+
+def _s_update_stato_riparazioni(meta):
+    Riparazione = meta.tables["Riparazione"]
+    return (
+        Riparazione.update()
+        .where(Riparazione.c.idRiparazione.in_(bindparam("id_riparazioni", expanding=True)))
+        .values(stato=bindparam("nuovo_stato"))
+    )
+
+
+# -----------------------------------------------
+# PROFILO CLIENTE (vista completa di uno o più clienti)
+# Una query per livello (cliente, dispositivi, riparazioni e ciascuna tabella
+# figlia di Riparazione), tutte filtrate sugli stessi id cliente: il numero di
+# query non dipende da quanti dispositivi o riparazioni ha il cliente.
+# Parametri: id_clienti.
+# -----------------------------------------------
+
+# Cliente con i dati di ClientePrivato o ClienteBusiness; le colonne hanno
+# il nome della tabella come prefisso (Cliente_idCliente, ClientePrivato_nome, ...).
+
+def _s_profilo_clienti(meta):
+    Cliente = meta.tables["Cliente"]
+    ClientePrivato = meta.tables["ClientePrivato"]
+    ClienteBusiness = meta.tables["ClienteBusiness"]
+    return (
+        select(Cliente, ClientePrivato, ClienteBusiness)
+        .select_from(
+            Cliente
+            .outerjoin(ClientePrivato, Cliente.c.idCliente == ClientePrivato.c.idCliente)
+            .outerjoin(ClienteBusiness, Cliente.c.idCliente == ClienteBusiness.c.idCliente)
+        )
+        .where(Cliente.c.idCliente.in_(bindparam("id_clienti", expanding=True)))
+        .set_label_style(LABEL_STYLE_TABLENAME_PLUS_COL)
+    )
+
+def _s_profilo_dispositivi(meta):
+    Dispositivo = meta.tables["Dispositivo"]
+    return (
+        select(Dispositivo)
+        .where(Dispositivo.c.idCliente.in_(bindparam("id_clienti", expanding=True)))
+        .order_by(Dispositivo.c.idDispositivo)
+    )
+
+def _s_profilo_riparazioni(meta):
+    Dispositivo = meta.tables["Dispositivo"]
+    Riparazione = meta.tables["Riparazione"]
+    return (
+        select(Riparazione)
+        .select_from(Riparazione.join(Dispositivo, Riparazione.c.idDispositivo == Dispositivo.c.idDispositivo))
+        .where(Dispositivo.c.idCliente.in_(bindparam("id_clienti", expanding=True)))
+        .order_by(Riparazione.c.idRiparazione)
+    )
+
+# Righe di una tabella figlia di Riparazione (Appuntamento, Preventivo, ...)
+# per le riparazioni dei clienti, ordinate per la colonna indicata.
+
+def _s_profilo_figli(nome_tabella: str, ordine: str):
+    def costruttore(meta):
+        Dispositivo = meta.tables["Dispositivo"]
+        Riparazione = meta.tables["Riparazione"]
+        Figlia = meta.tables[nome_tabella]
+        return (
+            select(Figlia)
+            .select_from(
+                Figlia
+                .join(Riparazione, Figlia.c.idRiparazione == Riparazione.c.idRiparazione)
+                .join(Dispositivo, Riparazione.c.idDispositivo == Dispositivo.c.idDispositivo)
+            )
+            .where(Dispositivo.c.idCliente.in_(bindparam("id_clienti", expanding=True)))
+            .order_by(Figlia.c[ordine], *Figlia.primary_key.columns)
+        )
+    return costruttore
+
+
+# -----------------------------------------------
+# AGENDA DEGLI APPUNTAMENTI (intervalli di date)
+# -----------------------------------------------
+
+# Granularità dei conteggi dell'agenda (i report usano anche "mese").
+GRANULARITA = ("ora", "giorno", "settimana")
+
+# Inizio dell'intervallo (ora, giorno, settimana da lunedì o mese) che contiene una data,
+# come testo: "YYYY-MM-DD HH:00" per l'ora, "YYYY-MM-DD" per giorno e settimana, "YYYY-MM" per il mese.
+# Viene tradotto nelle funzioni di data del dialetto (vedi sotto).
+class inizio_intervallo(FunctionElement):
+    type = String()
+    inherit_cache = True
+    # la granularità fa parte della chiave della cache di compilazione
+    _traverse_internals = FunctionElement._traverse_internals + [
+        ("granularita", InternalTraversal.dp_string),
+    ]
+
+    def __init__(self, colonna, granularita: str):
+        if granularita not in GRANULARITA + ("mese",):
+            raise ValueError(f"Granularità non valida: {granularita}")
+        self.granularita = granularita
+        super().__init__(colonna)
+
+@compiles(inizio_intervallo, "mysql")
+def _inizio_intervallo_mysql(element, compiler, **kw):
+    col = list(element.clauses)[0]
+    if element.granularita == "ora":
+        espr = func.date_format(col, "%Y-%m-%d %H:00")
+    elif element.granularita == "giorno":
+        espr = func.date_format(col, "%Y-%m-%d")
+    elif element.granularita == "mese":
+        espr = func.date_format(col, "%Y-%m")
+    else:
+        espr = func.date_format(func.subdate(col, func.weekday(col)), "%Y-%m-%d")
+    return compiler.process(espr, **kw)
+
+@compiles(inizio_intervallo, "sqlite")
+def _inizio_intervallo_sqlite(element, compiler, **kw):
+    col = list(element.clauses)[0]
+    if element.granularita == "ora":
+        espr = func.strftime("%Y-%m-%d %H:00", col)
+    elif element.granularita == "giorno":
+        espr = func.strftime("%Y-%m-%d", col)
+    elif element.granularita == "mese":
+        espr = func.strftime("%Y-%m", col)
+    else:
+        espr = func.strftime("%Y-%m-%d", col, "weekday 0", "-6 days")
+    return compiler.process(espr, **kw)
+
+@compiles(inizio_intervallo)
+def _inizio_intervallo_default(element, compiler, **kw):
+    col = list(element.clauses)[0]
+    if element.granularita == "ora":
+        espr = func.to_char(col, "YYYY-MM-DD HH24:00")
+    elif element.granularita == "mese":
+        espr = func.to_char(col, "YYYY-MM")
+    else:
+        unita = "day" if element.granularita == "giorno" else "week"
+        espr = func.to_char(func.date_trunc(unita, col), "YYYY-MM-DD")
+    return compiler.process(espr, **kw)
+
+# Appuntamenti con dataOra nell'intervallo [da, a), ordinati per data.
+# Lettura a intervallo sull'indice (dataOra, idRiparazione). Parametri: da, a.
+
+def _s_agenda_appuntamenti(meta):
+    Appuntamento = meta.tables["Appuntamento"]
+    return (
+        select(Appuntamento.c.idAppuntamento, Appuntamento.c.dataOra, Appuntamento.c.idRiparazione)
+        .where(Appuntamento.c.dataOra >= bindparam("da"), Appuntamento.c.dataOra < bindparam("a"))
+        .order_by(Appuntamento.c.dataOra.asc(), Appuntamento.c.idRiparazione.asc())
+    )
+
+# Numero di appuntamenti per ora/giorno/settimana nell'intervallo [da, a),
+# calcolato con GROUP BY nel database. Parametri: da, a.
+
+def _s_agenda_carico(granularita: str):
+    def costruttore(meta):
+        Appuntamento = meta.tables["Appuntamento"]
+        return (
+            select(
+                inizio_intervallo(Appuntamento.c.dataOra, granularita).label("intervallo"),
+                func.count().label("appuntamenti"),
+            )
+            .where(Appuntamento.c.dataOra >= bindparam("da"), Appuntamento.c.dataOra < bindparam("a"))
+            .group_by(literal_column("intervallo"))
+            .order_by(literal_column("intervallo"))
+        )
+    return costruttore
+
+
+# -----------------------------------------------
+# CATALOGO DEGLI STATEMENT
+# -----------------------------------------------
+
+_COSTRUTTORI = {
+    "q_dispositivi_cliente_business": _s_dispositivi_cliente_business,
+    "q_appuntamenti_cliente_business": _s_appuntamenti_cliente_business,
+    "q_dispositivi_cliente_privato": _s_dispositivi_cliente_privato,
+    "q_riparazioni_con_appuntamento": _s_riparazioni_con_appuntamento,
+    "q_appuntamenti_cliente_privato": _s_appuntamenti_cliente_privato,
+    "q_riparazioni_con_appuntamento_prima_pagina": _s_riparazioni_con_appuntamento_prima_pagina,
+    "q_riparazioni_con_appuntamento_pagina_successiva": _s_riparazioni_con_appuntamento_pagina_successiva,
+    "q_riparazioni_con_appuntamento_exists": _s_riparazioni_con_appuntamento_exists,
+    "q_dispositivi_clienti_privati": _s_dispositivi_clienti_privati,
+    "q_dispositivi_clienti_business": _s_dispositivi_clienti_business,
+    "q_appuntamenti_clienti_privati": _s_appuntamenti_clienti_privati,
+    "q_appuntamenti_clienti_business": _s_appuntamenti_clienti_business,
+    "update_stato_riparazione": _s_update_stato_riparazione,
+    "delete_appuntamenti_riparazione": _s_delete_appuntamenti_riparazione,
+    "delete_riparazione": _s_delete_riparazione,
+    "update_stato_riparazioni": _s_update_stato_riparazioni,
+    "q_agenda_appuntamenti": _s_agenda_appuntamenti,
+    "q_agenda_carico_ora": _s_agenda_carico("ora"),
+    "q_agenda_carico_giorno": _s_agenda_carico("giorno"),
+    "q_agenda_carico_settimana": _s_agenda_carico("settimana"),
+    "q_profilo_clienti": _s_profilo_clienti,
+    "q_profilo_dispositivi": _s_profilo_dispositivi,
+    "q_profilo_riparazioni": _s_profilo_riparazioni,
+    "q_profilo_appuntamenti": _s_profilo_figli("Appuntamento", "dataOra"),
+    "q_profilo_preventivi": _s_profilo_figli("Preventivo", "data"),
+    "q_profilo_pagamenti": _s_profilo_figli("Pagamento", "dataPagamento"),
+    "q_profilo_garanzie": _s_profilo_figli("Garanzia", "dataInizio"),
+}
+
+# un catalogo per ogni MetaData riflesso (si libera insieme al MetaData)
+_cataloghi = weakref.WeakKeyDictionary()
+
+# Catalogo {nome: statement}: ogni statement viene costruito al primo accesso
+# e poi riusato. completo() li costruisce tutti subito (es. all'avvio del menu);
+# con un MetaData parziale si possono usare solo gli statement delle tabelle riflesse.
+class _Catalogo(dict):
+    def __init__(self, meta):
+        super().__init__()
+        self._meta = weakref.ref(meta)
+
+    def __missing__(self, nome):
+        # il nome viene portato nelle opzioni di esecuzione (usato da metriche.py)
+        stmt = _COSTRUTTORI[nome](self._meta()).execution_options(nome_query=nome)
+        self[nome] = stmt
+        return stmt
+
+    def completo(self):
+        for nome in _COSTRUTTORI:
+            self[nome]
+        return self
+
+# Ritorna il catalogo degli statement del MetaData (creato una sola volta).
+# Gli statement contengono solo segnaposto: si eseguono con
+# conn.execute(catalogo(meta)[nome], parametri).
+
+def catalogo(meta) -> dict:
+    cat = _cataloghi.get(meta)
+    if cat is None:
+        cat = _Catalogo(meta)
+        _cataloghi[meta] = cat
+    return cat
+
+# Esegue uno statement del catalogo passando solo i parametri. Ritorna sempre un
+# Result (righe, .keys(), .mappings()): con DB_PREPARED=1 su mysql-connector le
+# SELECT usano un prepared statement lato server, con lo stesso tipo di risultato.
+
+def esegui(conn, meta, chiave: str, **params):
+    stmt = catalogo(meta)[chiave]
+    if usa_preparato(conn, chiave):
+        return esegui_preparato(conn, stmt, params)
+    return conn.execute(stmt, params)
+
+# Indica se lo statement del catalogo va eseguito come prepared statement
+# (non le query multi-cliente: il numero di parametri cambia a ogni chiamata).
+
+def usa_preparato(conn, chiave: str) -> bool:
+    return (
+        DB_PREPARED
+        and chiave.startswith("q_")
+        and not chiave.startswith(("q_dispositivi_clienti_", "q_appuntamenti_clienti_", "q_profilo_"))
+        and conn.dialect.driver == "mysqlconnector"
+    )
+
+
+# -----------------------------------------------
+# QUERY MULTI-CLIENTE
+# -----------------------------------------------
+
+# Esegue una query multi-cliente a blocchi di `blocco` clienti e raggruppa le righe
+# per cliente. chiavi: lista di clienti richiesti; colonne_chiave: colonne del
+# risultato che identificano il cliente. Ritorna {cliente: [righe]} con una voce
+# (eventualmente vuota) per ogni cliente richiesto.
+
+def _per_cliente(conn, meta, chiave_stmt: str, nome_param: str, chiavi, colonne_chiave, blocco: int):
+    stmt = catalogo(meta)[chiave_stmt]
+    chiavi = list(dict.fromkeys(chiavi))
+    gruppi = {k: [] for k in chiavi}
+    for i in range(0, len(chiavi), blocco):
+        for r in conn.execute(stmt, {nome_param: chiavi[i:i + blocco]}):
+            m = dict(r._mapping)
+            k = tuple(m.pop(c) for c in colonne_chiave)
+            gruppi.setdefault(k if len(k) > 1 else k[0], []).append(m)
+    return gruppi
+
+# Dispositivi di più clienti privati: clienti è una lista di (nome, cognome).
+
+def dispositivi_clienti_privati(conn, meta, clienti, blocco: int = BLOCCO_IN) -> dict:
+    clienti = [tuple(c) for c in clienti]
+    return _per_cliente(conn, meta, "q_dispositivi_clienti_privati", "clienti", clienti, ("nome", "cognome"), blocco)
+
+# Dispositivi di più clienti business, per ragione sociale.
+
+def dispositivi_clienti_business(conn, meta, ragioni_sociali, blocco: int = BLOCCO_IN) -> dict:
+    return _per_cliente(conn, meta, "q_dispositivi_clienti_business", "ragioni_sociali", ragioni_sociali, ("ragioneSociale",), blocco)
+
+# Appuntamenti (ordinati per data) di più clienti privati: clienti è una lista di (nome, cognome).
+
+def appuntamenti_clienti_privati(conn, meta, clienti, blocco: int = BLOCCO_IN) -> dict:
+    clienti = [tuple(c) for c in clienti]
+    return _per_cliente(conn, meta, "q_appuntamenti_clienti_privati", "clienti", clienti, ("nome", "cognome"), blocco)
+
+# Appuntamenti (ordinati per data) di più clienti business, per ragione sociale.
+
+def appuntamenti_clienti_business(conn, meta, ragioni_sociali, blocco: int = BLOCCO_IN) -> dict:
+    return _per_cliente(conn, meta, "q_appuntamenti_clienti_business", "ragioni_sociali", ragioni_sociali, ("ragioneSociale",), blocco)
+
+# -----------------------------------------------
+# PROFILO CLIENTE
+# -----------------------------------------------
+
+# Tabelle figlie di Riparazione nel profilo: (chiave nel profilo, statement).
+PROFILO_FIGLI = (
+    ("appuntamenti", "q_profilo_appuntamenti"),
+    ("preventivi", "q_profilo_preventivi"),
+    ("pagamenti", "q_profilo_pagamenti"),
+    ("garanzie", "q_profilo_garanzie"),
+)
+
+# Profili completi di più clienti: 7 query per blocco di `blocco` clienti,
+# qualunque sia il numero di dispositivi e riparazioni. Ritorna {idCliente: profilo}
+# (solo i clienti esistenti); ogni profilo è un dizionario annidato:
+#   {"idCliente", "tipoCliente", ..., "anagrafica": {...},
+#    "dispositivi": [{..., "riparazioni": [{..., "appuntamenti": [...],
+#                                           "preventivi": [...], "pagamenti": [...],
+#                                           "garanzie": [...]}]}]}
+
+def profili_clienti(conn, meta, id_clienti, blocco: int = BLOCCO_IN) -> dict:
+    cat = catalogo(meta)
+    ids = list(dict.fromkeys(id_clienti))
+    profili = {}
+    for i in range(0, len(ids), blocco):
+        parte = {"id_clienti": ids[i:i + blocco]}
+
+        for r in conn.execute(cat["q_profilo_clienti"], parte).mappings():
+            campi = {"Cliente": {}, "ClientePrivato": {}, "ClienteBusiness": {}}
+            for chiave, valore in r.items():
+                tabella, colonna = chiave.split("_", 1)
+                campi[tabella][colonna] = valore
+            profilo = campi["Cliente"]
+            if campi["ClientePrivato"].get("idCliente") is not None:
+                anagrafica = campi["ClientePrivato"]
+            elif campi["ClienteBusiness"].get("idCliente") is not None:
+                anagrafica = campi["ClienteBusiness"]
+            else:
+                anagrafica = {}
+            anagrafica.pop("idCliente", None)
+            profilo["anagrafica"] = anagrafica
+            profilo["dispositivi"] = []
+            profili[profilo["idCliente"]] = profilo
+
+        # le righe orfane (es. un dispositivo il cui cliente non esiste più) si
+        # saltano, e con loro le righe che ne dipendono
+        dispositivi = {}
+        for r in conn.execute(cat["q_profilo_dispositivi"], parte).mappings():
+            profilo = profili.get(r["idCliente"])
+            if profilo is None:
+                continue
+            d = dict(r, riparazioni=[])
+            dispositivi[d["idDispositivo"]] = d
+            profilo["dispositivi"].append(d)
+
+        riparazioni = {}
+        for r in conn.execute(cat["q_profilo_riparazioni"], parte).mappings():
+            dispositivo = dispositivi.get(r["idDispositivo"])
+            if dispositivo is None:
+                continue
+            rip = dict(r, **{chiave: [] for chiave, _ in PROFILO_FIGLI})
+            riparazioni[rip["idRiparazione"]] = rip
+            dispositivo["riparazioni"].append(rip)
+
+        for chiave, nome_stmt in PROFILO_FIGLI:
+            for r in conn.execute(cat[nome_stmt], parte).mappings():
+                rip = riparazioni.get(r["idRiparazione"])
+                if rip is not None:
+                    rip[chiave].append(dict(r))
+    return profili
+
+# Profilo completo di un cliente (None se non esiste).
+
+def profilo_cliente(conn, meta, id_cliente):
+    return profili_clienti(conn, meta, [id_cliente]).get(id_cliente)
+
+# Scorre le riparazioni con appuntamento a pagine di `dimensione` righe
+# (paginazione keyset su dataOra, idRiparazione): memoria e latenza costanti
+# per pagina, qualunque sia la posizione nello storico.
+
+def pagine_riparazioni_con_appuntamento(conn, meta, dimensione: int = 50):
+    cat = catalogo(meta)
+    righe = conn.execute(
+        cat["q_riparazioni_con_appuntamento_prima_pagina"], {"limite": dimensione}
+    ).fetchall()
+    while righe:
+        yield righe
+        if len(righe) < dimensione:
+            return
+        ultima = righe[-1]
+        righe = conn.execute(
+            cat["q_riparazioni_con_appuntamento_pagina_successiva"],
+            {
+                "limite": dimensione,
+                "ultima_data": ultima.dataOra,
+                "ultimo_id": ultima.idRiparazione,
+            },
+        ).fetchall()
+
+
+# -----------------------------------------------
+# UPDATE E DELETE MULTI-RIPARAZIONE
+# -----------------------------------------------
+
+# Aggiorna lo stato di più riparazioni: stati è un dizionario {idRiparazione: nuovo_stato}.
+# Un solo statement per blocco di `blocco` id: IN semplice se lo stato di destinazione
+# è unico, altrimenti CASE sull'id. Ritorna il numero di righe aggiornate.
+
+def aggiorna_stato_riparazioni(conn, meta, stati: dict, blocco: int = BLOCCO_IN) -> int:
+    Riparazione = meta.tables["Riparazione"]
+    voci = list(stati.items())
+    aggiornate = 0
+    for i in range(0, len(voci), blocco):
+        parte = dict(voci[i:i + blocco])
+        destinazioni = set(parte.values())
+        if len(destinazioni) == 1:
+            res = conn.execute(
+                catalogo(meta)["update_stato_riparazioni"],
+                {"id_riparazioni": list(parte), "nuovo_stato": destinazioni.pop()},
+            )
+        else:
+            res = conn.execute(
+                Riparazione.update()
+                .where(Riparazione.c.idRiparazione.in_(list(parte)))
+                .values(stato=case(parte, value=Riparazione.c.idRiparazione, else_=Riparazione.c.stato))
+            )
+        aggiornate += res.rowcount
+    return aggiornate
+
+# DELETE delle riparazioni e di tutte le righe che ne dipendono lungo le FK
+# (Appuntamento, Intervento, Preventivo -> DettaglioPreventivo, Pagamento ->
+# DocumentoFiscale, Garanzia, ...), ricavate come per l'archiviazione e in
+# ordine figli -> padri. Costruiti una volta per MetaData. Parametri: id_riparazioni.
+# Ritorna [(tabella, statement)].
+
+_eliminazioni = weakref.WeakKeyDictionary()
+
+def statement_eliminazione(meta) -> list[tuple[str, object]]:
+    stmts = _eliminazioni.get(meta)
+    if stmts is None:
+        import archivio
+
+        cond = archivio.condizioni(meta)
+        stmts = [
+            (t.name, delete(t).where(cond[t.name]).execution_options(nome_query=f"delete_riparazioni_{t.name}"))
+            for t, _ in reversed(archivio.dipendenze(meta))
+        ]
+        _eliminazioni[meta] = stmts
+    return stmts
+
+# Elimina più riparazioni con tutte le righe che ne dipendono, a blocchi di
+# `blocco` id (per ogni blocco prima i figli, poi le riparazioni).
+# Ritorna {tabella: righe eliminate}.
+
+def elimina_riparazioni(conn, meta, id_riparazioni, blocco: int = BLOCCO_IN) -> dict[str, int]:
+    ids = list(dict.fromkeys(id_riparazioni))
+    eliminate = {nome: 0 for nome, _ in statement_eliminazione(meta)}
+    for i in range(0, len(ids), blocco):
+        parte = {"id_riparazioni": ids[i:i + blocco]}
+        for nome, stmt in statement_eliminazione(meta):
+            eliminate[nome] += conn.execute(stmt, parte).rowcount
+    return eliminate
+
+# Riepilogo di elimina_riparazioni: riparazioni eliminate su quelle richieste
+# e righe collegate per tabella.
+
+def riepilogo_eliminazione(eliminate: dict[str, int], richieste: int) -> str:
+    collegate = ", ".join(f"{nome}: {n}" for nome, n in eliminate.items() if nome != "Riparazione" and n)
+    return f"Eliminate {eliminate['Riparazione']} riparazioni su {richieste}" + (f" ({collegate})" if collegate else "")
+
+# -----------------------------------------------
+# PREPARED STATEMENT LATO SERVER (mysql-connector)
+# -----------------------------------------------
+
+# Esegue una SELECT come prepared statement lato server.
+# Il cursore "prepared" viene tenuto nelle info della connessione del pool,
+# quindi lo stesso statement viene preparato una sola volta per connessione.
+# Il cursore non passa dagli eventi di SQLAlchemy: la misura per metriche.py
+# viene registrata qui. Ritorna un Result con le righe già lette.
+
+def esegui_preparato(conn, stmt, params: dict) -> IteratorResult:
+    compilato = stmt.compile(dialect=conn.dialect)
+    sql = compilato.string
+    valori = compilato.construct_params(params)
+    posizionali = [valori[k] for k in compilato.positiontup]
+
+    cursori = conn.connection.info.setdefault("prepared_cursors", {})
+    cur = cursori.get(sql)
+    if cur is None:
+        cur = conn.connection.driver_connection.cursor(prepared=True)
+        cursori[sql] = cur
+        STATISTICHE_COMPILAZIONE["prepared_miss"] += 1
+    else:
+        STATISTICHE_COMPILAZIONE["prepared_hit"] += 1
+
+    t0 = time.perf_counter()
+    cur.execute(sql, posizionali)
+    righe = cur.fetchall()
+    ms = (time.perf_counter() - t0) * 1000
+    metriche.misura(conn.engine, stmt.get_execution_options().get("nome_query", metriche.ALTRE_QUERY),
+                    ms, len(righe), sql, posizionali)
+    colonne = [d[0] for d in cur.description]
+    return IteratorResult(SimpleResultMetaData(colonne), iter(righe))
+
+
+# -----------------------------------------------
+# CONTATORI DELLA CACHE DI COMPILAZIONE
+# -----------------------------------------------
+
+STATISTICHE_COMPILAZIONE: Counter = Counter()
+
+# Registra sull'engine un listener che conta, per ogni esecuzione,
+# se SQLAlchemy ha riusato lo statement compilato (cache hit) o meno.
+
+def attiva_contatori(engine):
+    if event.contains(engine, "after_cursor_execute", _conta_compilazione):
+        return
+    event.listen(engine, "after_cursor_execute", _conta_compilazione)
+
+def _conta_compilazione(conn, cursor, statement, parameters, context, executemany):
+    esito = getattr(context, "cache_hit", None)
+    if esito is CacheStats.CACHE_HIT:
+        STATISTICHE_COMPILAZIONE["hit"] += 1
+    elif esito is CacheStats.CACHE_MISS:
+        STATISTICHE_COMPILAZIONE["miss"] += 1
+    elif esito is not None:
+        STATISTICHE_COMPILAZIONE["non_cacheabile"] += 1
+
+# Ritorna una riga di riepilogo con hit rate della cache di compilazione
+# e dei prepared statement.
+
+def riepilogo_contatori() -> str:
+    s = STATISTICHE_COMPILAZIONE
+    totale = s["hit"] + s["miss"]
+    rate = (s["hit"] / totale * 100) if totale else 0.0
+    riga = f"compile cache: hit={s['hit']} miss={s['miss']} non_cacheabili={s['non_cacheabile']} hit_rate={rate:.1f}%"
+    if s["prepared_hit"] or s["prepared_miss"]:
+        riga += f" | prepared: riusati={s['prepared_hit']} preparati={s['prepared_miss']}"
+    return riga
+
+
+# -----------------------------------------------
+# FUNZIONI DI COMPATIBILITÀ
+# Restituiscono lo statement del catalogo con i valori già legati.
+# -----------------------------------------------
+
+# Restituisce i dispositivi (id, marca, modello) associati a un cliente business,
+# filtrando per ragione sociale.
+
+def q_dispositivi_cliente_business(meta, ragione_sociale):
+    return catalogo(meta)["q_dispositivi_cliente_business"].params(ragione_sociale=ragione_sociale)
+
+# Restituisce le date degli appuntamenti associati a un cliente business,
+# ordinati per data, filtrando per ragione sociale.
+
+def q_appuntamenti_cliente_business(meta, ragione_sociale):
+    return catalogo(meta)["q_appuntamenti_cliente_business"].params(ragione_sociale=ragione_sociale)
+
+# Restituisce i dispositivi (id, marca, modello) di un cliente privato,
+# identificato tramite nome e cognome.
+
+def q_dispositivi_cliente_privato(meta, nome, cognome):
+    return catalogo(meta)["q_dispositivi_cliente_privato"].params(nome=nome, cognome=cognome)
+
+# Restituisce le riparazioni che hanno un appuntamento,
+# mostrando i dati del cliente privato, del dispositivo e della riparazione,
+# con ordinamento per data dell’appuntamento.
+
+def q_riparazioni_con_appuntamento(meta):
+    return catalogo(meta)["q_riparazioni_con_appuntamento"]
+
+# Restituisce le date degli appuntamenti associati a un cliente privato,
+# identificato tramite nome e cognome, ordinate per data.
+
+def q_appuntamenti_cliente_privato(meta, nome, cognome):
+    return catalogo(meta)["q_appuntamenti_cliente_privato"].params(nome=nome, cognome=cognome)
+
+# Restituisce tutte le riparazioni che hanno almeno un appuntamento,
+# utilizzando una sottoquery con EXISTS.
+
+def q_riparazioni_con_appuntamento_exists(meta):
+    return catalogo(meta)["q_riparazioni_con_appuntamento_exists"]
+
 # Aggiorna lo stato di una riparazione specifica,
 # identificata tramite idRiparazione.
 
+# (params() non è supportato sugli statement DML: qui si legano i valori
+# direttamente; dal catalogo si usa esegui(conn, meta, "update_stato_riparazione", ...))
+
 def update_stato_riparazione(meta, idRiparazione, nuovo_stato):
     Riparazione = meta.tables["Riparazione"]
     return (
@@ -0,0 +1,396 @@
+# report.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO I REPORT DIREZIONALI
+# Aggregazioni calcolate nel database (GROUP BY e funzioni finestra) su
+# Riparazione, Intervento/Tecnico, Preventivo e Pagamento:
+#   - riparazioni per stato (con percentuale sul totale)
+#   - tempi di riparazione per tecnico (media, massimo, posizione)
+#   - preventivato/accettato/pagato per mese (con pagato cumulato)
+#
+# I risultati restano in memoria per REPORT_INTERVALLO secondi. Allo scadere,
+# i report con una "filigrana" (colonna data crescente) vengono aggiornati in
+# modo incrementale: si aggregano solo le righe dall'ultima filigrana in poi
+# e si sommano ai totali già calcolati, senza rileggere lo storico.
+# Il valore della filigrana stessa (es. il giorno per una colonna Date) viene
+# sempre ricalcolato: il suo contributo viene tolto dai totali e riletto, così
+# le righe aggiunte dopo con la stessa data non vanno perse.
+# Le righe inserite in seguito con una data più vecchia della filigrana non
+# vengono viste finché non si ricalcola il report per intero (modo "completo").
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import argparse
+import os
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import Counter
+from sqlalchemy import select, func, literal, literal_column, union_all, and_, bindparam, case, Float
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+import queries
+
+# Secondi dopo cui un report in memoria viene aggiornato.
+REPORT_INTERVALLO = float(os.getenv("REPORT_INTERVALLO", "600"))
+
+# Se attivo (default) allo scadere si aggiorna in modo incrementale dove possibile.
+REPORT_INCREMENTALE = os.getenv("REPORT_INCREMENTALE", "1") == "1"
+
+MODI = ("auto", "incrementale", "completo")
+
+
+# Ore (con decimali) trascorse tra due date, tradotto per dialetto.
+class ore_tra(FunctionElement):
+    type = Float()
+    inherit_cache = True
+
+@compiles(ore_tra, "mysql")
+def _ore_tra_mysql(element, compiler, **kw):
+    inizio, fine = list(element.clauses)
+    return compiler.process(func.timestampdiff(literal_column("SECOND"), inizio, fine) / 3600.0, **kw)
+
+@compiles(ore_tra, "sqlite")
+def _ore_tra_sqlite(element, compiler, **kw):
+    inizio, fine = list(element.clauses)
+    return compiler.process((func.julianday(fine) - func.julianday(inizio)) * 24, **kw)
+
+@compiles(ore_tra)
+def _ore_tra_default(element, compiler, **kw):
+    inizio, fine = list(element.clauses)
+    return compiler.process(func.extract("epoch", fine - inizio) / 3600.0, **kw)
+
+
+# Report con cache in memoria e aggiornamento incrementale opzionale.
+# Le sottoclassi definiscono costruisci() e, se aggregano righe con delle
+# filigrane, parziali()/combina()/sottrai()/finalizza() per unire i nuovi
+# aggregati ai precedenti. Le versioni di base trattano le righe come un
+# elenco (report che non aggregano): si aggiungono e si tolgono così come sono.
+class Report(ABC):
+    nome = ""
+    titolo = ""
+    # (tabella, colonna) crescenti usate come filigrana; vuoto = solo ricalcolo completo
+    filigrane: tuple = ()
+
+    def __init__(self, intervallo: float = REPORT_INTERVALLO):
+        self.intervallo = intervallo
+        self.colonne: list[str] = []
+        self.righe: list[tuple] = []
+        self.calcolato_il: float | None = None
+        self.valori_filigrana: list | None = None
+        self.ultimo_modo = None
+        self._parziali: dict = {}
+        self._bordo: list[tuple] = []  # righe aggregate con filigrana uguale all'ultima letta
+        self._statement = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.statistiche: Counter = Counter()
+
+    # Statement del report. Con incrementale=True considera solo le righe con
+    # filigrana in [dal_i, al_i], altrimenti tutte quelle con filigrana <= al_i.
+    @abstractmethod
+    def costruisci(self, meta, incrementale: bool):
+        ...
+
+    def statement(self, meta, incrementale: bool = False):
+        per_meta = self._statement.setdefault(meta, {})
+        if incrementale not in per_meta:
+            stmt = self.costruisci(meta, incrementale)
+            per_meta[incrementale] = stmt.execution_options(nome_query=f"report_{self.nome}")
+        return per_meta[incrementale]
+
+    # Condizione sulla i-esima filigrana (vedi costruisci).
+    def filtro(self, meta, i: int, incrementale: bool):
+        tabella, colonna = self.filigrane[i]
+        col = meta.tables[tabella].c[colonna]
+        if incrementale:
+            return and_(col >= bindparam(f"dal_{i}"), col <= bindparam(f"al_{i}"))
+        return col <= bindparam(f"al_{i}")
+
+    def _leggi_filigrane(self, conn, meta) -> list:
+        return [
+            conn.execute(select(func.max(meta.tables[t].c[c]))).scalar()
+            for t, c in self.filigrane
+        ]
+
+    # Ritorna (colonne, righe). modo: "auto" (cache, poi incrementale se possibile),
+    # "incrementale" o "completo" (forzano l'aggiornamento).
+    def leggi(self, conn, meta, modo: str = "auto"):
+        if modo not in MODI:
+            raise ValueError(f"Modo non valido: {modo} (ammessi: {', '.join(MODI)})")
+        with self._lock:
+            adesso = time.monotonic()
+            if modo == "auto" and self.calcolato_il is not None and adesso - self.calcolato_il < self.intervallo:
+                self.statistiche["hit"] += 1
+                return self.colonne, self.righe
+
+            nuove = self._leggi_filigrane(conn, meta)
+            incrementale = (
+                modo != "completo"
+                and (modo == "incrementale" or REPORT_INCREMENTALE)
+                and self.filigrane
+                and self.valori_filigrana is not None
+                and None not in self.valori_filigrana
+            )
+            if incrementale:
+                self._aggiorna(conn, meta, nuove)
+            else:
+                self._ricalcola(conn, meta, nuove)
+            self.valori_filigrana = nuove
+            self.calcolato_il = time.monotonic()
+            return self.colonne, self.righe
+
+    def _ricalcola(self, conn, meta, nuove: list):
+        params = {f"al_{i}": v for i, v in enumerate(nuove)}
+        res = conn.execute(self.statement(meta), params)
+        self.colonne = list(res.keys())
+        self.righe = [tuple(r) for r in res]
+        if self.filigrane:
+            self._parziali = self.parziali(self.righe)
+            self._bordo = self._intervallo(conn, meta, nuove, nuove)
+        self.ultimo_modo = "completo"
+        self.statistiche["completo"] += 1
+
+    # Toglie il contributo dell'ultima filigrana e rilegge le righe da lì in poi:
+    # le righe arrivate dopo con la stessa data vengono contate.
+    def _aggiorna(self, conn, meta, nuove: list):
+        self.ultimo_modo = "incrementale"
+        self.statistiche["incrementale"] += 1
+        nuove_righe = self._intervallo(conn, meta, self.valori_filigrana, nuove)
+        self.sottrai(self._parziali, self._bordo)
+        self.combina(self._parziali, nuove_righe)
+        self.righe = self.finalizza(self._parziali)
+        self._bordo = nuove_righe if nuove == self.valori_filigrana else self._intervallo(conn, meta, nuove, nuove)
+
+    # Righe aggregate con filigrana i-esima in [dal_i, al_i].
+    def _intervallo(self, conn, meta, dal: list, al: list) -> list[tuple]:
+        params = {}
+        for i, (d, a) in enumerate(zip(dal, al)):
+            params[f"dal_{i}"], params[f"al_{i}"] = d, a
+        return [tuple(r) for r in conn.execute(self.statement(meta, incrementale=True), params)]
+
+    # Parziali di base: quante volte compare ogni riga, nell'ordine di arrivo.
+    def parziali(self, righe) -> dict:
+        return dict(Counter(righe))
+
+    def combina(self, parziali: dict, righe):
+        for r in righe:
+            parziali[r] = parziali.get(r, 0) + 1
+
+    # Inverso di combina: toglie dai parziali righe già sommate.
+    def sottrai(self, parziali: dict, righe):
+        for r in righe:
+            parziali[r] -= 1
+            if parziali[r] == 0:
+                del parziali[r]
+
+    def finalizza(self, parziali: dict) -> list[tuple]:
+        return [r for r, n in parziali.items() for _ in range(n)]
+
+    def riepilogo(self) -> str:
+        s = self.statistiche
+        eta = f"{time.monotonic() - self.calcolato_il:.0f}s fa" if self.calcolato_il is not None else "mai"
+        return (
+            f"{self.nome}: calcolato {eta} ({self.ultimo_modo or '-'}) "
+            f"hit={s['hit']} completi={s['completo']} incrementali={s['incrementale']}"
+        )
+
+
+# Numero di riparazioni per stato e percentuale sul totale.
+# Gli stati cambiano con gli UPDATE: il report si ricalcola sempre per intero.
+class RiparazioniPerStato(Report):
+    nome = "riparazioni_per_stato"
+    titolo = "Riparazioni per stato"
+
+    def costruisci(self, meta, incrementale):
+        Riparazione = meta.tables["Riparazione"]
+        n = func.count()
+        return (
+            select(
+                Riparazione.c.stato,
+                n.label("riparazioni"),
+                func.round(n * 100.0 / func.sum(n).over(), 1).label("percentuale"),
+            )
+            .group_by(Riparazione.c.stato)
+            .order_by(n.desc())
+        )
+
+
+# Tempo tra ingresso e chiusura delle riparazioni chiuse, per ogni tecnico che
+# vi ha lavorato (una riparazione conta una volta per tecnico). Filigrana: dataChiusura.
+class TempiPerTecnico(Report):
+    nome = "tempi_per_tecnico"
+    titolo = "Tempi di riparazione per tecnico (ore)"
+    filigrane = (("Riparazione", "dataChiusura"),)
+
+    def costruisci(self, meta, incrementale):
+        Intervento = meta.tables["Intervento"]
+        Riparazione = meta.tables["Riparazione"]
+        Tecnico = meta.tables["Tecnico"]
+        coppie = (
+            select(
+                Intervento.c.idTecnico,
+                Riparazione.c.idRiparazione,
+                ore_tra(Riparazione.c.dataIngresso, Riparazione.c.dataChiusura).label("ore"),
+            )
+            .join_from(Intervento, Riparazione, Intervento.c.idRiparazione == Riparazione.c.idRiparazione)
+            .where(self.filtro(meta, 0, incrementale))
+            .distinct()
+            .subquery()
+        )
+        media = func.avg(coppie.c.ore)
+        return (
+            select(
+                Tecnico.c.idTecnico,
+                Tecnico.c.nome,
+                Tecnico.c.cognome,
+                func.count().label("riparazioni"),
+                func.sum(coppie.c.ore).label("ore_totali"),
+                func.round(media, 1).label("ore_medie"),
+                func.max(coppie.c.ore).label("ore_max"),
+                func.rank().over(order_by=media).label("posizione"),
+            )
+            .join_from(Tecnico, coppie, Tecnico.c.idTecnico == coppie.c.idTecnico)
+            .group_by(Tecnico.c.idTecnico, Tecnico.c.nome, Tecnico.c.cognome)
+            .order_by(media, Tecnico.c.idTecnico)
+        )
+
+    def parziali(self, righe):
+        return {r[0]: [r[1], r[2], r[3], r[4], r[6]] for r in righe}
+
+    def combina(self, parziali, righe):
+        for id_tecnico, nome, cognome, n, totale, _media, massimo, _pos in righe:
+            p = parziali.get(id_tecnico)
+            if p is None:
+                parziali[id_tecnico] = [nome, cognome, n, totale, massimo]
+            else:
+                p[2] += n
+                p[3] += totale
+                p[4] = max(p[4], massimo)
+
+    # Il massimo resta: le righe tolte vengono rilette subito dopo da combina.
+    def sottrai(self, parziali, righe):
+        for id_tecnico, _nome, _cognome, n, totale, _media, _massimo, _pos in righe:
+            p = parziali[id_tecnico]
+            p[2] -= n
+            p[3] -= totale
+            if p[2] == 0:
+                del parziali[id_tecnico]
+
+    def finalizza(self, parziali):
+        medie = sorted((p[3] / p[2], k) for k, p in parziali.items())
+        # stessa numerazione di RANK(): a parità di media stessa posizione
+        risultato, pos, precedente = [], 0, None
+        for i, (media, k) in enumerate(medie, 1):
+            if media != precedente:
+                pos, precedente = i, media
+            nome, cognome, n, totale, massimo = parziali[k]
+            risultato.append((k, nome, cognome, n, totale, round(media, 1), massimo, pos))
+        return risultato
+
+
+# Per ogni mese: importo dei preventivi emessi e accettati, incassi e incassi
+# cumulati. Filigrane: Preventivo.data e Pagamento.dataPagamento.
+class RicaviPerMese(Report):
+    nome = "ricavi_per_mese"
+    titolo = "Preventivato e incassato per mese"
+    filigrane = (("Preventivo", "data"), ("Pagamento", "dataPagamento"))
+
+    def costruisci(self, meta, incrementale):
+        Preventivo = meta.tables["Preventivo"]
+        Pagamento = meta.tables["Pagamento"]
+        zero = literal(0, Pagamento.c.importo.type)
+        preventivi = (
+            select(
+                queries.inizio_intervallo(Preventivo.c.data, "mese").label("mese"),
+                func.sum(Preventivo.c.importoTotale).label("preventivato"),
+                func.sum(case((Preventivo.c.accettato == 1, Preventivo.c.importoTotale), else_=0)).label("accettato"),
+                zero.label("pagato"),
+            )
+            .where(self.filtro(meta, 0, incrementale))
+            .group_by(literal_column("mese"))
+        )
+        pagamenti = (
+            select(
+                queries.inizio_intervallo(Pagamento.c.dataPagamento, "mese").label("mese"),
+                zero.label("preventivato"),
+                zero.label("accettato"),
+                func.sum(Pagamento.c.importo).label("pagato"),
+            )
+            .where(self.filtro(meta, 1, incrementale))
+            .group_by(literal_column("mese"))
+        )
+        u = union_all(preventivi, pagamenti).subquery()
+        pagato = func.sum(u.c.pagato)
+        return (
+            select(
+                u.c.mese,
+                func.sum(u.c.preventivato).label("preventivato"),
+                func.sum(u.c.accettato).label("accettato"),
+                pagato.label("pagato"),
+                func.sum(pagato).over(order_by=u.c.mese).label("pagato_cumulato"),
+            )
+            .group_by(u.c.mese)
+            .order_by(u.c.mese)
+        )
+
+    def parziali(self, righe):
+        return {r[0]: [r[1], r[2], r[3]] for r in righe}
+
+    def combina(self, parziali, righe):
+        for mese, preventivato, accettato, pagato, _cumulato in righe:
+            p = parziali.setdefault(mese, [0, 0, 0])
+            p[0] += preventivato
+            p[1] += accettato
+            p[2] += pagato
+
+    def sottrai(self, parziali, righe):
+        for mese, preventivato, accettato, pagato, _cumulato in righe:
+            p = parziali[mese]
+            p[0] -= preventivato
+            p[1] -= accettato
+            p[2] -= pagato
+
+    def finalizza(self, parziali):
+        righe, cumulato = [], 0
+        for mese in sorted(parziali):
+            preventivato, accettato, pagato = parziali[mese]
+            cumulato += pagato
+            righe.append((mese, preventivato, accettato, pagato, cumulato))
+        return righe
+
+
+REPORT = {r.nome: r for r in (RiparazioniPerStato(), TempiPerTecnico(), RicaviPerMese())}
+
+
+# Ritorna (colonne, righe) del report indicato.
+def leggi(conn, meta, nome: str, modo: str = "auto"):
+    if nome not in REPORT:
+        raise ValueError(f"Report sconosciuto: {nome} (disponibili: {', '.join(REPORT)})")
+    return REPORT[nome].leggi(conn, meta, modo)
+
+# Stato dei report in memoria, una riga per report.
+def riepilogo() -> str:
+    return "\n".join(r.riepilogo() for r in REPORT.values())
+
+
+if __name__ == "__main__":
+    import output
+    from database import engine_lettura
+    from schema_reflect import schema_riflesso
+
+    parser = argparse.ArgumentParser(description="Report direzionali calcolati nel database")
+    parser.add_argument("nomi", nargs="*", help=f"report da calcolare ({', '.join(REPORT)}; default: tutti)")
+    parser.add_argument("--modo", choices=MODI, default="completo")
+    args = parser.parse_args()
+    sconosciuti = [n for n in args.nomi if n not in REPORT]
+    if sconosciuti:
+        parser.error(f"report sconosciuti: {', '.join(sconosciuti)}")
+
+    meta = schema_riflesso()
+    with engine_lettura().connect() as conn:
+        for nome in args.nomi or list(REPORT):
+            t0 = time.perf_counter()
+            colonne, righe = leggi(conn, meta, nome, args.modo)
+            print(f"\n== {REPORT[nome].titolo} ({(time.perf_counter() - t0) * 1000:.1f} ms) ==")
+            output.scrivi_tabella(colonne, [righe])
@@ -0,0 +1,849 @@
+# ricerca.py
+# -----------------------------------------------------------------------------
+# IN QUESTO FILE DEFINIAMO LA RICERCA APPROSSIMATA (in memoria)
+# Indice di nomi dei clienti privati, ragioni sociali, numeri di telefono e
+# numeri di serie dei dispositivi, per trovare un cliente anche con errori di
+# battitura, maiuscole diverse o solo l'inizio del nome, senza LIKE '%x%'.
+#
+#   - i testi vengono normalizzati (minuscole, senza accenti e punteggiatura;
+#     telefoni e seriali senza separatori); ogni testo è un "documento" con un
+#     numero progressivo, e i testi stanno in due buffer di byte
+#   - vocabolario ordinato: i documenti di tutte le parole stanno in un solo
+#     array di interi, una parola dopo l'altra, così quelli delle parole con lo
+#     stesso prefisso sono un solo tratto contiguo (completamento con bisect);
+#     per ogni trigramma un array dei documenti: nessuna struttura Python per
+#     documento
+#   - un errore per parola (lettera mancante, in più, sbagliata o scambiata con
+#     la vicina): per ogni parola indicizzata le chiavi (crc32) sue e delle sue
+#     varianti con una lettera in meno, in un array ordinato di interi a 64 bit;
+#     una parola senza corrispondenze si prova a dividere in due (spazio
+#     mancante o sbagliato)
+#   - gli elenchi delle parole della richiesta si intersecano come insiemi,
+#     partendo dal più corto; per le parole molto frequenti si tengono in
+#     memoria pochi insiemi già pronti
+#   - trigrammi, per gli altri casi: i candidati si prendono dagli elenchi più
+#     rari e si ordinano per similarità (trigrammi in comune / trigrammi totali)
+#
+# L'indice si prepara alla prima ricerca (non all'avvio del menu) leggendo le
+# tabelle in streaming oppure caricandolo da un file (RICERCA_SNAPSHOT), e si
+# aggiorna con gli inserimenti del menu. Il file si scrive solo con --salva-snapshot
+# e vale solo per lo stesso DATABASE_URL e finché le righe già indicizzate non cambiano.
+#
+#   python ricerca.py mario rosi          # cerca nel database configurato
+#   python ricerca.py --salva-snapshot    # prepara l'indice e lo salva su file
+#   python ricerca.py --prova 1000000     # tempi su dati generati, senza database
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import bisect
+import math
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import Counter
+from itertools import chain, islice
+from sqlalchemy import select, func
+from sqlalchemy.engine import make_url
+import output
+
+# File dell'indice salvato (stringa vuota => niente snapshot).
+RICERCA_SNAPSHOT = os.getenv(
+    "RICERCA_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ricerca.pickle"),
+)
+
+# Similarità minima (0-1) perché un documento sia proposto dalla ricerca approssimata.
+RICERCA_SOGLIA = float(os.getenv("RICERCA_SOGLIA", "0.3"))
+
+# Limiti che tengono costante il costo di una ricerca anche su indici molto grandi.
+MAX_PAROLE_PREFISSO = 200   # parole lette per ogni prefisso
+MAX_POSIZIONI = 10000       # voci degli elenchi lette per ogni parola o per i trigrammi
+MAX_CANDIDATI = 1000        # documenti valutati per similarità
+MIN_LUNGHEZZA_VARIANTI = 3  # parole più corte: niente errori di battitura
+MAX_INSIEMI = 64            # insiemi di documenti delle parole frequenti tenuti in memoria
+
+# Tipi di documento indicizzati.
+PRIVATO, BUSINESS, TELEFONO, SERIALE = 1, 2, 3, 4
+NOMI_TIPO = {PRIVATO: "privato", BUSINESS: "business", TELEFONO: "telefono", SERIALE: "seriale"}
+
+# Una sola preparazione dell'indice alla volta (vedi IndiceRicerca.assicura).
+_lock_preparazione = threading.Lock()
+
+_NON_ALFANUMERICI = re.compile(r"[^0-9a-z]+")
+
+
+# Minuscole, senza accenti, con la punteggiatura sostituita da spazi.
+def normalizza(testo: str) -> str:
+    testo = testo or ""
+    if not testo.isascii():
+        testo = unicodedata.normalize("NFKD", testo)
+        testo = "".join(c for c in testo if not unicodedata.combining(c))
+    return _NON_ALFANUMERICI.sub(" ", testo.lower()).strip()
+
+# Forma compatta (senza spazi): usata per telefoni e numeri di serie.
+def compatta(testo: str) -> str:
+    return normalizza(testo).replace(" ", "")
+
+# Trigrammi di un termine, con le parole delimitate da spazi come in pg_trgm.
+def trigrammi(termine: str) -> set[str]:
+    tri = set()
+    for parola in termine.split():
+        p = "  " + parola + " "
+        tri |= {p[i:i + 3] for i in range(len(p) - 2)}
+    return tri
+
+# Varianti di una parola con una lettera in meno.
+def cancellazioni(parola: str) -> set[str]:
+    return {parola[:i] + parola[i + 1:] for i in range(len(parola))}
+
+# Chiave di una variante nell'elenco ordinato delle cancellazioni: crc32 della
+# variante nei 32 bit alti, numero della parola in quelli bassi.
+def _chiave(variante: str) -> int:
+    return zlib.crc32(variante.encode()) << 32
+
+# True se le parole sono uguali o a una modifica (lettera mancante, in più,
+# sbagliata o scambiata con la vicina).
+def una_modifica(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+    if len(a) > len(b):
+        return a[i + 1:] == b[i:]
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+
+# Posizioni di `valore` nel vettore (la ricerca la fa array.index, senza tabelle per documento).
+def _posizioni(valori: array, valore: int) -> list[int]:
+    trovate = []
+    i = 0
+    while True:
+        try:
+            i = valori.index(valore, i)
+        except ValueError:
+            return trovate
+        trovate.append(i)
+        i += 1
+
+
+class IndiceRicerca:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # vocabolario: parole ordinate e i loro documenti in un solo array (quelli
+        # della parola i vanno da _inizio[i] a _inizio[i + 1])
+        self._parole: list[str] = []
+        self._inizio = array("I", [0])
+        self._documenti_parole = array("I")
+        # parole dei documenti aggiunti dopo l'ultima compattazione (vedi _compatta):
+        # parola -> documenti (l'id se è uno solo, altrimenti array), e le parole ordinate
+        self._nuove: dict[str, int | array] = {}
+        self._parole_nuove: list[str] = []
+        self._trigrammi: dict[str, array] = {}   # trigramma -> documenti
+        # errori di battitura: parole alfabetiche numerate e, ordinate, le chiavi
+        # della parola e delle sue varianti con una lettera in meno (vedi _chiave)
+        self._parole_varianti: list[str] = []
+        self._cancellazioni = array("Q")
+        # insiemi dei documenti dei tratti del vocabolario più frequenti, per le
+        # intersezioni (costruiti alla prima ricerca che li usa, non salvati nello snapshot)
+        self._insiemi: dict[tuple[int, int], frozenset] = {}
+        # documenti (vettori paralleli; tipo 0 = rimosso). Testo originale e
+        # normalizzato stanno in due buffer: il documento d va da pos[d] a pos[d + 1]
+        self._doc_tipo = bytearray()
+        self._doc_id = array("q")
+        self._doc_cliente = array("q")
+        self._testi = bytearray()
+        self._pos_testo = array("Q", [0])
+        self._normalizzati = bytearray()
+        self._pos_normalizzato = array("Q", [0])
+        self.attivi = 0
+        self.filigrana = {"cliente": 0, "dispositivo": 0}
+        # database di provenienza e impronta delle righe indicizzate (vedi prepara)
+        self.origine = None
+        self.impronta = None
+        self.pronto = False
+
+    # ---------- documenti ----------
+
+    def _testo(self, did: int) -> str:
+        return self._testi[self._pos_testo[did]:self._pos_testo[did + 1]].decode()
+
+    def _normalizzato(self, did: int) -> str:
+        return self._normalizzati[self._pos_normalizzato[did]:self._pos_normalizzato[did + 1]].decode()
+
+    # ---------- inserimento ----------
+
+    # In un caricamento le parole nuove si ordinano alla fine (vedi _compatta).
+    def _aggiungi(self, tipo: int, id_doc: int, id_cliente: int, testo: str, normalizzato: str,
+                  caricamento: bool = False):
+        if not normalizzato:
+            return
+        did = len(self._doc_tipo)
+        self._doc_tipo.append(tipo)
+        self._doc_id.append(id_doc)
+        self._doc_cliente.append(id_cliente)
+        self._testi += testo.encode()
+        self._pos_testo.append(len(self._testi))
+        self._normalizzati += normalizzato.encode()
+        self._pos_normalizzato.append(len(self._normalizzati))
+        for t in trigrammi(normalizzato):
+            elenco = self._trigrammi.get(t)
+            if elenco is None:
+                elenco = self._trigrammi[t] = array("I")
+            elenco.append(did)
+        for parola in set(normalizzato.split()):
+            elenco = self._nuove.get(parola)
+            if elenco is None:
+                self._nuove[parola] = did
+                if not caricamento:
+                    bisect.insort(self._parole_nuove, parola)
+            elif type(elenco) is int:
+                self._nuove[parola] = array("I", (elenco, did))
+            else:
+                elenco.append(did)
+        self.attivi += 1
+
+    # Unisce al vocabolario le parole dei documenti aggiunti dopo l'ultima
+    # compattazione, registra le varianti di quelle mai viste e ordina le chiavi.
+    # Si fa alla fine di un caricamento; le poche parole aggiunte dal menu restano
+    # in _nuove (la ricerca guarda anche lì).
+    def _compatta(self):
+        if not self._nuove:
+            return
+        vecchie, vecchio_inizio, vecchi = self._parole, self._inizio, self._documenti_parole
+        parole, inizio, documenti = [], array("I", [0]), array("I")
+        i = 0
+        for parola in sorted(self._nuove.keys() | set(vecchie)):
+            if i < len(vecchie) and vecchie[i] == parola:
+                documenti += vecchi[vecchio_inizio[i]:vecchio_inizio[i + 1]]
+                i += 1
+            elif parola.isalpha():
+                numero = len(self._parole_varianti)
+                self._parole_varianti.append(parola)
+                self._cancellazioni.append(_chiave(parola) | numero)
+                if len(parola) >= MIN_LUNGHEZZA_VARIANTI:
+                    self._cancellazioni.extend(_chiave(v) | numero for v in cancellazioni(parola))
+            elenco = self._nuove.get(parola)
+            if type(elenco) is int:
+                documenti.append(elenco)
+            elif elenco is not None:
+                documenti += elenco
+            parole.append(parola)
+            inizio.append(len(documenti))
+        self._parole, self._inizio, self._documenti_parole = parole, inizio, documenti
+        self._nuove, self._parole_nuove, self._insiemi = {}, [], {}
+        self._cancellazioni = array("Q", sorted(self._cancellazioni))
+
+    def _aggiungi_cliente(self, id_cliente, nome=None, cognome=None, ragione_sociale=None, telefono=None,
+                          caricamento=False):
+        if ragione_sociale:
+            self._aggiungi(BUSINESS, id_cliente, id_cliente, ragione_sociale, normalizza(ragione_sociale), caricamento)
+        elif nome or cognome:
+            testo = f"{nome or ''} {cognome or ''}".strip()
+            self._aggiungi(PRIVATO, id_cliente, id_cliente, testo, normalizza(testo), caricamento)
+        if telefono:
+            self._aggiungi(TELEFONO, id_cliente, id_cliente, telefono, compatta(telefono), caricamento)
+        self.filigrana["cliente"] = max(self.filigrana["cliente"], id_cliente)
+
+    def _aggiungi_dispositivo(self, id_dispositivo, id_cliente, numero_serie, caricamento=False):
+        if numero_serie:
+            self._aggiungi(SERIALE, id_dispositivo, id_cliente, numero_serie, compatta(numero_serie), caricamento)
+        self.filigrana["dispositivo"] = max(self.filigrana["dispositivo"], id_dispositivo)
+
+    # Aggiunge un cliente privato (nome, cognome) o business (ragione_sociale).
+    # Finché l'indice non è pronto non serve: la preparazione legge anche questa riga.
+    def aggiungi_cliente(self, id_cliente, nome=None, cognome=None, ragione_sociale=None, telefono=None):
+        with self._lock:
+            if self.pronto:
+                self._aggiungi_cliente(id_cliente, nome, cognome, ragione_sociale, telefono)
+
+    def aggiungi_dispositivo(self, id_dispositivo, id_cliente, numero_serie):
+        with self._lock:
+            if self.pronto:
+                self._aggiungi_dispositivo(id_dispositivo, id_cliente, numero_serie)
+
+    # ---------- rimozione ----------
+
+    def _rimuovi(self, did: int):
+        if self._doc_tipo[did]:
+            self._doc_tipo[did] = 0
+            self.attivi -= 1
+
+    # Rimuove un cliente (nome/ragione sociale e telefono) e i suoi dispositivi.
+    # I documenti restano negli elenchi e vengono saltati dalla ricerca.
+    def rimuovi_cliente(self, id_cliente):
+        with self._lock:
+            for did in _posizioni(self._doc_cliente, id_cliente):
+                self._rimuovi(did)
+
+    def rimuovi_dispositivo(self, id_dispositivo):
+        with self._lock:
+            for did in _posizioni(self._doc_id, id_dispositivo):
+                if self._doc_tipo[did] == SERIALE:
+                    self._rimuovi(did)
+
+    # ---------- costruzione dal database ----------
+
+    # Legge clienti e dispositivi (solo id maggiori delle filigrane) e li aggiunge.
+    # Le parole nuove entrano nel vocabolario una volta sola alla fine.
+    def _carica(self, conn, meta, blocco: int = 10000):
+        ClientePrivato = meta.tables["ClientePrivato"]
+        ClienteBusiness = meta.tables["ClienteBusiness"]
+        Dispositivo = meta.tables["Dispositivo"]
+        da_cliente, da_disp = self.filigrana["cliente"], self.filigrana["dispositivo"]
+
+        def colonna(t, nome):
+            return t.c[nome] if nome in t.c else None
+
+        tel_p, tel_b = colonna(ClientePrivato, "telefono"), colonna(ClienteBusiness, "telefono")
+        stmt = select(ClientePrivato.c.idCliente, ClientePrivato.c.nome, ClientePrivato.c.cognome,
+                      *([tel_p] if tel_p is not None else [])).where(ClientePrivato.c.idCliente > da_cliente)
+        for parte in output.risultato_in_streaming(conn, stmt, None, blocco).partitions():
+            for r in parte:
+                self._aggiungi_cliente(r[0], nome=r[1], cognome=r[2], telefono=r[3] if len(r) > 3 else None,
+                                       caricamento=True)
+        stmt = select(ClienteBusiness.c.idCliente, ClienteBusiness.c.ragioneSociale,
+                      *([tel_b] if tel_b is not None else [])).where(ClienteBusiness.c.idCliente > da_cliente)
+        for parte in output.risultato_in_streaming(conn, stmt, None, blocco).partitions():
+            for r in parte:
+                self._aggiungi_cliente(r[0], ragione_sociale=r[1], telefono=r[2] if len(r) > 2 else None,
+                                       caricamento=True)
+        if "numeroSerie" in Dispositivo.c:
+            stmt = select(Dispositivo.c.idDispositivo, Dispositivo.c.idCliente, Dispositivo.c.numeroSerie).where(
+                Dispositivo.c.idDispositivo > da_disp)
+            for parte in output.risultato_in_streaming(conn, stmt, None, blocco).partitions():
+                for r in parte:
+                    self._aggiungi_dispositivo(r[0], r[1], r[2], caricamento=True)
+        self._compatta()
+
+    # Numero e somma degli id delle righe lette fino alle filigrane, per tabella.
+    # Cambiano se una riga già indicizzata viene eliminata o sostituita.
+    def _impronta_db(self, conn, meta) -> dict[str, tuple[int, int]]:
+        impronta = {}
+        for tabella, colonna, filigrana in (("ClientePrivato", "idCliente", "cliente"),
+                                            ("ClienteBusiness", "idCliente", "cliente"),
+                                            ("Dispositivo", "idDispositivo", "dispositivo")):
+            c = meta.tables[tabella].c[colonna]
+            n, somma = conn.execute(
+                select(func.count(), func.coalesce(func.sum(c), 0)).where(c <= self.filigrana[filigrana])
+            ).one()
+            impronta[tabella] = (int(n), int(somma))
+        return impronta
+
+    # Costruisce l'indice da zero.
+    def costruisci(self, conn, meta):
+        nuovo = IndiceRicerca()
+        nuovo._carica(conn, meta)
+        nuovo.origine = origine_database()
+        nuovo.impronta = nuovo._impronta_db(conn, meta)
+        nuovo.pronto = True
+        with self._lock:
+            self.__dict__.update({k: v for k, v in nuovo.__dict__.items() if k != "_lock"})
+
+    # Carica lo snapshot se è dello stesso database (DATABASE_URL) e se le righe
+    # già indicizzate sono ancora quelle (impronta fino alle filigrane), poi
+    # aggiunge le righe inserite dopo; altrimenti ricostruisce da zero.
+    # Lo snapshot non viene riscritto qui (vedi python ricerca.py --salva-snapshot).
+    # Ritorna "snapshot" o "costruito".
+    def prepara(self, conn, meta, percorso: str | None = RICERCA_SNAPSHOT) -> str:
+        if percorso and self.carica_snapshot(percorso, origine_database()):
+            with self._lock:
+                if self.impronta == self._impronta_db(conn, meta):
+                    self._carica(conn, meta)
+                    self.impronta = self._impronta_db(conn, meta)
+                    self.pronto = True
+                    return "snapshot"
+        self.costruisci(conn, meta)
+        return "costruito"
+
+    # Prepara l'indice se non è ancora pronto (prima ricerca del menu).
+    # Ritorna il modo di preparazione, None se era già pronto.
+    def assicura(self, conn, meta) -> str | None:
+        if self.pronto:
+            return None
+        with _lock_preparazione:
+            if self.pronto:
+                return None
+            return self.prepara(conn, meta)
+
+    def salva_snapshot(self, percorso: str = RICERCA_SNAPSHOT):
+        with self._lock:
+            stato = {k: v for k, v in self.__dict__.items() if k not in ("_lock", "_insiemi", "pronto")}
+            with open(percorso + ".tmp", "wb") as f:
+                pickle.dump(stato, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(percorso + ".tmp", percorso)
+
+    # Carica lo snapshot; con `origine` lo scarta se è stato preparato da un altro database.
+    def carica_snapshot(self, percorso: str = RICERCA_SNAPSHOT, origine: str | None = None) -> bool:
+        try:
+            with open(percorso, "rb") as f:
+                stato = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return False
+        if origine is not None and stato.get("origine") != origine:
+            return False
+        with self._lock:
+            self.__dict__.update(stato)
+            self._insiemi = {}
+        return True
+
+    # ---------- ricerca ----------
+
+    # Posizione della parola nel vocabolario ordinato, None se non c'è.
+    def _posizione(self, parola: str) -> int | None:
+        i = bisect.bisect_left(self._parole, parola)
+        return i if i < len(self._parole) and self._parole[i] == parola else None
+
+    def _conosciuta(self, parola: str) -> bool:
+        return parola in self._nuove or self._posizione(parola) is not None
+
+    # Un gruppo sono le parole accettate per una parola della richiesta, con i
+    # loro "pezzi" di documenti: un tratto del vocabolario (range di posizioni)
+    # o i documenti di una parola aggiunta dopo l'ultima compattazione.
+
+    def _gruppo_parole(self, parole) -> tuple[list[str], list]:
+        parole, pezzi = list(parole), []
+        for p in parole:
+            i = self._posizione(p)
+            if i is not None:
+                pezzi.append(range(i, i + 1))
+            elenco = self._nuove.get(p)
+            if elenco is not None:
+                pezzi.append((elenco,) if type(elenco) is int else elenco)
+        return parole, pezzi
+
+    # Parole indicizzate che iniziano con `parola` (al più MAX_PAROLE_PREFISSO):
+    # nel vocabolario sono un solo tratto.
+    def _gruppo_prefisso(self, parola: str) -> tuple[list[str], list]:
+        i = bisect.bisect_left(self._parole, parola)
+        # "{" segue "z": le parole normalizzate hanno solo cifre e minuscole
+        j = min(bisect.bisect_left(self._parole, parola + "{", i), i + MAX_PAROLE_PREFISSO)
+        parole, pezzi = self._parole[i:j], [range(i, j)] if j > i else []
+        k = bisect.bisect_left(self._parole_nuove, parola)
+        for p in self._parole_nuove[k:k + MAX_PAROLE_PREFISSO]:
+            if not p.startswith(parola):
+                break
+            parole.append(p)
+            elenco = self._nuove[p]
+            pezzi.append((elenco,) if type(elenco) is int else elenco)
+        return parole, pezzi
+
+    def _lunghezza(self, pezzo) -> int:
+        if type(pezzo) is range:
+            return self._inizio[pezzo.stop] - self._inizio[pezzo.start]
+        return len(pezzo)
+
+    def _elenco(self, pezzo):
+        if type(pezzo) is range:
+            return self._documenti_parole[self._inizio[pezzo.start]:self._inizio[pezzo.stop]]
+        return pezzo
+
+    def _frequente(self, pezzo) -> bool:
+        return type(pezzo) is range and self._lunghezza(pezzo) > MAX_POSIZIONI
+
+    # Insieme dei documenti di un tratto frequente (al più MAX_INSIEMI alla volta).
+    def _insieme(self, pezzo: range) -> frozenset:
+        chiave = (pezzo.start, pezzo.stop)
+        insieme = self._insiemi.get(chiave)
+        if insieme is None:
+            if len(self._insiemi) >= MAX_INSIEMI:
+                del self._insiemi[next(iter(self._insiemi))]   # il più vecchio
+            insieme = self._insiemi[chiave] = frozenset(self._elenco(pezzo))
+        return insieme
+
+    # Documenti che contengono la parola (per le parole frequenti l'insieme tenuto in memoria).
+    def _contenenti(self, parola: str) -> set[int] | frozenset:
+        pezzi = self._gruppo_parole([parola])[1]
+        if len(pezzi) == 1 and self._frequente(pezzi[0]):
+            return self._insieme(pezzi[0])
+        return self._unione(pezzi, MAX_POSIZIONI)
+
+    # Documenti di almeno uno dei pezzi, fino a `massimo`.
+    def _unione(self, pezzi, massimo: int) -> set[int]:
+        if sum(map(self._lunghezza, pezzi)) <= massimo:
+            return set().union(*map(self._elenco, pezzi))
+        return set(islice(chain.from_iterable(map(self._elenco, pezzi)), massimo))
+
+    # Documenti con almeno una parola di ogni gruppo. Si parte dal gruppo con meno
+    # documenti (fino a `massimo` se è l'unico) e si tengono quelli presenti negli
+    # altri: i pezzi corti si scorrono, quelli frequenti si confrontano come
+    # insiemi. Se un gruppo ha molti più documenti dei candidati rimasti, si
+    # controlla invece il testo dei candidati.
+    def _documenti(self, gruppi: list, massimo: int) -> set[int]:
+        if len(gruppi) == 1:
+            return self._unione(gruppi[0][1], massimo)
+        gruppi = sorted(gruppi, key=lambda g: sum(map(self._lunghezza, g[1])))
+        pezzi = gruppi[1][1]
+        brevi = [p for p in pezzi if not self._frequente(p)]
+        if sum(map(self._lunghezza, brevi)) < sum(map(self._lunghezza, gruppi[0][1])):
+            # secondo gruppo fatto soprattutto di parole frequenti: costruire l'insieme
+            # dei suoi pezzi corti costa meno, e il primo si scorre come lista
+            primo = islice(chain.from_iterable(map(self._elenco, gruppi[0][1])), MAX_POSIZIONI)
+            frequenti = [self._insieme(p) for p in pezzi if self._frequente(p)]
+            if brevi or len(frequenti) > 1:
+                primo = list(primo)
+            documenti = self._unione(brevi, MAX_POSIZIONI).intersection(primo) if brevi else set()
+            documenti.update(*(insieme.intersection(primo) for insieme in frequenti))
+            altri = gruppi[2:]
+        else:
+            documenti = self._unione(gruppi[0][1], MAX_POSIZIONI)
+            altri = gruppi[1:]
+        for parole, pezzi in altri:
+            if not documenti:
+                break
+            brevi = [p for p in pezzi if not self._frequente(p)]
+            if sum(map(self._lunghezza, brevi)) > 20 * len(documenti):
+                accettate = set(parole)
+                documenti = {d for d in islice(documenti, MAX_CANDIDATI)
+                             if not accettate.isdisjoint(self._normalizzato(d).split())}
+                continue
+            trovati = documenti.intersection(chain.from_iterable(map(self._elenco, brevi)))
+            for p in pezzi:
+                if self._frequente(p):
+                    trovati |= documenti & self._insieme(p)
+            documenti = trovati
+        return documenti
+
+    # Documenti il cui testo normalizzato è uguale alla richiesta (per una sola
+    # parola si guardano i primi `massimo` documenti che la contengono).
+    def _esatti(self, q: str, massimo: int = MAX_CANDIDATI) -> list[int]:
+        parole = set(q.split())
+        gruppi = [self._gruppo_parole([p]) for p in parole]
+        if not gruppi or not all(pezzi for _parole, pezzi in gruppi):
+            return []
+        pos, tipo = self._pos_normalizzato, self._doc_tipo
+        return [d for d in self._documenti(gruppi, massimo)
+                if pos[d + 1] - pos[d] == len(q) and tipo[d] and self._normalizzato(d) == q]
+
+    # Documenti con una parola che inizia con ciascuna parola della richiesta,
+    # fino a `massimo`; i testi più corti hanno punteggio più alto.
+    def _per_prefisso(self, q: str, massimo: int = MAX_CANDIDATI) -> dict[int, float]:
+        gruppi = []
+        for parola in q.split():
+            gruppo = self._gruppo_prefisso(parola)
+            if not gruppo[1]:
+                return {}
+            gruppi.append(gruppo)
+        if not gruppi:
+            return {}
+        pos, tipo = self._pos_normalizzato, self._doc_tipo
+        punteggi = {}
+        for d in self._documenti(gruppi, massimo):
+            if not tipo[d]:
+                continue
+            n = pos[d + 1] - pos[d]
+            punteggi[d] = 1.0 if n == len(q) and self._normalizzato(d) == q else 0.5 + 0.5 * len(q) / n
+            if len(punteggi) >= massimo:
+                break
+        return punteggi
+
+    # Parole indicizzate a distanza di al più una modifica da `parola`: la parola
+    # e le sue varianti con una lettera in meno si cercano tra le chiavi delle
+    # parole indicizzate e delle loro varianti (lettera in più, mancante,
+    # sbagliata o scambiata), poi si verificano. Le parole con cifre (telefoni,
+    # seriali) non hanno chiavi: si cercano direttamente le varianti.
+    def _parole_simili(self, parola: str) -> set[str]:
+        if len(parola) < MIN_LUNGHEZZA_VARIANTI:
+            return {parola} if self._conosciuta(parola) else set()
+        varianti = cancellazioni(parola)
+        if not parola.isalpha():
+            return {p for p in (parola, *varianti) if self._conosciuta(p)}
+        # le parole aggiunte dopo l'ultima compattazione non hanno chiavi: sono poche
+        simili = {p for p in self._parole_nuove if una_modifica(parola, p)}
+        chiavi = self._cancellazioni
+        for variante in (parola, *varianti):
+            chiave = _chiave(variante)
+            i = bisect.bisect_left(chiavi, chiave)
+            while i < len(chiavi) and chiavi[i] >> 32 == chiave >> 32:
+                trovata = self._parole_varianti[chiavi[i] & 0xFFFFFFFF]
+                if una_modifica(parola, trovata):
+                    simili.add(trovata)
+                i += 1
+        return simili
+
+    # Due parole indicizzate che danno `parola` unite o con una lettera al posto
+    # dello spazio (es. "mariorossi", "mariowrossi"). None se non ce ne sono.
+    def _divisione(self, parola: str) -> tuple[str, str] | None:
+        for i in range(1, len(parola)):
+            for a, b in ((parola[:i], parola[i:]), (parola[:i], parola[i + 1:])):
+                if b and self._conosciuta(a) and self._conosciuta(b):
+                    return a, b
+        return None
+
+    # Documenti in cui ogni parola della richiesta corrisponde a una parola del
+    # documento con al più un errore di battitura (l'ultima anche per prefisso,
+    # perché può essere ancora incompleta), con punteggio dalla similarità dei
+    # trigrammi. Poiché ogni parola corrisponde già, i più simili sono quelli con
+    # qualche parola scritta come nella richiesta e, tra questi e tra gli altri,
+    # quelli di lunghezza più vicina: si valutano solo i primi `massimo` in quest'ordine.
+    def _per_parole_simili(self, q: str, soglia: float, massimo: int = MAX_CANDIDATI) -> dict[int, float]:
+        gruppi = []
+        richiesta = q.split()
+        for parola in richiesta:
+            parole, pezzi = self._gruppo_parole(self._parole_simili(parola))
+            if parola is richiesta[-1]:
+                altre, altri = self._gruppo_prefisso(parola)
+                # le parole simili che iniziano con `parola` sono già nel tratto del prefisso
+                tratto = altri[0] if altri and type(altri[0]) is range else range(0)
+                pezzi = [p for p in pezzi if type(p) is not range or p.start not in tratto] + altri
+                parole += altre
+            if pezzi:
+                gruppi.append((parole, pezzi))
+                continue
+            divisione = self._divisione(parola)
+            if divisione is None:
+                return {}
+            gruppi.extend(self._gruppo_parole([p]) for p in divisione)
+        if not gruppi:
+            return {}
+        documenti = self._documenti(gruppi, MAX_POSIZIONI)
+        pos, tipo, n = self._pos_normalizzato, self._doc_tipo, len(q)
+        if len(documenti) > MAX_CANDIDATI:
+            documenti = set(islice(documenti, MAX_CANDIDATI))
+        uguali = set().union(*(documenti.intersection(self._contenenti(p)) for p in set(richiesta)))
+
+        def distanza(d):
+            return abs(pos[d + 1] - pos[d] - n), d
+
+        candidati = sorted(uguali, key=distanza)[:massimo]
+        if len(candidati) < massimo:
+            candidati += sorted(documenti - uguali, key=distanza)[:massimo - len(candidati)]
+        tri_q = trigrammi(q)
+        punteggi = {}
+        for d in candidati:
+            if not tipo[d]:
+                continue
+            tri_t = trigrammi(self._normalizzato(d))
+            comuni = len(tri_q & tri_t)
+            simile = comuni / (len(tri_q) + len(tri_t) - comuni)
+            if simile >= soglia:
+                punteggi[d] = 0.9 * simile
+        return punteggi
+
+    # Documenti simili per trigrammi (similarità >= soglia). Un documento abbastanza
+    # simile ha almeno `minimo` trigrammi in comune con la richiesta: si contano
+    # le presenze negli elenchi più rari e, per ogni elenco non letto, si
+    # abbassa di uno il numero di presenze richiesto. Si valutano i documenti
+    # con più presenze, con i trigrammi del testo.
+    def _per_trigrammi(self, q: str, soglia: float, limite: int) -> dict[int, float]:
+        tri_q = trigrammi(q)
+        if not tri_q:
+            return {}
+        elenchi = sorted((self._trigrammi.get(t, ()) for t in tri_q), key=len)
+        minimo = math.ceil(soglia * len(tri_q))
+        presenze = Counter()
+        letti = posizioni = 0
+        for elenco in elenchi:
+            # oltre il budget si smette: i trigrammi molto comuni (come " ma" o
+            # "ssi") distinguono poco e si trattano come non letti
+            if letti and posizioni + len(elenco) > MAX_POSIZIONI:
+                break
+            presenze.update(elenco)
+            letti += 1
+            posizioni += len(elenco)
+        richieste = max(1, minimo - (len(elenchi) - letti))
+
+        punteggi = {}
+        for d, n in presenze.most_common(limite * 4):
+            if n < richieste:
+                break
+            if not self._doc_tipo[d]:
+                continue
+            tri_t = trigrammi(self._normalizzato(d))
+            comuni = len(tri_q & tri_t)
+            simile = comuni / (len(tri_q) + len(tri_t) - comuni)
+            if simile >= soglia:
+                punteggi[d] = 0.9 * simile
+        return punteggi
+
+    # Ritorna fino a `limite` risultati ordinati per punteggio (1 = identico):
+    # lista di dict con punteggio, tipo, id, idCliente, testo.
+    def cerca(self, testo: str, limite: int = 10, soglia: float = RICERCA_SOGLIA) -> list[dict]:
+        # la forma compatta serve per telefoni e seriali (testi con cifre)
+        varianti = [normalizza(testo)]
+        if any(c.isdigit() for c in testo):
+            varianti.append(compatta(testo))
+        varianti = [v for v in dict.fromkeys(varianti) if v]
+        with self._lock:
+            punteggi: dict[int, float] = {}
+            esatta = False
+            for q in varianti:
+                for did, p in self._per_prefisso(q, limite * 20).items():
+                    punteggi[did] = max(p, punteggi.get(did, 0.0))
+                for did in self._esatti(q, limite * 20):
+                    punteggi[did] = 1.0
+                    esatta = True
+            # la ricerca per somiglianza serve solo se non c'è un testo identico
+            # e i risultati per prefisso non bastano
+            simili = False
+            if not esatta and len(punteggi) < limite:
+                for q in varianti:
+                    for did, p in self._per_parole_simili(q, soglia, limite * 2).items():
+                        punteggi[did] = max(p, punteggi.get(did, 0.0))
+                        simili = True
+            # trigrammi solo se non è stato trovato nulla (più errori, parole spezzate)
+            if not esatta and not simili and len(punteggi) < limite:
+                for q in varianti:
+                    for did, p in self._per_trigrammi(q, soglia, limite).items():
+                        punteggi[did] = max(p, punteggi.get(did, 0.0))
+
+            # a parità di punteggio si ordina per testo, decodificando solo i candidati
+            ordinati = sorted(punteggi.items(), key=lambda x: -x[1])
+            if len(ordinati) > limite:
+                ultimo = ordinati[limite - 1][1]
+                ordinati = [x for x in ordinati if x[1] >= ultimo]
+            migliori = sorted(ordinati, key=lambda x: (-x[1], self._normalizzato(x[0])))[:limite]
+            return [{
+                "punteggio": round(p, 3),
+                "tipo": NOMI_TIPO[self._doc_tipo[did]],
+                "id": self._doc_id[did],
+                "idCliente": self._doc_cliente[did],
+                "testo": self._testo(did),
+            } for did, p in migliori]
+
+    def riepilogo(self) -> str:
+        if not self.pronto:
+            return "indice ricerca: non ancora preparato (alla prima ricerca)"
+        parole = len(self._parole) + sum(self._posizione(p) is None for p in self._parole_nuove)
+        return (
+            f"indice ricerca: documenti={self.attivi} parole={parole} "
+            f"trigrammi={len(self._trigrammi)}"
+        )
+
+
+# Database da cui si prepara l'indice (DATABASE_URL senza password), salvato nello snapshot.
+def origine_database() -> str:
+    from database import DATABASE_URL
+
+    return make_url(DATABASE_URL).render_as_string(hide_password=True)
+
+
+# Indice condiviso dall'applicativo.
+indice = IndiceRicerca()
+
+
+# Picco di memoria del processo in byte (0 dove il modulo resource non c'è).
+def _memoria_processo() -> int:
+    try:
+        import resource
+    except ImportError:
+        return 0
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return picco if sys.platform == "darwin" else picco * 1024
+
+
+# Genera n clienti e dispositivi fittizi (nomi da sillabe casuali) e misura
+# costruzione e tempi di ricerca esatta, per prefisso e con errori di battitura.
+def prova(n: int = 1_000_000, ricerche: int = 1000, seme: int = 3) -> dict:
+    import random
+    import statistics
+
+    rnd = random.Random(seme)
+    sillabe = ["ma", "ri", "ro", "ssi", "bi", "an", "chi", "lu", "ca", "gio", "ve", "ne", "ti", "fer",
+               "ra", "co", "lo", "mbo", "esp", "si", "to", "ric", "gre", "mar", "ino", "pa", "de", "na"]
+
+    def parola():
+        return "".join(rnd.choice(sillabe) for _ in range(rnd.randint(2, 4))).capitalize()
+
+    rss0 = _memoria_processo()
+    t0 = time.perf_counter()
+    idx = IndiceRicerca()
+    nomi = []
+    for i in range(1, n + 1):
+        if i % 5:
+            nome, cognome = parola(), parola()
+            idx._aggiungi_cliente(i, nome=nome, cognome=cognome, telefono=f"3{rnd.randint(10**8, 10**9 - 1)}",
+                                  caricamento=True)
+            nomi.append(f"{nome} {cognome}")
+        else:
+            rs = f"{parola()} {rnd.choice(['Srl', 'Spa', 'Snc'])}"
+            idx._aggiungi_cliente(i, ragione_sociale=rs, telefono=f"0{rnd.randint(10**8, 10**9 - 1)}", caricamento=True)
+            nomi.append(rs)
+        idx._aggiungi_dispositivo(i, i, f"SN-{rnd.randint(10**9, 10**10 - 1)}", caricamento=True)
+    idx._compatta()
+    costruzione = time.perf_counter() - t0
+    memoria = _memoria_processo() - rss0
+
+    def refuso(testo):
+        i = rnd.randrange(len(testo))
+        return testo[:i] + rnd.choice("aeiourst") + testo[i + 1:]
+
+    # ogni tipo di ricerca ritorna (richiesta, testo che deve comparire nei risultati)
+    def esatta():
+        testo = rnd.choice(nomi)
+        return testo.upper(), testo
+
+    def prefisso():
+        testo = rnd.choice(nomi)
+        return testo[:5], None
+
+    def con_refuso():
+        testo = rnd.choice(nomi)
+        return refuso(testo), testo
+
+    tempi = {}
+    for nome_tipo, genera in (("esatta", esatta), ("prefisso", prefisso), ("refuso", con_refuso)):
+        misure = []
+        trovati = 0
+        for _ in range(ricerche):
+            q, atteso = genera()
+            t = time.perf_counter()
+            risultati = idx.cerca(q)
+            misure.append((time.perf_counter() - t) * 1000)
+            trovati += atteso is None or any(r["testo"] == atteso for r in risultati)
+        misure.sort()
+        tempi[nome_tipo] = {
+            "p50_ms": statistics.median(misure),
+            "p95_ms": misure[int(len(misure) * 0.95) - 1],
+            "trovati": trovati / ricerche,
+        }
+    return {"clienti": n, "documenti": idx.attivi, "costruzione_s": costruzione,
+            "memoria_mb": memoria / 1024 / 1024, "tempi": tempi}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ricerca approssimata di clienti, telefoni e seriali")
+    parser.add_argument("testo", nargs="*")
+    parser.add_argument("--limite", type=int, default=10)
+    parser.add_argument("--prova", type=int, metavar="N", help="misura i tempi su N clienti generati")
+    parser.add_argument("--salva-snapshot", action="store_true", help="prepara l'indice e lo salva in RICERCA_SNAPSHOT")
+    args = parser.parse_args()
+    if args.salva_snapshot and not RICERCA_SNAPSHOT:
+        parser.error("RICERCA_SNAPSHOT è vuoto: nessun file in cui salvare l'indice")
+
+    if args.prova:
+        r = prova(args.prova)
+        print(f"{r['clienti']} clienti, {r['documenti']} documenti: costruzione {r['costruzione_s']:.1f}s, "
+              f"memoria {r['memoria_mb']:.0f} MB")
+        for nome_tipo, t in r["tempi"].items():
+            print(f"  ricerca {nome_tipo:<9} p50={t['p50_ms']:.3f} ms  p95={t['p95_ms']:.3f} ms  "
+                  f"trovati={t['trovati']:.1%}")
+    else:
+        from database import engine_lettura
+        from schema_reflect import schema_riflesso
+
+        meta = schema_riflesso()
+        with engine_lettura().connect() as conn:
+            t0 = time.perf_counter()
+            modo = indice.prepara(conn, meta)
+        print(f"{indice.riepilogo()} ({modo} in {time.perf_counter() - t0:.2f}s)")
+        if args.salva_snapshot:
+            t0 = time.perf_counter()
+            indice.salva_snapshot(RICERCA_SNAPSHOT)
+            print(f"snapshot salvato in {RICERCA_SNAPSHOT} ({time.perf_counter() - t0:.2f}s)")
+        if args.testo:
+            t0 = time.perf_counter()
+            risultati = indice.cerca(" ".join(args.testo), args.limite)
+            print(f"ricerca in {(time.perf_counter() - t0) * 1000:.3f} ms")
+            colonne = ["punteggio", "tipo", "testo", "idCliente", "id"]
+            output.scrivi_tabella(colonne, [[[r[c] for c in colonne] for r in risultati]])
@@ -5,17 +5,199 @@
 # -----------------------------------------------------------------------------
 #
 
-from sqlalchemy import MetaData
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from sqlalchemy import MetaData, bindparam, text
 from database import engine
 
-# Carica tutte le tabelle del database usando la reflection di SQLAlchemy.
-# Ritorna un oggetto MetaData con lo schema completo.
+# Tabelle necessarie al corretto funzionamento dell'applicativo.
+TABELLE_RICHIESTE = [
+    "Cliente", "ClientePrivato", "ClienteBusiness",
+    "Dispositivo", "Riparazione", "Appuntamento",
+    "Tecnico", "Intervento",
+    "Ricambio", "Preventivo", "DettaglioPreventivo",
+    "Pagamento", "Fornitore", "Fornitura",
+    "Ordine", "DettaglioOrdine",
+    "DocumentoFiscale", "Garanzia",
+]
+
+# File in cui viene salvato lo schema riflesso (MetaData serializzato)
+# insieme all'impronta delle tabelle. Stringa vuota => cache disattivata.
+SCHEMA_CACHE = os.getenv(
+    "SCHEMA_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".schema_cache.pickle"),
+)
+
+# Calcola l'impronta (fingerprint) di ogni tabella da colonne e indici:
+# se struttura, indici o versione della tabella cambiano, cambia anche l'impronta
+# (es. dopo `python indici.py ensure-indexes` la tabella viene riflessa di nuovo).
+# Ritorna {nome_tabella: impronta} oppure None se il dialetto non è supportato.
+
+def impronta_schema(conn, tabelle) -> dict[str, str] | None:
+    nomi = list(tabelle)
+    if conn.dialect.name == "mysql":
+        # l'impronta si calcola qui e non con GROUP_CONCAT, che tronca il testo a
+        # group_concat_max_len (1024 byte di default) sulle tabelle larghe
+        statements = [
+            "SELECT c.TABLE_NAME, t.CREATE_TIME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, "
+            "c.COLUMN_DEFAULT, c.COLUMN_KEY, c.EXTRA "
+            "FROM information_schema.COLUMNS c "
+            "JOIN information_schema.TABLES t "
+            "ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME "
+            "WHERE c.TABLE_SCHEMA = DATABASE() AND c.TABLE_NAME IN :nomi "
+            "ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION",
+            "SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME "
+            "FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :nomi "
+            "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX",
+        ]
+    elif conn.dialect.name == "sqlite":
+        # la riga 'table' e quelle 'index' della stessa tabella (tbl_name)
+        statements = [
+            "SELECT tbl_name, type, name, sql FROM sqlite_master "
+            "WHERE type IN ('table', 'index') AND tbl_name IN :nomi "
+            "ORDER BY tbl_name, type DESC, name",
+        ]
+    else:
+        return None
+    impronte = {}
+    for sql in statements:
+        stmt = text(sql).bindparams(bindparam("nomi", expanding=True))
+        for nome, *valori in conn.execute(stmt, {"nomi": nomi}):
+            impronte.setdefault(nome, hashlib.md5()).update("|".join(map(str, valori)).encode() + b",")
+    return {nome: h.hexdigest() for nome, h in impronte.items()}
+
+# Legge dal disco lo schema salvato in precedenza (se presente e leggibile).
+
+def _leggi_cache(percorso):
+    if not percorso or not os.path.exists(percorso):
+        return None
+    try:
+        with open(percorso, "rb") as f:
+            dati = pickle.load(f)
+        if dati.get("url") != engine.url.render_as_string(hide_password=True):
+            return None
+        return dati
+    except Exception:
+        return None
+
+# Salva su disco lo schema riflesso e le impronte delle tabelle.
+
+def _scrivi_cache(percorso, meta, impronte):
+    if not percorso:
+        return
+    # file temporaneo con nome univoco: più processi (es. cron) non si sovrascrivono a vicenda
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=os.path.dirname(os.path.abspath(percorso)), prefix=".schema_cache.", delete=False
+        ) as f:
+            tmp = f.name
+            pickle.dump(
+                {
+                    "url": engine.url.render_as_string(hide_password=True),
+                    "impronte": impronte,
+                    "meta": meta,
+                },
+                f,
+            )
+        os.replace(tmp, percorso)
+    except OSError:
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+# Carica le tabelle del database usando la reflection di SQLAlchemy.
+# Di default vengono riflesse solo le tabelle richieste (e quelle a cui puntano
+# le loro FK), usando la cache su disco: si riflettono di nuovo solo le tabelle
+# la cui impronta è cambiata dall'ultimo avvio.
+# Con tabelle=None e cache=False si ottiene il comportamento originale (tutto lo schema).
+# Ritorna un oggetto MetaData con lo schema.
+
+def schema_riflesso(tabelle=TABELLE_RICHIESTE, cache: bool = True):
+    if tabelle is None:
+        meta = MetaData()
+        meta.reflect(bind=engine)
+        return meta
+
+    richieste = set(tabelle)
+    percorso = SCHEMA_CACHE if cache else ""
+
+    with engine.connect() as conn:
+        impronte = impronta_schema(conn, richieste)
+
+        salvato = _leggi_cache(percorso) if impronte is not None else None
+        if salvato is not None:
+            meta = salvato["meta"]
+            vecchie = salvato["impronte"]
+        else:
+            meta = MetaData()
+            vecchie = {}
+
+        # tabelle cambiate, nuove o sparite rispetto alla cache
+        cambiate = [
+            t for t in sorted(richieste)
+            if impronte is None or vecchie.get(t) != impronte.get(t)
+        ]
+        # le tabelle in cache con FK verso una tabella da riflettere puntano ancora
+        # al vecchio oggetto Table: vanno riflesse anche loro (a catena)
+        da_rifare = set(cambiate)
+        aggiunte = True
+        while aggiunte:
+            aggiunte = False
+            for t in list(meta.tables.values()):
+                if t.name not in da_rifare and any(
+                    fk.column.table.name in da_rifare for fk in t.foreign_keys
+                ):
+                    da_rifare.add(t.name)
+                    aggiunte = True
+        for nome in da_rifare:
+            if nome in meta.tables:
+                meta.remove(meta.tables[nome])
+
+        da_riflettere = [
+            t for t in sorted(da_rifare)
+            if impronte is None or t in impronte or t not in richieste
+        ]
+        if da_riflettere:
+            meta.reflect(bind=conn, only=lambda nome, _m: nome in da_riflettere, extend_existing=True)
+
+    if impronte is not None and (cambiate or salvato is None):
+        impronte_salvate = dict(vecchie)
+        impronte_salvate.update(impronte)
+        for nome in cambiate:
+            if nome not in impronte:
+                impronte_salvate.pop(nome, None)
+        _scrivi_cache(percorso, meta, impronte_salvate)
 
-def schema_riflesso():
-    meta = MetaData()
-    meta.reflect(bind=engine)
     return meta
 
+# Misura il tempo di avvio a freddo (cache assente) e a caldo (cache valida).
+# Ritorna un dizionario con i tempi in secondi.
+
+def tempi_avvio(ripetizioni: int = 3) -> dict[str, float]:
+    tempi = {}
+
+    t0 = time.perf_counter()
+    schema_riflesso(tabelle=None)
+    tempi["completo"] = time.perf_counter() - t0
+
+    if SCHEMA_CACHE and os.path.exists(SCHEMA_CACHE):
+        os.remove(SCHEMA_CACHE)
+    t0 = time.perf_counter()
+    schema_riflesso()
+    tempi["freddo"] = time.perf_counter() - t0
+
+    caldi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        schema_riflesso()
+        caldi.append(time.perf_counter() - t0)
+    tempi["caldo"] = min(caldi)
+    return tempi
+
 # Ritorna una tabella dallo schema riflesso.
 # Se la tabella non esiste, mostra un errore e l’elenco di quelle presenti.
 
@@ -28,16 +210,7 @@ def ottieni_tabella(meta: MetaData, name: str):
 # per il corretto funzionamento dell’applicativo.
 
 def controllo_tabelle_richieste(meta: MetaData):
-    required = [
-        "Cliente", "ClientePrivato", "ClienteBusiness",
-        "Dispositivo", "Riparazione", "Appuntamento",
-        "Tecnico", "Intervento",
-        "Ricambio", "Preventivo", "DettaglioPreventivo",
-        "Pagamento", "Fornitore", "Fornitura",
-        "Ordine", "DettaglioOrdine",
-        "DocumentoFiscale", "Garanzia",
-    ]
-    missing = [t for t in required if t not in meta.tables] # Individua esventuali tabelle mancanti
+    missing = [t for t in TABELLE_RICHIESTE if t not in meta.tables] # Individua esventuali tabelle mancanti
     if missing:
         raise RuntimeError(
             "Nel Database mancano le tabelle richieste: "
@@ -45,3 +218,8 @@ def controllo_tabelle_richieste(meta: MetaData):
             + "\nTabelle presenti: "
             + ", ".join(sorted(meta.tables.keys()))
         )
+
+
+if __name__ == "__main__":
+    for fase, secondi in tempi_avvio().items():
+        print(f"avvio {fase}: {secondi * 1000:.1f} ms")
@@ -0,0 +1,95 @@
+# test_chiavi.py
+# -----------------------------------------------------------------------------
+# TEST DELL'ALLOCATORE DI CHIAVI (chiavi.py) CON THREAD CONCORRENTI
+# Più thread inseriscono righe su un DB SQLite temporaneo prendendo gli id
+# dall'allocatore: nessun id deve essere assegnato due volte.
+#
+# Uso: python -m pytest test_chiavi.py
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import os
+import threading
+from sqlalchemy import MetaData, Table, Column, Integer, create_engine, select, func
+from chiavi import AllocatoreChiavi, prova_concorrenza
+
+THREAD = 8
+RIGHE_PER_THREAD = 100
+
+
+# Crea un DB SQLite con una tabella Prova (PK non autoincrement).
+def _database(cartella):
+    eng = create_engine(f"sqlite:///{os.path.join(cartella, 'prova.db')}", connect_args={"timeout": 30})
+    meta = MetaData()
+    tab = Table("Prova", meta, Column("id", Integer, primary_key=True, autoincrement=False))
+    meta.create_all(eng)
+    return eng, tab
+
+# Esegue lavora(n) in THREAD thread e ritorna le eccezioni sollevate.
+def _in_parallelo(lavora) -> list[BaseException]:
+    errori = []
+
+    def esegui(n: int):
+        try:
+            lavora(n)
+        except BaseException as e:
+            errori.append(e)
+
+    lavoratori = [threading.Thread(target=esegui, args=(i,)) for i in range(THREAD)]
+    for t in lavoratori:
+        t.start()
+    for t in lavoratori:
+        t.join()
+    return errori
+
+# Controlla che gli id assegnati siano tutti diversi e tutti presenti nella tabella.
+def _controlla_id(eng, tab, assegnati: list[int]):
+    assert len(assegnati) == THREAD * RIGHE_PER_THREAD
+    duplicati = sorted({i for i in assegnati if assegnati.count(i) > 1})
+    assert not duplicati, f"id assegnati più volte: {duplicati[:10]}"
+    with eng.connect() as c:
+        assert c.execute(select(func.count()).select_from(tab)).scalar_one() == len(assegnati)
+        assert c.execute(select(func.count(func.distinct(tab.c.id)))).scalar_one() == len(assegnati)
+
+
+# Intervalli in memoria condivisi tra i thread (riserva su una connessione propria).
+def test_thread_concorrenti_senza_chiavi_duplicate(tmp_path):
+    eng, tab = _database(tmp_path)
+    alloc = AllocatoreChiavi(eng, blocco=7)
+    assegnati: list[int] = []
+
+    def lavora(n: int):
+        for _ in range(RIGHE_PER_THREAD):
+            nuovo = alloc.prossima(tab, "id")
+            assegnati.append(nuovo)
+            with eng.begin() as c:
+                c.execute(tab.insert().values(id=nuovo))
+
+    assert _in_parallelo(lavora) == []
+    _controlla_id(eng, tab, assegnati)
+    eng.dispose()
+
+# Riserva sulla connessione del chiamante (percorso SQLite del menu).
+def test_thread_concorrenti_sulla_connessione_del_chiamante(tmp_path):
+    eng, tab = _database(tmp_path)
+    alloc = AllocatoreChiavi(eng)
+    assegnati: list[int] = []
+
+    def lavora(n: int):
+        for _ in range(RIGHE_PER_THREAD):
+            with eng.begin() as c:
+                nuovo = alloc.prossima(tab, "id", conn=c)
+                c.execute(tab.insert().values(id=nuovo))
+            assegnati.append(nuovo)
+
+    assert _in_parallelo(lavora) == []
+    _controlla_id(eng, tab, assegnati)
+    eng.dispose()
+
+# La prova di concorrenza conta come collisioni solo le chiavi duplicate.
+def test_prova_concorrenza_allocatore_senza_collisioni():
+    r = prova_concorrenza(thread=4, righe_per_thread=50)["allocatore"]
+    assert r["collisioni"] == 0
+    assert r["errori"] == []
+    assert r["inserite"] == 4 * 50
@@ -0,0 +1,94 @@
+# test_magazzino.py
+# -----------------------------------------------------------------------------
+# TEST DEL REGISTRO DELLE VARIAZIONI DEL MAGAZZINO (magazzino.py)
+# Su un DB SQLite temporaneo popolato da dati_sintetici si installano tabelle e
+# trigger del magazzino, si inseriscono, modificano e cancellano righe di
+# Fornitura, DettaglioOrdine e Ordine, e dopo l'aggiornamento incrementale il
+# riepilogo deve coincidere con il ricalcolo dallo storico.
+#
+# Uso: python -m pytest test_magazzino.py
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import os
+from datetime import date
+from sqlalchemy import create_engine, select, func
+from dati_sintetici import crea_schema, genera
+import magazzino
+
+RIPARAZIONI = 2000
+
+
+# Crea e popola un DB SQLite di prova con il magazzino installato. Ritorna (engine, MetaData).
+def _database(cartella):
+    eng = create_engine(f"sqlite:///{os.path.join(cartella, 'magazzino.db')}")
+    meta = crea_schema(eng)
+    genera(eng, meta, RIPARAZIONI)
+    with eng.begin() as conn:
+        magazzino.installa(conn, meta)
+    return eng, meta
+
+# Prossimo id libero della tabella (PK a una colonna).
+def _prossimo(conn, tabella) -> int:
+    pk = list(tabella.primary_key.columns)[0]
+    return (conn.execute(select(func.max(pk))).scalar() or 0) + 1
+
+
+def test_aggiorna_allinea_il_riepilogo_dopo_insert_update_delete(tmp_path):
+    eng, meta = _database(tmp_path)
+    Fornitura, Ordine, DettaglioOrdine = (meta.tables[t] for t in ("Fornitura", "Ordine", "DettaglioOrdine"))
+
+    with eng.begin() as conn:
+        assert magazzino.verifica(conn, meta) == []
+        id_fornitura, id_ordine = _prossimo(conn, Fornitura), _prossimo(conn, Ordine)
+        # ogni modifica tocca ricambi diversi, così ogni trigger è l'unico a registrarli
+        nuovi = {"fornitura": 40, "spostata": 39, "ordine": 38}
+        usati = set(nuovi.values())
+
+        def prima(stmt, ricambio):
+            riga = conn.execute(stmt.where(ricambio.not_in(usati)).limit(1)).one()
+            usati.add(riga[-1])
+            return riga
+
+        fornitura = prima(select(Fornitura.c.idFornitura, Fornitura.c.idRicambio), Fornitura.c.idRicambio)
+        altra_fornitura = prima(select(Fornitura.c.idFornitura, Fornitura.c.idRicambio), Fornitura.c.idRicambio)
+        dettaglio = prima(select(DettaglioOrdine.c.idOrdine, DettaglioOrdine.c.idRicambio), DettaglioOrdine.c.idRicambio)
+        altro_dettaglio = prima(select(DettaglioOrdine.c.idOrdine, DettaglioOrdine.c.idRicambio),
+                                DettaglioOrdine.c.idRicambio)
+        ordine_modificato = prima(select(DettaglioOrdine.c.idOrdine, DettaglioOrdine.c.idRicambio),
+                                  DettaglioOrdine.c.idRicambio)[0]
+        ordine_cancellato = prima(select(DettaglioOrdine.c.idOrdine, DettaglioOrdine.c.idRicambio),
+                                  DettaglioOrdine.c.idRicambio)[0]
+
+        # Fornitura: insert, update della quantità e del ricambio, delete
+        conn.execute(Fornitura.insert().values(
+            idFornitura=id_fornitura, idFornitore=1, idRicambio=nuovi["fornitura"], quantita=500, data=date(2030, 1, 1),
+        ))
+        conn.execute(Fornitura.update().where(Fornitura.c.idFornitura == fornitura[0])
+                     .values(quantita=Fornitura.c.quantita + 7, idRicambio=nuovi["spostata"]))
+        conn.execute(Fornitura.delete().where(Fornitura.c.idFornitura == altra_fornitura[0]))
+
+        # DettaglioOrdine: insert su un ordine nuovo, update, delete
+        conn.execute(Ordine.insert().values(idOrdine=id_ordine, idFornitore=1, data=date(2030, 2, 1)))
+        conn.execute(DettaglioOrdine.insert().values(idOrdine=id_ordine, idRicambio=nuovi["ordine"], quantita=40))
+        conn.execute(DettaglioOrdine.update()
+                     .where(DettaglioOrdine.c.idOrdine == dettaglio[0], DettaglioOrdine.c.idRicambio == dettaglio[1])
+                     .values(quantita=DettaglioOrdine.c.quantita + 11))
+        conn.execute(DettaglioOrdine.delete().where(
+            DettaglioOrdine.c.idOrdine == altro_dettaglio[0], DettaglioOrdine.c.idRicambio == altro_dettaglio[1],
+        ))
+
+        # Ordine: update della data (cambia ultimoOrdine) e delete. Le righe dell'ordine
+        # cancellato restano: i loro ricambi li registra solo il trigger su Ordine (come
+        # con un ON DELETE CASCADE, che su MySQL non attiva i trigger di DettaglioOrdine)
+        conn.execute(Ordine.update().where(Ordine.c.idOrdine == ordine_modificato).values(data=date(2031, 1, 1)))
+        conn.execute(Ordine.delete().where(Ordine.c.idOrdine == ordine_cancellato))
+
+    with eng.begin() as conn:
+        assert magazzino.verifica(conn, meta) != []
+        esito = magazzino.aggiorna(conn, meta)
+        assert esito["voci"] > 0
+        assert magazzino.verifica(conn, meta) == []
+        assert conn.execute(select(func.count()).select_from(magazzino.VariazioneMagazzino)).scalar_one() == 0
+    eng.dispose()
@@ -0,0 +1,101 @@
+# test_report.py
+# -----------------------------------------------------------------------------
+# TEST DELL'AGGIORNAMENTO INCREMENTALE DEI REPORT (report.py)
+# Su un DB SQLite temporaneo popolato da dati_sintetici si calcolano i report
+# con filigrana, si inseriscono righe con la stessa data dell'ultima filigrana
+# e con date successive, e l'aggiornamento incrementale deve dare lo stesso
+# risultato di un ricalcolo completo.
+#
+# Uso: python -m pytest test_report.py
+# -----------------------------------------------------------------------------
+#
+
+from __future__ import annotations
+import os
+from datetime import timedelta
+import pytest
+from sqlalchemy import create_engine, select, func
+from dati_sintetici import crea_schema, genera
+from report import TempiPerTecnico, RicaviPerMese
+
+RIPARAZIONI = 2000
+
+
+# Crea e popola un DB SQLite di prova. Ritorna (engine, MetaData).
+def _database(cartella):
+    eng = create_engine(f"sqlite:///{os.path.join(cartella, 'report.db')}")
+    meta = crea_schema(eng)
+    genera(eng, meta, RIPARAZIONI)
+    return eng, meta
+
+# Prossimo id libero della tabella (PK a una colonna).
+def _prossimo(conn, tabella) -> int:
+    pk = list(tabella.primary_key.columns)[0]
+    return (conn.execute(select(func.max(pk))).scalar() or 0) + 1
+
+# Confronta due risultati riga per riga, con tolleranza sui valori decimali.
+def _uguali(righe, attese):
+    assert len(righe) == len(attese)
+    for r, a in zip(righe, attese):
+        assert len(r) == len(a)
+        for v, w in zip(r, a):
+            if isinstance(w, (int, str)) or w is None:
+                assert v == w, (r, a)
+            else:
+                assert float(v) == pytest.approx(float(w)), (r, a)
+
+
+# Riparazioni chiuse all'ora dell'ultima filigrana e dopo, con i loro interventi.
+def test_tempi_per_tecnico_incrementale_uguale_al_completo(tmp_path):
+    eng, meta = _database(tmp_path)
+    Riparazione, Intervento = meta.tables["Riparazione"], meta.tables["Intervento"]
+    report = TempiPerTecnico(intervallo=0)
+    with eng.connect() as conn:
+        report.leggi(conn, meta, "completo")
+    filigrana = report.valori_filigrana[0]
+
+    with eng.begin() as conn:
+        id_rip, id_int = _prossimo(conn, Riparazione), _prossimo(conn, Intervento)
+        for i, chiusura in enumerate((filigrana, filigrana, filigrana + timedelta(hours=5))):
+            conn.execute(Riparazione.insert().values(
+                idRiparazione=id_rip + i, idDispositivo=1, stato="Chiusa",
+                dataIngresso=chiusura - timedelta(days=i + 1), dataChiusura=chiusura,
+            ))
+            conn.execute(Intervento.insert().values(
+                idIntervento=id_int + i, idRiparazione=id_rip + i, idTecnico=1 + i % 3,
+            ))
+
+    with eng.connect() as conn:
+        _, righe = report.leggi(conn, meta, "incrementale")
+        _, attese = TempiPerTecnico().leggi(conn, meta, "completo")
+    assert report.ultimo_modo == "incrementale"
+    _uguali(righe, attese)
+    eng.dispose()
+
+# Preventivi e pagamenti alla data dell'ultima filigrana e nei mesi successivi.
+def test_ricavi_per_mese_incrementale_uguale_al_completo(tmp_path):
+    eng, meta = _database(tmp_path)
+    Preventivo, Pagamento = meta.tables["Preventivo"], meta.tables["Pagamento"]
+    report = RicaviPerMese(intervallo=0)
+    with eng.connect() as conn:
+        report.leggi(conn, meta, "completo")
+    data_prev, data_pag = report.valori_filigrana
+
+    with eng.begin() as conn:
+        id_prev, id_pag = _prossimo(conn, Preventivo), _prossimo(conn, Pagamento)
+        for i, giorni in enumerate((0, 0, 40)):
+            conn.execute(Preventivo.insert().values(
+                idPreventivo=id_prev + i, idRiparazione=1, data=data_prev + timedelta(days=giorni),
+                importoTotale=100 + i, accettato=i % 2,
+            ))
+            conn.execute(Pagamento.insert().values(
+                idPagamento=id_pag + i, idRiparazione=1, importo=50 + i,
+                dataPagamento=data_pag + timedelta(days=giorni), metodo="Carta",
+            ))
+
+    with eng.connect() as conn:
+        _, righe = report.leggi(conn, meta, "incrementale")
+        _, attese = RicaviPerMese().leggi(conn, meta, "completo")
+    assert report.ultimo_modo == "incrementale"
+    _uguali(righe, attese)
+    eng.dispose()